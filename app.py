@@ -1,50 +1,53 @@
-import streamlit as st
-import pandas as pd
-import os
-
-# --- 1. 頁面基本設定 ---
-st.set_page_config(page_title="時研-管理系統入口", layout="centered", page_icon="🏢")
-
-# ==========================================
-# 🎨 核心 CSS 魔法：美化登入介面
-# ==========================================
-st.markdown("""
-<style>
-    /* 隱藏左側導覽列 (登入前不給看) */
-    [data-testid="collapsedControl"] { display: none; }
-    [data-testid="stSidebar"] { display: none; }
-    
-    /* 登入卡片美化 */
-    div[data-testid="stVerticalBlock"] > div > div > div[data-testid="stVerticalBlock"] {
-        background-color: rgba(255, 255, 255, 0.95);
-        padding: 30px;
-        border-radius: 12px;
-        box-shadow: 0 8px 24px rgba(0, 0, 0, 0.05);
-        border: 1px solid #e2e8f0;
-    }
-    
-    /* Logo 設定 */
-    .global-logo-container { 
-        width: 100%; text-align: center; margin-bottom: 20px; margin-top: 20px; 
-    }
-    .global-logo-en { 
-        font-size: 42px; font-weight: 500; font-family: "Times New Roman", Times, serif; color: #3E3024; 
-    }
-    .global-logo-tw { 
-        font-size: 24px; font-weight: 900; color: #2C3E50; letter-spacing: 2px; line-height: 1.5;
-    }
-    
-    /* 按鈕美化 */
-    .stButton>button {
-        border-radius: 8px !important;
-        font-weight: bold !important;
-        border: 1px solid #c0c4cc !important;
-        background-color: #ffffff !important;
-        color: #333333 !important; 
-        transition: all 0.2s ease !important;
-        height: 42px !important;
-        margin-top: 10px;
-    }
+import streamlit as st
+import pandas as pd
+import os
+import atomic_io
+import data_cache
+import avatar_store
+
+# --- 1. 頁面基本設定 ---
+st.set_page_config(page_title="時研-管理系統入口", layout="centered", page_icon="🏢")
+
+# ==========================================
+# 🎨 核心 CSS 魔法：美化登入介面
+# ==========================================
+st.markdown("""
+<style>
+    /* 隱藏左側導覽列 (登入前不給看) */
+    [data-testid="collapsedControl"] { display: none; }
+    [data-testid="stSidebar"] { display: none; }
+    
+    /* 登入卡片美化 */
+    div[data-testid="stVerticalBlock"] > div > div > div[data-testid="stVerticalBlock"] {
+        background-color: rgba(255, 255, 255, 0.95);
+        padding: 30px;
+        border-radius: 12px;
+        box-shadow: 0 8px 24px rgba(0, 0, 0, 0.05);
+        border: 1px solid #e2e8f0;
+    }
+    
+    /* Logo 設定 */
+    .global-logo-container { 
+        width: 100%; text-align: center; margin-bottom: 20px; margin-top: 20px; 
+    }
+    .global-logo-en { 
+        font-size: 42px; font-weight: 500; font-family: "Times New Roman", Times, serif; color: #3E3024; 
+    }
+    .global-logo-tw { 
+        font-size: 24px; font-weight: 900; color: #2C3E50; letter-spacing: 2px; line-height: 1.5;
+    }
+    
+    /* 按鈕美化 */
+    .stButton>button {
+        border-radius: 8px !important;
+        font-weight: bold !important;
+        border: 1px solid #c0c4cc !important;
+        background-color: #ffffff !important;
+        color: #333333 !important; 
+        transition: all 0.2s ease !important;
+        height: 42px !important;
+        margin-top: 10px;
+    }
     .stButton>button:hover:not(:disabled) {
         border-color: #3b82f6 !important;
         color: #3b82f6 !important;
@@ -100,16 +103,16 @@ div[data-testid="stVerticalBlock"] > div > div > div[data-testid="stVerticalBloc
 }
 </style>
 """, unsafe_allow_html=True)
-
-# --- 2. 顯示 Logo ---
-st.markdown("""
-    <div class='global-logo-container'>
-        <span class='global-logo-en'>T<span style='color: #C19A6B;'>i</span>me Lab</span><br>
-        <span class='global-logo-tw'>🏢 時研國際設計股份有限公司<br>管理系統入口</span>
-    </div>
-""", unsafe_allow_html=True)
-
-# --- 3. 讀取人員資料庫 ---
+
+# --- 2. 顯示 Logo ---
+st.markdown("""
+    <div class='global-logo-container'>
+        <span class='global-logo-en'>T<span style='color: #C19A6B;'>i</span>me Lab</span><br>
+        <span class='global-logo-tw'>🏢 時研國際設計股份有限公司<br>管理系統入口</span>
+    </div>
+""", unsafe_allow_html=True)
+
+# --- 3. 讀取人員資料庫 ---
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 S_FILE = os.path.join(CURRENT_DIR, "staff_v2.csv")
 TEST_SYSTEM_NAME = "99_測試區-請款單系統"
@@ -119,39 +122,40 @@ def load_staff(filepath=S_FILE, fallback_path=None):
     """Load staff for the selected environment without creating cross-environment writes."""
     source_path = filepath if os.path.exists(filepath) else fallback_path
     if source_path and os.path.exists(source_path):
-        for enc in ['utf-8-sig', 'utf-8', 'cp950', 'big5']:
-            try:
-                df = pd.read_csv(source_path, encoding=enc, dtype=str).fillna("")
-                # 舊版測試區曾用全員 0000 建立 demo_staff.csv；只在這種
-                # 全部仍是佔位密碼的情況下補上正式密碼，且只寫回測試檔。
-                if filepath == TEST_S_FILE and source_path == filepath and fallback_path:
-                    prod_df = pd.read_csv(fallback_path, encoding=enc, dtype=str).fillna("")
-                    if (
-                        "name" in df.columns and "password" in df.columns
-                        and "name" in prod_df.columns and "password" in prod_df.columns
-                        and not df.empty
-                        and df["password"].astype(str).str.strip().eq("0000").all()
-                    ):
-                        password_map = prod_df.set_index("name")["password"].to_dict()
-                        updated_passwords = df["name"].map(password_map).fillna(df["password"])
-                        if not updated_passwords.equals(df["password"]):
-                            df["password"] = updated_passwords
-                            df.to_csv(filepath, index=False, encoding="utf-8-sig")
-                return df
-            except:
-                continue
-    # 預設名單
-    return pd.DataFrame({
-        "name": ["Andy", "Charles", "Eason", "Sunglin", "Anita", "WISH"], 
-        "status": ["在職", "在職", "在職", "在職", "在職", "離職"], 
-        "password": ["0000"]*6
-    })
-
+        # ★ 大頭貼搬到附件儲存區後，名單檔只剩幾 KB，登入頁不再解析 1.5 MB 的 base64
+        avatar_store.migrate_staff_csv(source_path)
+        # ★ 編碼只偵測一次、單次解析；檔案未變動時直接取用快取
+        df = data_cache.read_csv(source_path)
+        if df is not None and len(df.columns) > 0:
+            # 舊版測試區曾用全員 0000 建立 demo_staff.csv；只在這種
+            # 全部仍是佔位密碼的情況下補上正式密碼，且只寫回測試檔。
+            if filepath == TEST_S_FILE and source_path == filepath and fallback_path:
+                prod_df = data_cache.read_csv(fallback_path)
+                if (
+                    prod_df is not None
+                    and "name" in df.columns and "password" in df.columns
+                    and "name" in prod_df.columns and "password" in prod_df.columns
+                    and not df.empty
+                    and df["password"].astype(str).str.strip().eq("0000").all()
+                ):
+                    password_map = prod_df.set_index("name")["password"].to_dict()
+                    updated_passwords = df["name"].map(password_map).fillna(df["password"])
+                    if not updated_passwords.equals(df["password"]):
+                        df["password"] = updated_passwords
+                        atomic_io.write_csv(df, filepath)
+            return df
+    # 預設名單
+    return pd.DataFrame({
+        "name": ["Andy", "Charles", "Eason", "Sunglin", "Anita", "WISH"], 
+        "status": ["在職", "在職", "在職", "在職", "在職", "離職"], 
+        "password": ["0000"]*6
+    })
+
 # 動態抓取 pages 資料夾內的系統選項
 sys_options = []
-pages_dir = os.path.join(CURRENT_DIR, "pages")
-if os.path.exists(pages_dir):
-    sys_options = sorted([f.replace(".py", "") for f in os.listdir(pages_dir) if f.endswith(".py")])
+pages_dir = os.path.join(CURRENT_DIR, "pages")
+if os.path.exists(pages_dir):
+    sys_options = sorted([f.replace(".py", "") for f in os.listdir(pages_dir) if f.endswith(".py")])
 if not sys_options:
     sys_options = ["1_採購單系統", "2_請款單系統"] # 防呆預設
 
@@ -166,49 +170,49 @@ with st.container():
     )
     staff_list = staff_df["name"].tolist() if not staff_df.empty else ["尚無人員資料"]
     selected_user = st.selectbox("身分", staff_list)
-
-    # 檢查是否為離職人員
-    is_resigned = False
-    if not staff_df.empty and selected_user in staff_list:
-        user_row = staff_df[staff_df["name"] == selected_user].iloc[0]
-        if user_row.get("status") == "離職":
-            is_resigned = True
-
-    # ★ 核心需求：離職員工的防呆封鎖畫面
-    if is_resigned:
+
+    # 檢查是否為離職人員
+    is_resigned = False
+    if not staff_df.empty and selected_user in staff_list:
+        user_row = staff_df[staff_df["name"] == selected_user].iloc[0]
+        if user_row.get("status") == "離職":
+            is_resigned = True
+
+    # ★ 核心需求：離職員工的防呆封鎖畫面
+    if is_resigned:
         # 紅字顯示警告，並強制鎖死密碼與進入按鈕
         st.markdown("<p style='color:#E53935; font-size:15px; font-weight:bold; margin-top:-10px; margin-bottom:10px;'>目前已離職，無法登入畫面</p>", unsafe_allow_html=True)
         password = st.text_input("密碼", type="password", disabled=True, placeholder="此帳號已停用")
         st.button("登入系統", disabled=True, use_container_width=True)
-
-    # 正常在職人員登入畫面
-    else:
-        # ★ 完美支援「直接按 Enter 登入」，拋棄不穩定的 st.form，改用底層監聽
-        def process_login():
-            st.session_state.do_login = True
-
+
+    # 正常在職人員登入畫面
+    else:
+        # ★ 完美支援「直接按 Enter 登入」，拋棄不穩定的 st.form，改用底層監聽
+        def process_login():
+            st.session_state.do_login = True
+
         # 只要密碼框輸入完成按下 Enter，就會觸發 on_change 進入 process_login
         password = st.text_input("密碼", type="password", key="login_pw", on_change=process_login)
 
         # 點擊按鈕一樣觸發 process_login
-        btn_clicked = st.button("登入系統", use_container_width=True, on_click=process_login)
-
-        if st.session_state.get('do_login', False):
-            st.session_state.do_login = False # 執行後立即重置狀態
-            pw_val = st.session_state.login_pw
-            
-            if pw_val: # 只有當密碼有輸入時才進行驗證
-                if not staff_df.empty:
-                    user_row = staff_df[staff_df["name"] == selected_user].iloc[0]
-                    if str(user_row["password"]) == str(pw_val):
-                        # 將登入資訊寫入暫存記憶體
-                        st.session_state.user_id = selected_user
-                        st.session_state.user_status = "在職"
-                        st.session_state.sys_choice = st.session_state.sys_choice_val
-                        
-                        # 跳轉到對應頁面
-                        st.switch_page(f"pages/{st.session_state.sys_choice_val}.py")
-                    else:
-                        st.error("❌ 密碼錯誤，請重新輸入。")
-            elif btn_clicked:
-                st.error("❌ 請輸入密碼。")
+        btn_clicked = st.button("登入系統", use_container_width=True, on_click=process_login)
+
+        if st.session_state.get('do_login', False):
+            st.session_state.do_login = False # 執行後立即重置狀態
+            pw_val = st.session_state.login_pw
+            
+            if pw_val: # 只有當密碼有輸入時才進行驗證
+                if not staff_df.empty:
+                    user_row = staff_df[staff_df["name"] == selected_user].iloc[0]
+                    if str(user_row["password"]) == str(pw_val):
+                        # 將登入資訊寫入暫存記憶體
+                        st.session_state.user_id = selected_user
+                        st.session_state.user_status = "在職"
+                        st.session_state.sys_choice = st.session_state.sys_choice_val
+                        
+                        # 跳轉到對應頁面
+                        st.switch_page(f"pages/{st.session_state.sys_choice_val}.py")
+                    else:
+                        st.error("❌ 密碼錯誤，請重新輸入。")
+            elif btn_clicked:
+                st.error("❌ 請輸入密碼。")
@@ -0,0 +1,447 @@
+"""表單附件的內容定址儲存區。
+
+存摺與憑證原本以 base64 直接塞在 `帳戶影像Base64`／`影像Base64` 欄位裡，每讀一次
+表單就得帶上所有照片。這裡把附件依 SHA-256 存成 attachments/ 底下的獨立檔案，
+表單欄位只保留 `att:<sha256>` 代號（多個以 | 分隔）；相同內容只會存一份。
+
+舊資料中的 base64 仍可直接讀取，`migrate_forms` 會把它們一次搬出表單資料庫。
+
+大檔案（Excel 報價、多張憑證）以分段上傳：瀏覽器依續傳代號（token）逐段送出，
+`append_chunk` 寫進 attachments/.staging/<token>.part 並同時累計 SHA-256；連線中斷後
+以同一個代號重新選檔即可從已收到的位置接續。`finish_upload` 收齊後才把暫存檔搬進
+儲存區並回傳附件代號，表單存檔時只引用這個代號。
+
+備份以 zip 匯出（`export_forms_zip`）：表單 CSV 只帶附件代號，附件檔逐一從磁碟串流
+寫入壓縮檔，不必把所有照片轉成 base64 放進記憶體；`restore_forms_zip` 可還原。
+
+直接執行本檔（`python attachment_store.py`）會模擬一次中斷後續傳的上傳，並做一次
+zip 備份與還原。
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from typing import BinaryIO, Iterable, Optional, Union
+
+import pandas as pd
+
+import form_store
+
+REF_PREFIX = "att:"
+ATTACHMENT_COLUMNS = ("帳戶影像Base64", "影像Base64")
+ATTACHMENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "attachments")
+
+BACKUP_FORMS_NAME = "forms.csv"
+BACKUP_ATTACHMENT_DIR = "attachments"
+STAGING_DIRNAME = ".staging"
+STAGING_TTL = 2 * 24 * 3600  # 超過兩天沒有續傳的暫存檔會被清掉
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024  # 與 Streamlit 預設上傳上限相同
+_TOKEN_RE = re.compile(r"^[0-9a-f]{32}$")
+
+_migrate_lock = threading.Lock()
+_migrated_paths: set[str] = set()
+_upload_lock = threading.Lock()
+# token -> (已雜湊的位元組數, sha256 物件)；行程重啟後由暫存檔重新計算
+_hashers: dict[str, tuple[int, "hashlib._Hash"]] = {}
+# token -> (附件代號, 完成時間)；依完成順序排列，超過 STAGING_TTL 或 _MAX_FINISHED 筆時從最舊的開始移除
+_finished: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+_MAX_FINISHED = 1000
+
+
+def is_ref(value: object) -> bool:
+    return isinstance(value, str) and value.startswith(REF_PREFIX)
+
+
+def _digest(value: str) -> str:
+    digest = value[len(REF_PREFIX):]
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+        raise ValueError(f"invalid attachment id: {value!r}")
+    return digest
+
+
+def path_for(ref: str, root: Optional[str] = None) -> str:
+    """Return the on-disk path of *ref* (files are fanned out by the first two hex digits)."""
+    digest = _digest(ref)
+    return os.path.join(root or ATTACHMENT_DIR, digest[:2], digest)
+
+
+def _write(data: bytes, root: Optional[str] = None) -> tuple[str, bool]:
+    ref = REF_PREFIX + hashlib.sha256(data).hexdigest()
+    path = path_for(ref, root)
+    if os.path.exists(path):
+        return ref, False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return ref, True
+
+
+def store_bytes(data: bytes, root: Optional[str] = None) -> str:
+    """Store *data* (once per distinct content) and return its attachment id."""
+    return _write(data, root)[0]
+
+
+def stored_paths(root: Optional[str] = None) -> list[str]:
+    """Return the paths of every stored attachment file."""
+    base = root or ATTACHMENT_DIR
+    paths = []
+    for folder, dirs, names in os.walk(base):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]  # 略過 .staging
+        paths.extend(os.path.join(folder, n) for n in sorted(names) if not n.startswith("."))
+    return paths
+
+
+def _staging_path(token: str, root: Optional[str]) -> str:
+    if not _TOKEN_RE.match(token or ""):
+        raise ValueError(f"invalid upload token: {token!r}")
+    return os.path.join(root or ATTACHMENT_DIR, STAGING_DIRNAME, token + ".part")
+
+
+def _purge_stale_staging(root: Optional[str]) -> None:
+    folder = os.path.join(root or ATTACHMENT_DIR, STAGING_DIRNAME)
+    cutoff = time.time() - STAGING_TTL
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                _hashers.pop(entry.name[:-len(".part")], None)
+        except OSError:
+            pass
+
+
+def _finished_ref(token: str) -> Optional[str]:
+    # 呼叫端持有 _upload_lock；順便清掉過期的完成紀錄，攤銷後 O(1)
+    cutoff = time.time() - STAGING_TTL
+    while _finished and (len(_finished) > _MAX_FINISHED or next(iter(_finished.values()))[1] < cutoff):
+        _finished.popitem(last=False)
+    entry = _finished.get(token)
+    return entry[0] if entry else None
+
+
+def _staged_hasher(token: str, path: str) -> tuple[int, "hashlib._Hash"]:
+    """Return the running hash of a staged file, re-reading it when the process lost track."""
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    cached = _hashers.get(token)
+    if cached and cached[0] == size:
+        return cached
+    h = hashlib.sha256()
+    if size:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+    _hashers[token] = (size, h)
+    return _hashers[token]
+
+
+def begin_upload(token: str, size: int, root: Optional[str] = None) -> int:
+    """Open (or resume) the staged upload *token* of *size* bytes; return the bytes already received."""
+    if size < 0 or size > MAX_UPLOAD_BYTES:
+        raise ValueError(f"upload size {size} exceeds {MAX_UPLOAD_BYTES} bytes")
+    path = _staging_path(token, root)
+    with _upload_lock:
+        if _finished_ref(token):
+            return size
+        if not os.path.exists(path):
+            _purge_stale_staging(root)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            open(path, "ab").close()
+        received = os.path.getsize(path)
+        if received > size:
+            # 同一個代號卻換了檔案：從頭來過
+            open(path, "wb").close()
+            _hashers.pop(token, None)
+            received = 0
+        return received
+
+
+def append_chunk(token: str, offset: int, data: bytes, root: Optional[str] = None) -> int:
+    """Write *data* at *offset* of a staged upload and return the bytes received so far.
+
+    Chunks that were already received are ignored and gaps are refused, so the
+    client can simply resend from the returned offset.
+    """
+    path = _staging_path(token, root)
+    with _upload_lock:
+        if _finished_ref(token) or not os.path.exists(path):
+            return os.path.getsize(path) if os.path.exists(path) else 0
+        received, h = _staged_hasher(token, path)
+        if offset != received or not data:
+            return received
+        with open(path, "ab") as f:
+            f.write(data)
+        h.update(data)
+        _hashers[token] = (received + len(data), h)
+        return received + len(data)
+
+
+def finish_upload(token: str, size: int, root: Optional[str] = None) -> Optional[str]:
+    """Move a fully received upload into the store and return its attachment id.
+
+    Returns None while fewer than *size* bytes have arrived.
+    """
+    path = _staging_path(token, root)
+    with _upload_lock:
+        ref = _finished_ref(token)
+        if ref:
+            return ref
+        if not os.path.exists(path):
+            return None
+        received, h = _staged_hasher(token, path)
+        if received != size:
+            return None
+        ref = REF_PREFIX + h.hexdigest()
+        final = path_for(ref, root)
+        if os.path.exists(final):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            os.replace(path, final)
+        _hashers.pop(token, None)
+        _finished[token] = (ref, time.time())
+        _finished_ref(token)  # 超過上限時移除最舊的紀錄
+        return ref
+
+
+def split_cell(cell: object) -> list[str]:
+    """Split an attachment column value into ids or legacy base64 chunks."""
+    text = "" if cell is None or (not isinstance(cell, str) and pd.isna(cell)) else str(cell).strip()
+    if not text:
+        return []
+    chunks = text.split("|") if "|" in text else text.split(",") if "," in text else [text]
+    parts = []
+    for chunk in chunks:
+        c = chunk.strip()
+        if c.startswith("data:"):
+            c = c.split("base64,")[-1]
+        if c:
+            parts.append(c)
+    return parts
+
+
+def _decode_legacy(chunk: str) -> bytes:
+    return base64.b64decode(chunk + "=" * ((4 - len(chunk) % 4) % 4))
+
+
+def load_bytes(value: str, root: Optional[str] = None) -> Optional[bytes]:
+    """Return the bytes of an attachment id or legacy base64 chunk (None if unavailable)."""
+    try:
+        if is_ref(value):
+            with open(path_for(value, root), "rb") as f:
+                return f.read()
+        return _decode_legacy(value)
+    except (OSError, ValueError, binascii.Error):
+        return None
+
+
+def load_cell(cell: object, root: Optional[str] = None) -> list[bytes]:
+    """Return the bytes of every readable attachment in a column value."""
+    files = []
+    for part in split_cell(cell):
+        raw = load_bytes(part, root)
+        if raw:
+            files.append(raw)
+    return files
+
+
+def cell_to_b64(cell: object, root: Optional[str] = None) -> str:
+    """Return a column value as pipe-joined base64 (for legacy renderers)."""
+    return "|".join(base64.b64encode(raw).decode() for raw in load_cell(cell, root))
+
+
+def _store_parts(cell: object, root: Optional[str], created: list[str]) -> str:
+    refs = []
+    for part in split_cell(cell):
+        if is_ref(part):
+            refs.append(part)
+            continue
+        raw = load_bytes(part, root)
+        if not raw:
+            continue
+        ref, is_new = _write(raw, root)
+        refs.append(ref)
+        if is_new:
+            created.append(path_for(ref, root))
+    return "|".join(refs)
+
+
+def store_cell(cell: object, root: Optional[str] = None) -> str:
+    """Move any inline base64 in a column value into the store and return the id list."""
+    return _store_parts(cell, root, [])
+
+
+def store_files(files: Iterable[bytes], root: Optional[str] = None) -> str:
+    """Store uploaded file contents and return them as a column value."""
+    return "|".join(store_bytes(data, root) for data in files)
+
+
+def migrate_forms(db_path: str, root: Optional[str] = None) -> list[str]:
+    """Move inline attachments out of the form database once per process.
+
+    Returns the paths of attachment files created by the migration.
+    """
+    key = os.path.abspath(db_path)
+    if key in _migrated_paths:
+        return []
+    created: list[str] = []
+    with _migrate_lock:
+        if key not in _migrated_paths:
+            form_store.rewrite_columns(
+                db_path, ATTACHMENT_COLUMNS, lambda cell: _store_parts(cell, root, created), skip_prefix=REF_PREFIX
+            )
+            _migrated_paths.add(key)
+    return created
+
+
+def restore_forms_csv(
+    db_path: str, data: bytes, root: Optional[str] = None, issues: Optional[list] = None
+) -> list[str]:
+    """Replace the forms with a CSV backup and move its attachments into the store."""
+    form_store.import_csv(db_path, data, replace=True, issues=issues)
+    _migrated_paths.discard(os.path.abspath(db_path))
+    return migrate_forms(db_path, root)
+
+
+def export_forms_zip(db_path: str, output: Union[str, BinaryIO], root: Optional[str] = None) -> int:
+    """Write a zip backup (forms CSV with attachment ids + the referenced files) to *output*.
+
+    Attachments are streamed from disk one at a time. Returns the number of attachment files.
+    """
+    df = form_store.load_forms(db_path, form_store.FORM_COLUMNS)
+    refs = dict.fromkeys(
+        part for column in ATTACHMENT_COLUMNS for cell in df[column] for part in split_cell(cell) if is_ref(part)
+    )
+    count = 0
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(BACKUP_FORMS_NAME, "w") as f:
+            with io.TextIOWrapper(f, encoding="utf-8-sig", newline="") as text:
+                df.to_csv(text, index=False)
+        for ref in refs:
+            path = path_for(ref, root)
+            if os.path.exists(path):
+                # 照片與 Excel 本身已壓縮過，直接存入
+                zf.write(path, f"{BACKUP_ATTACHMENT_DIR}/{_digest(ref)}", compress_type=zipfile.ZIP_STORED)
+                count += 1
+    return count
+
+
+def extract_zip_attachments(zf: zipfile.ZipFile, folder: str, root: Optional[str] = None) -> list[str]:
+    """Copy the files under *folder*/ of a backup zip into the store; returns the files created.
+
+    Each member is named by its SHA-256 and verified while it is streamed to disk.
+    """
+    created: list[str] = []
+    for info in zf.infolist():
+        prefix, _, name = info.filename.partition("/")
+        if prefix != folder or not name:
+            continue
+        ref = REF_PREFIX + name
+        path = path_for(ref, root)  # 檔名不是合法雜湊時會拋出 ValueError
+        if os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        h = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as out, zf.open(info) as src:
+                for block in iter(lambda: src.read(1024 * 1024), b""):
+                    h.update(block)
+                    out.write(block)
+            if h.hexdigest() != name:
+                raise ValueError(f"attachment {name} does not match its content")
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        created.append(path)
+    return created
+
+
+def restore_forms_zip(
+    db_path: str, source: Union[str, BinaryIO], root: Optional[str] = None, issues: Optional[list] = None
+) -> list[str]:
+    """Replace the forms with a zip backup; returns the attachment files that were created."""
+    with zipfile.ZipFile(source) as zf:
+        created = extract_zip_attachments(zf, BACKUP_ATTACHMENT_DIR, root)
+        with zf.open(BACKUP_FORMS_NAME) as f:
+            form_store.import_csv(db_path, f, replace=True, issues=issues)
+    _migrated_paths.discard(os.path.abspath(db_path))
+    return created + migrate_forms(db_path, root)
+
+
+def restore_forms_backup(
+    db_path: str, name: str, data: Union[bytes, BinaryIO], root: Optional[str] = None, issues: Optional[list] = None
+) -> list[str]:
+    """Restore a CSV or zip backup chosen by its file name; returns the attachment files created.
+
+    Amounts that could not be parsed (stored as 0) are appended to *issues*.
+    """
+    if name.lower().endswith(".zip"):
+        return restore_forms_zip(db_path, io.BytesIO(data) if isinstance(data, bytes) else data, root, issues)
+    return restore_forms_csv(db_path, data if isinstance(data, bytes) else data.read(), root, issues)
+
+
+def _self_check() -> None:
+    """Upload a file in chunks, drop the connection half-way, resume with a fresh process state."""
+    import secrets
+
+    data = os.urandom(3 * 256 * 1024 + 123)
+    chunk = 256 * 1024
+    with tempfile.TemporaryDirectory() as root:
+        token = secrets.token_hex(16)
+        offset = begin_upload(token, len(data), root)
+        while offset < len(data) // 2:
+            offset = append_chunk(token, offset, data[offset:offset + chunk], root)
+        # 重送已收到的段落、跳號的段落都不會改變已收到的位置
+        assert append_chunk(token, 0, data[:chunk], root) == offset
+        assert append_chunk(token, offset + 1, data[offset + 1:offset + 2], root) == offset
+        # 模擬行程重啟：遺失記憶體中的雜湊狀態後續傳
+        _hashers.clear()
+        assert finish_upload(token, len(data), root) is None
+        offset = begin_upload(token, len(data), root)
+        while offset < len(data):
+            offset = append_chunk(token, offset, data[offset:offset + chunk], root)
+        ref = finish_upload(token, len(data), root)
+        assert ref == REF_PREFIX + hashlib.sha256(data).hexdigest(), ref
+        assert load_bytes(ref, root) == data
+        assert finish_upload(token, len(data), root) == ref
+        assert stored_paths(root) == [path_for(ref, root)]
+        print(f"ok: {len(data)} bytes uploaded in {chunk // 1024} KB chunks, resumed once, stored as {ref[:16]}…")
+
+        # zip 備份：表單只帶代號，附件另外存入；還原到另一個儲存區後內容相同
+        db = os.path.join(root, "forms.db")
+        form_store.insert_form(db, {"單號": "R001", "影像Base64": ref, "帳戶影像Base64": ""})
+        backup = os.path.join(root, "backup.zip")
+        assert export_forms_zip(db, backup, root) == 1
+        other = os.path.join(root, "restored")
+        restored_db = os.path.join(other, "forms.db")
+        os.makedirs(other)
+        created = restore_forms_backup(restored_db, "backup.zip", open(backup, "rb").read(), other)
+        assert created == [path_for(ref, other)] and load_bytes(ref, other) == data
+        assert form_store.get_form(restored_db, "R001")["影像Base64"] == ref
+        print(f"ok: zip backup of 1 form + 1 attachment ({os.path.getsize(backup)} bytes) restored")
+
+
+if __name__ == "__main__":
+    _self_check()
@@ -0,0 +1,213 @@
+"""人員大頭貼與人員名單分開存放。
+
+staff_v2.csv 原本把大頭貼以 base64 直接放在 `avatar` 欄，檔案約 1.5 MB，登入頁每次
+重跑都得整份解析，各頁面還把整份名單留在 session_state 裡。這裡把大頭貼縮成小圖後
+存進附件儲存區（attachments/，依內容 SHA-256 去重），名單只保留 `att:<sha256>`
+代號；側邊欄需要顯示時才讀取目前使用者的那一張。
+
+舊名單中的 base64 由 `migrate_staff_csv` 在第一次讀取時搬出並改寫名單檔。
+名單本身不再含圖片，所以備份改為 zip（名單 CSV＋大頭貼檔案，`export_staff_zip`）；
+還原（`restore_staff_backup`）後會重新搬移一次，舊的內嵌 base64 CSV 備份也能還原。
+
+側邊欄不再把圖片以 data URI 塞進每一次重跑的頁面：`avatar_url` 會把 120px 的
+WebP（不支援時用 JPEG）縮圖發佈到 static/avatars/<sha256>.<副檔名>，透過 Streamlit
+的靜態檔服務（.streamlit/config.toml 的 enableStaticServing）以固定網址提供，
+檔名即內容雜湊，瀏覽器快取後每次重跑只多傳一個網址。
+"""
+
+from __future__ import annotations
+
+import base64
+import io
+import os
+import threading
+import zipfile
+from functools import lru_cache
+from typing import BinaryIO, Optional, Union
+
+import atomic_io
+import attachment_store
+import data_cache
+
+AVATAR_COLUMN = "avatar"
+THUMBNAIL_SIZE = 160
+SIDEBAR_SIZE = 120  # 側邊欄 60px 圓框的兩倍，高解析螢幕也清楚
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "avatars")
+STATIC_URL = "app/static/avatars"
+BACKUP_STAFF_NAME = "staff.csv"
+BACKUP_AVATAR_DIR = "avatars"
+_EXTENSIONS = {"image/webp": "webp", "image/jpeg": "jpg", "image/png": "png", "image/gif": "gif"}
+
+_migrate_lock = threading.Lock()
+_migrated: dict[str, list[str]] = {}
+
+
+def thumbnail(data: bytes, size: int = THUMBNAIL_SIZE, image_format: str = "JPEG") -> bytes:
+    """Shrink a picture to at most *size* px as *image_format* (unchanged when Pillow is unavailable).
+
+    Falls back to JPEG when the Pillow build cannot write *image_format* (e.g. WebP).
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            if max(img.size) <= size and len(data) <= 64 * 1024:
+                return data
+            img.thumbnail((size, size))
+            img = img.convert("RGB")
+            for fmt in dict.fromkeys((image_format, "JPEG")):
+                out = io.BytesIO()
+                try:
+                    img.save(out, format=fmt, quality=85)
+                except (KeyError, OSError):
+                    continue
+                return out.getvalue()
+    except Exception:
+        pass
+    # 不是可辨識的圖片就原樣保存，交給瀏覽器處理
+    return data
+
+
+def store_avatar(data: bytes, root: Optional[str] = None) -> str:
+    """Store an uploaded avatar as a thumbnail and return its attachment id."""
+    return attachment_store.store_bytes(thumbnail(data), root)
+
+
+def _mime(raw: bytes) -> str:
+    if raw.startswith(b"\x89PNG"):
+        return "image/png"
+    if raw[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if raw[:4] == b"RIFF" and raw[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+@lru_cache(maxsize=128)
+def _data_uri(ref: str, root: Optional[str]) -> str:
+    raw = attachment_store.load_bytes(ref, root)
+    return f"data:{_mime(raw)};base64,{base64.b64encode(raw).decode()}" if raw else ""
+
+
+def data_uri(cell: object, root: Optional[str] = None) -> str:
+    """Return an ``<img src>`` for a staff avatar cell ('' when there is none)."""
+    text = "" if cell is None else str(cell).strip()
+    if not text or text == "nan":
+        return ""
+    if attachment_store.is_ref(text):
+        # 代號對應的內容不會變，可直接快取
+        return _data_uri(text, root)
+    return f"data:image/jpeg;base64,{text}"
+
+
+@lru_cache(maxsize=256)
+def _published_url(ref: str, root: Optional[str]) -> str:
+    digest = ref[len(attachment_store.REF_PREFIX):]
+    for ext in _EXTENSIONS.values():
+        if os.path.exists(os.path.join(STATIC_DIR, f"{digest}.{ext}")):
+            return f"{STATIC_URL}/{digest}.{ext}"
+    raw = attachment_store.load_bytes(ref, root)
+    if not raw:
+        return ""
+    small = thumbnail(raw, SIDEBAR_SIZE, "WEBP")
+    name = f"{digest}.{_EXTENSIONS[_mime(small)]}"
+    try:
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        atomic_io.write_bytes(os.path.join(STATIC_DIR, name), small, lock=False)
+    except OSError:
+        return _data_uri(ref, root)
+    return f"{STATIC_URL}/{name}"
+
+
+def avatar_url(cell: object, root: Optional[str] = None) -> str:
+    """Return a stable, browser-cacheable ``<img src>`` for a staff avatar cell ('' when there is none).
+
+    Legacy inline base64 cells fall back to a data URI.
+    """
+    text = "" if cell is None else str(cell).strip()
+    if attachment_store.is_ref(text):
+        try:
+            return _published_url(text, root)
+        except ValueError:
+            return ""
+    return data_uri(text, root)
+
+
+def migrate_staff_csv(path: str, root: Optional[str] = None) -> list[str]:
+    """Move inline base64 avatars of a staff CSV into the attachment store once per process.
+
+    Returns the avatar files created for *path* in this process (for backups).
+    """
+    key = os.path.abspath(path)
+    if key in _migrated:
+        return _migrated[key]
+    with _migrate_lock:
+        if key in _migrated:
+            return _migrated[key]
+        created: list[str] = []
+        if os.path.exists(path):
+            with atomic_io.file_lock(path):
+                df = data_cache.read_csv_file(path)
+                if df is not None and AVATAR_COLUMN in df.columns:
+                    inline = df[AVATAR_COLUMN].map(lambda c: bool(c) and not attachment_store.is_ref(c))
+                    for idx in df.index[inline]:
+                        raw = attachment_store.load_bytes(df.at[idx, AVATAR_COLUMN])
+                        if not raw:
+                            continue
+                        ref = store_avatar(raw, root)
+                        df.at[idx, AVATAR_COLUMN] = ref
+                        created.append(attachment_store.path_for(ref, root))
+                    if created:
+                        atomic_io.write_csv(df, path)
+                        data_cache.invalidate(path)
+        _migrated[key] = created
+    return created
+
+
+def export_staff_zip(path: str, output: Union[str, BinaryIO], root: Optional[str] = None) -> int:
+    """Write a zip backup (staff CSV with avatar ids + the avatar files) to *output*.
+
+    Returns the number of avatar files.
+    """
+    migrate_staff_csv(path, root)
+    with open(path, "rb") as f:
+        raw = f.read()
+    df = data_cache.read_csv_file(path)
+    refs = [] if df is None or AVATAR_COLUMN not in df.columns else list(dict.fromkeys(
+        c for c in df[AVATAR_COLUMN] if attachment_store.is_ref(c)
+    ))
+    count = 0
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(BACKUP_STAFF_NAME, raw)
+        for ref in refs:
+            try:
+                file_path = attachment_store.path_for(ref, root)
+            except ValueError:
+                continue
+            if os.path.exists(file_path):
+                zf.write(file_path, f"{BACKUP_AVATAR_DIR}/{ref[len(attachment_store.REF_PREFIX):]}", compress_type=zipfile.ZIP_STORED)
+                count += 1
+    return count
+
+
+def restore_staff_backup(
+    path: str, name: str, data: Union[bytes, BinaryIO], root: Optional[str] = None
+) -> list[str]:
+    """Replace the staff CSV with a zip or CSV backup; returns the avatar files created.
+
+    Inline base64 avatars of an old CSV backup are moved into the store again.
+    """
+    data = data if isinstance(data, bytes) else data.read()
+    created: list[str] = []
+    if name.lower().endswith(".zip"):
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            created = attachment_store.extract_zip_attachments(zf, BACKUP_AVATAR_DIR, root)
+            data = zf.read(BACKUP_STAFF_NAME)
+    atomic_io.write_bytes(path, data)
+    data_cache.invalidate(path)
+    with _migrate_lock:
+        _migrated.pop(os.path.abspath(path), None)
+    return created + migrate_staff_csv(path, root)
@@ -0,0 +1,106 @@
+"""可續傳的分段附件上傳元件。
+
+`st.file_uploader` 會把整個檔案一次送上來，再經過 `getvalue()`、base64 與存檔，整份
+內容在記憶體裡出現好幾次；手機網路一斷就得從頭再傳。這個元件在瀏覽器端把檔案切段，
+每段連同續傳代號送回伺服器，由 `attachment_store.append_chunk` 寫進暫存區並累計
+雜湊；收齊後才轉成附件代號。續傳代號存在瀏覽器的 localStorage，連線中斷後重新選
+同一個檔案即可從已收到的位置接續。
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import os
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+import attachment_store
+
+CHUNK_SIZE = 512 * 1024  # 手機網路下一段約 1～2 秒，斷線時最多重傳這麼多
+DEFAULT_TYPES = ("png", "jpg", "jpeg", "xlsx", "xls")
+
+_COMPONENT = components.declare_component(
+    "timelab_chunked_upload",
+    path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "chunked_upload_component"),
+)
+
+
+@dataclass
+class StagedUpload:
+    """A finished upload that already lives in the attachment store."""
+
+    name: str
+    mime_type: str
+    size: int
+    ref: str
+
+
+def _chunk_id(value: object) -> Optional[tuple]:
+    chunk = value.get("chunk") if isinstance(value, dict) else None
+    return (chunk.get("token"), chunk.get("offset"), value.get("seq")) if chunk else None
+
+
+def _process(value: object, root: Optional[str], applied: Optional[tuple] = None) -> tuple[dict, list[StagedUpload]]:
+    """Apply the chunk carried by a component value; return (progress per token, finished uploads).
+
+    A chunk whose id equals *applied* was already written and is not decoded again.
+    """
+    if not isinstance(value, dict):
+        return {}, []
+    chunk = value.get("chunk") or {}
+    if applied is not None and _chunk_id(value) == applied:
+        chunk = {}
+    progress: dict = {}
+    uploads: list[StagedUpload] = []
+    for meta in value.get("files") or []:
+        token, name, size = str(meta.get("token", "")), str(meta.get("name") or "upload"), int(meta.get("size") or 0)
+        try:
+            received = attachment_store.begin_upload(token, size, root)
+            if chunk.get("token") == token:
+                data = base64.b64decode(chunk.get("data") or "")
+                received = attachment_store.append_chunk(token, int(chunk.get("offset", -1)), data, root)
+            ref = attachment_store.finish_upload(token, size, root) if received >= size else None
+        except (ValueError, OSError, binascii.Error) as e:
+            progress[token] = {"name": name, "offset": 0, "ref": "", "error": str(e)}
+            continue
+        progress[token] = {"name": name, "offset": received, "ref": ref or "", "error": ""}
+        if ref:
+            uploads.append(StagedUpload(name, str(meta.get("type") or ""), size, ref))
+    return progress, uploads
+
+
+def chunked_file_uploader(
+    label: str,
+    key: str,
+    types: Sequence[str] = DEFAULT_TYPES,
+    multiple: bool = False,
+    chunk_size: int = CHUNK_SIZE,
+    root: Optional[str] = None,
+):
+    """Resumable uploader; returns the finished StagedUpload (a list when *multiple*).
+
+    Files still being transferred are not returned, so a form saved mid-upload
+    only references attachments that are complete.
+    """
+    # 先處理這次重跑帶來的分段，讓元件拿到最新進度後立刻送下一段；
+    # 已寫入的分段記下代號，之後頁面因其他元件重跑時不再解碼同一段 base64
+    applied_key = f"{key}__applied_chunk"
+    before = st.session_state.get(key)
+    progress, uploads = _process(before, root, st.session_state.get(applied_key))
+    st.session_state[applied_key] = _chunk_id(before)
+    value = _COMPONENT(
+        label=label, key=key, default=None, multiple=bool(multiple), chunk_size=int(chunk_size),
+        accept=",".join("." + t.lstrip(".") for t in types), progress=progress,
+    )
+    if value != before:
+        latest, uploads = _process(value, root, st.session_state.get(applied_key))
+        st.session_state[applied_key] = _chunk_id(value)
+        if latest != progress:
+            st.rerun()
+    if multiple:
+        return uploads
+    return uploads[0] if uploads else None
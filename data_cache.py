@@ -0,0 +1,133 @@
+"""以檔案修改時間為鍵的共用資料快取。
+
+Streamlit 每次互動都會重跑整頁，表單、人員、專案與廠商資料因此在同一次重跑中被
+解析好幾次。這裡依「檔案路徑＋修改時間＋檔案大小」快取解析結果，同一台伺服器上
+所有使用者共用；檔案一有變動（或存檔函式呼叫 `invalidate`）就會重新讀取。
+
+取出的 DataFrame 一律是副本，呼叫端可以放心就地修改，不會汙染快取。
+
+CSV 的編碼只從檔頭取樣偵測一次（BOM → UTF-8 → cp950 → big5）並依檔案簽章記住，
+不再用四種編碼各完整解析一遍；舊編碼的檔案在下一次存檔時會改寫成 UTF-8。
+"""
+
+from __future__ import annotations
+
+import codecs
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+import pandas as pd
+
+MAX_ENTRIES = 64
+CSV_ENCODINGS = ("utf-8-sig", "utf-8", "cp950", "big5")
+SNIFF_BYTES = 64 * 1024
+
+_lock = threading.Lock()
+_entries: "OrderedDict[tuple, tuple[tuple[int, int], pd.DataFrame]]" = OrderedDict()
+_encodings: dict[str, tuple[tuple[int, int], str]] = {}
+
+
+def _signature(path: str) -> Optional[tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def load(path: str, loader: Callable[[], pd.DataFrame], key: Hashable = None) -> pd.DataFrame:
+    """Return ``loader()`` for *path*, re-running it only when the file changed.
+
+    *key* distinguishes different views of the same file (e.g. projected form
+    queries). Missing files are never cached.
+    """
+    cache_key = (os.path.abspath(path), key)
+    signature = _signature(path)
+    if signature is not None:
+        with _lock:
+            entry = _entries.get(cache_key)
+            if entry is not None and entry[0] == signature:
+                _entries.move_to_end(cache_key)
+                return entry[1].copy()
+    df = loader()
+    # 以讀取前的檔案狀態為準：讀取期間若檔案被改寫，下一次會因簽章不同而重讀
+    if signature is not None and isinstance(df, pd.DataFrame):
+        with _lock:
+            _entries[cache_key] = (signature, df.copy())
+            _entries.move_to_end(cache_key)
+            while len(_entries) > MAX_ENTRIES:
+                _entries.popitem(last=False)
+    return df
+
+
+def invalidate(path: str) -> None:
+    """Drop every cached view of *path* (call after writing the file)."""
+    target = os.path.abspath(path)
+    with _lock:
+        for cache_key in [k for k in _entries if k[0] == target]:
+            del _entries[cache_key]
+
+
+def detect_encoding(head: bytes, truncated: bool = False) -> str:
+    """Guess the encoding of a CSV from its first bytes.
+
+    With *truncated* a multi-byte character cut off at the end of the sample is
+    not held against an encoding.
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    for enc in CSV_ENCODINGS[1:]:
+        try:
+            head.decode(enc)
+            return enc
+        except UnicodeDecodeError as e:
+            if truncated and e.end >= len(head) and e.start >= len(head) - 3:
+                return enc
+    return "utf-8"
+
+
+def sniff_encoding(path: str) -> str:
+    """Return the encoding of *path*, sniffing it only when the file changed."""
+    key = os.path.abspath(path)
+    signature = _signature(path)
+    with _lock:
+        known = _encodings.get(key)
+    if known is not None and known[0] == signature:
+        return known[1]
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES)
+    enc = detect_encoding(head, truncated=len(head) == SNIFF_BYTES)
+    if signature is not None:
+        with _lock:
+            _encodings[key] = (signature, enc)
+    return enc
+
+
+def read_csv_file(path: str) -> Optional[pd.DataFrame]:
+    """Parse *path* as strings in one pass using its sniffed encoding (None when missing)."""
+    if not os.path.exists(path):
+        return None
+    enc = sniff_encoding(path)
+    # 取樣判斷錯誤時（例如 64KB 之後才出現非 UTF-8 字元）才改試其他編碼
+    for candidate in (enc,) + tuple(e for e in CSV_ENCODINGS if e != enc):
+        try:
+            df = pd.read_csv(path, encoding=candidate, dtype=str).fillna("")
+        except UnicodeDecodeError:
+            continue
+        except Exception:
+            return pd.DataFrame()
+        if candidate != enc:
+            signature = _signature(path)
+            with _lock:
+                _encodings[os.path.abspath(path)] = (signature, candidate)
+        return df
+    return pd.DataFrame()
+
+
+def read_csv(path: str) -> Optional[pd.DataFrame]:
+    """Cached equivalent of the pages' read_csv_robust (None when the file is missing)."""
+    if not os.path.exists(path):
+        return None
+    return load(path, lambda: read_csv_file(path), "csv")
@@ -0,0 +1,212 @@
+"""Excel 附件預覽快取。
+
+預覽、簽核視窗與列印原本每次都把整份 xlsx/xls 附件交給 `pd.read_excel` 重新解析，
+列印一張表單就要把所有試算表再讀一遍。這裡依附件內容的 SHA-256 快取：
+
+- 前 `SNAPSHOT_ROWS` 列的 DataFrame 快照（只讀第一個工作表的前幾列，大檔不必整本載入）
+- 由快照預先產生、可直接嵌入列印頁的 HTML 表格
+
+快取存在 attachments/.previews/（同一份內容只解析一次，重啟後仍有效），行程內另有
+小型記憶體快取。上傳時可呼叫 `warm` 先產生；畫面預覽以 `PAGE_ROWS` 列分頁，超出
+快照範圍的頁面才另外讀取。
+
+直接執行本檔（`python excel_preview.py`）會以一份大型活頁簿做自我檢查。
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import pandas as pd
+
+import atomic_io
+import attachment_store
+
+PAGE_ROWS = 100
+SNAPSHOT_ROWS = 1000
+CACHE_VERSION = 1
+PREVIEW_DIRNAME = ".previews"
+_MEMORY_ITEMS = 64
+_EXCEL_MAGIC = (b"PK\x03\x04", b"\xd0\xcf\x11\xe0")
+
+TABLE_CSS = (
+    "<style>.xls-tbl { width: 100%; border-collapse: collapse; font-size: 11px; table-layout: fixed; }"
+    " .xls-tbl th, .xls-tbl td { border: 1px solid #000; padding: 4px; word-wrap: break-word; overflow-wrap: break-word;"
+    " white-space: normal; word-break: break-all; } .xls-tbl th { background-color: #f0f0f0; }"
+    " .xls-tbl tr { page-break-inside: avoid !important; }</style>"
+)
+
+
+@dataclass
+class Snapshot:
+    frame: pd.DataFrame
+    truncated: bool
+    html: str
+
+
+@dataclass
+class PreviewPage:
+    frame: pd.DataFrame
+    start: int
+    has_more: bool
+
+
+_lock = threading.Lock()
+_memory: "OrderedDict[tuple, object]" = OrderedDict()
+
+
+def is_excel(raw: bytes) -> bool:
+    return raw.startswith(_EXCEL_MAGIC)
+
+
+def _remember(key: tuple, value: object) -> object:
+    with _lock:
+        _memory[key] = value
+        _memory.move_to_end(key)
+        while len(_memory) > _MEMORY_ITEMS:
+            _memory.popitem(last=False)
+    return value
+
+
+def _recall(key: tuple) -> Optional[object]:
+    with _lock:
+        value = _memory.get(key)
+        if value is not None:
+            _memory.move_to_end(key)
+        return value
+
+
+def _cache_paths(digest: str, root: Optional[str]) -> tuple[str, str]:
+    folder = os.path.join(root or attachment_store.ATTACHMENT_DIR, PREVIEW_DIRNAME, digest[:2])
+    base = os.path.join(folder, f"{digest}-v{CACHE_VERSION}")
+    return base + ".pkl", base + ".html"
+
+
+def _render_html(frame: pd.DataFrame, truncated: bool) -> str:
+    html = frame.to_html(index=False).replace("\n", "")
+    html = html.replace("<table", f'{TABLE_CSS}<table class="xls-tbl"', 1)
+    if truncated:
+        html += f"<div style='font-size:11px;color:#666;'>（僅列出前 {SNAPSHOT_ROWS} 列，完整內容請開啟原始檔案）</div>"
+    return html
+
+
+def _build(raw: bytes) -> Snapshot:
+    # 多讀一列用來判斷是否還有後續資料
+    frame = pd.read_excel(io.BytesIO(raw), nrows=SNAPSHOT_ROWS + 1)
+    truncated = len(frame) > SNAPSHOT_ROWS
+    frame = frame.iloc[:SNAPSHOT_ROWS]
+    return Snapshot(frame, truncated, _render_html(frame, truncated))
+
+
+def _snapshot(raw: bytes, digest: str, root: Optional[str]) -> Snapshot:
+    cached = _recall(("snapshot", digest))
+    if cached is not None:
+        return cached
+    pkl_path, html_path = _cache_paths(digest, root)
+    try:
+        with open(pkl_path, "rb") as f:
+            frame, truncated = pickle.load(f)
+        with open(html_path, encoding="utf-8") as f:
+            return _remember(("snapshot", digest), Snapshot(frame, truncated, f.read()))
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        pass
+    snap = _build(raw)
+    try:
+        os.makedirs(os.path.dirname(pkl_path), exist_ok=True)
+        # 內容定址，同時寫入的行程寫的是相同內容，不需要鎖
+        atomic_io.write_bytes(pkl_path, pickle.dumps((snap.frame, snap.truncated)), lock=False)
+        atomic_io.write_bytes(html_path, snap.html.encode("utf-8"), lock=False)
+    except OSError:
+        pass  # 無法寫入快取時仍回傳結果，下次再解析
+    return _remember(("snapshot", digest), snap)
+
+
+def snapshot(raw: bytes, root: Optional[str] = None) -> Snapshot:
+    """Return the cached row-limited snapshot of an Excel attachment (parsed on first use)."""
+    return _snapshot(raw, hashlib.sha256(raw).hexdigest(), root)
+
+
+def print_html(raw: bytes, root: Optional[str] = None) -> str:
+    """Return the pre-rendered HTML table of an Excel attachment for printing."""
+    return snapshot(raw, root).html
+
+
+def preview(raw: bytes, page: int = 0, root: Optional[str] = None) -> PreviewPage:
+    """Return one page of ``PAGE_ROWS`` rows; pages past the snapshot are read on demand."""
+    digest = hashlib.sha256(raw).hexdigest()
+    snap = _snapshot(raw, digest, root)
+    page = max(0, int(page))
+    start = page * PAGE_ROWS
+    end = start + PAGE_ROWS
+    if end <= len(snap.frame) or not snap.truncated:
+        has_more = end < len(snap.frame) or snap.truncated
+        return PreviewPage(snap.frame.iloc[start:end], start, has_more)
+    cached = _recall(("page", digest, page))
+    if cached is not None:
+        return cached
+    frame = pd.read_excel(io.BytesIO(raw), skiprows=range(1, start + 1), nrows=PAGE_ROWS + 1)
+    return _remember(("page", digest, page), PreviewPage(frame.iloc[:PAGE_ROWS], start, len(frame) > PAGE_ROWS))
+
+
+def warm(ref: str, root: Optional[str] = None) -> None:
+    """Build the preview cache of a freshly stored attachment if it is a spreadsheet."""
+    try:
+        with open(attachment_store.path_for(ref, root), "rb") as f:
+            if not is_excel(f.read(8)):
+                return
+        raw = attachment_store.load_bytes(ref, root)
+        if raw:
+            # 雜湊就是附件代號本身，不必重算
+            _snapshot(raw, ref[len(attachment_store.REF_PREFIX):], root)
+    except Exception:
+        pass  # 預覽快取只是加速，失敗時第一次開啟再解析
+
+
+def _self_check() -> None:
+    """Cache a 5,000-row workbook, then check paging, the on-disk cache and the parse savings."""
+    import tempfile
+    import time
+
+    rows = 5000
+    df = pd.DataFrame({"品項": [f"項目{i}" for i in range(rows)], "數量": range(rows), "單價": [i * 1.5 for i in range(rows)]})
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False)
+    raw = buf.getvalue()
+    with tempfile.TemporaryDirectory() as root:
+        ref = attachment_store.store_bytes(raw, root)
+        started = time.perf_counter()
+        full = pd.read_excel(io.BytesIO(raw))
+        full_ms = (time.perf_counter() - started) * 1000
+        assert len(full) == rows
+
+        started = time.perf_counter()
+        warm(ref, root)
+        warm_ms = (time.perf_counter() - started) * 1000
+        _memory.clear()  # 模擬另一個行程：只剩磁碟快取
+        started = time.perf_counter()
+        snap = snapshot(raw, root)
+        hit_ms = (time.perf_counter() - started) * 1000
+        assert len(snap.frame) == SNAPSHOT_ROWS and snap.truncated and 'class="xls-tbl"' in snap.html
+
+        first = preview(raw, 0, root)
+        assert first.start == 0 and len(first.frame) == PAGE_ROWS and first.has_more
+        assert first.frame["數量"].tolist() == list(range(PAGE_ROWS))
+        deep = preview(raw, 12, root)  # 超出快照範圍，另外讀取
+        assert deep.frame["數量"].iloc[0] == 12 * PAGE_ROWS and deep.has_more
+        last = preview(raw, rows // PAGE_ROWS - 1, root)
+        assert len(last.frame) == PAGE_ROWS and not last.has_more
+        print(
+            f"ok: full parse {full_ms:.0f} ms, first snapshot {warm_ms:.0f} ms, "
+            f"cached snapshot {hit_ms:.1f} ms, paging past the snapshot works"
+        )
+
+
+if __name__ == "__main__":
+    _self_check()
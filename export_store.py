@@ -0,0 +1,68 @@
+"""短期匯出檔。
+
+支出報表與備份原本把整個檔案的位元組留在 `st.session_state`，每個管理員工作階段都
+各自佔著一份，重跑頁面時也一直留在記憶體裡。這裡改為把匯出內容寫到 .exports/ 底下
+的暫存檔，工作階段只保存一個小小的 `ExportHandle`；下載時才開檔交給
+`st.download_button`。超過 `EXPORT_TTL` 的匯出檔會在下一次建立匯出時清掉。
+"""
+
+from __future__ import annotations
+
+import os
+import secrets
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".exports")
+EXPORT_TTL = 3600
+
+
+@dataclass(frozen=True)
+class ExportHandle:
+    token: str
+    name: str
+    mime: str
+
+
+def _purge(now: float) -> None:
+    try:
+        entries = list(os.scandir(EXPORT_DIR))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < now - EXPORT_TTL:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def create(name: str, mime: str = "application/octet-stream") -> tuple[ExportHandle, str]:
+    """Reserve a new export file; returns (handle, path to write to)."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    _purge(time.time())
+    handle = ExportHandle(secrets.token_hex(16), name, mime)
+    return handle, os.path.join(EXPORT_DIR, handle.token)
+
+
+def path_of(handle: Optional[ExportHandle]) -> Optional[str]:
+    """Return the file of *handle*, or None once it expired or was discarded."""
+    if not isinstance(handle, ExportHandle):
+        return None
+    path = os.path.join(EXPORT_DIR, handle.token)
+    return path if os.path.exists(path) else None
+
+
+def open_export(handle: Optional[ExportHandle]) -> Optional[BinaryIO]:
+    path = path_of(handle)
+    return open(path, "rb") if path else None
+
+
+def discard(handle: Optional[ExportHandle]) -> None:
+    path = path_of(handle)
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,192 @@
+"""批次轉單：採購單轉請款單、報價單轉採購單。
+
+轉單畫面原本逐列處理勾選的單據：在整張表裡找來源單、重算已請款／尚未請款金額、
+掃描整張表計算新單號、再把一列 DataFrame `pd.concat` 回去，一次轉幾十張就變成
+平方級的工作量，而且讀取與寫入之間若有人同時轉同一張單，餘額會被重複扣除。
+
+這裡把一批 (來源單號, 金額) 一次處理：
+
+- 只讀取被勾選的來源單，整批比對可轉餘額（同一張來源單出現多次時依序分配，
+  超過剩餘餘額而不轉的列不佔用餘額）
+- 通過的列依單號前綴一次配發一段單號
+- 來源單的請款金額與所有新單在同一個交易內寫入，並比對來源單版本；期間若被別人
+  修改，整批不寫入並回報衝突
+- 回傳逐列的結果，畫面可以直接列出成功與失敗原因
+
+轉換規則（可轉餘額怎麼算、新單長什麼樣子）由 `ConversionRule` 描述，
+採購單轉請款單與報價單轉採購單共用同一套流程。
+
+直接執行本檔（`python form_conversion.py`）會以暫存資料庫做自我檢查。
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+import pandas as pd
+
+import form_store
+import frame_clean
+
+# 逐列結果：成功、查無來源單、金額不正確、超過可轉餘額、來源單已被他人修改
+CONVERSION_RESULTS = ("ok", "missing", "bad_amount", "over_balance", "conflict")
+
+
+@dataclass
+class ConversionRow:
+    source_id: str
+    amount: int
+    result: str
+    available: int = 0
+    new_id: str = ""
+
+
+@dataclass(frozen=True)
+class ConversionRule:
+    """How a source form turns into a new one.
+
+    *available* returns the convertible balance of every source row;
+    *id_prefix* and *build* receive one source row (a dict) and return the
+    prefix of the new form id and the new form's values. *status* is written
+    to the source's 請款狀態 when not empty.
+    """
+
+    available: Callable[[pd.DataFrame], pd.Series]
+    id_prefix: Callable[[dict], str]
+    build: Callable[[dict, int, str], dict]
+    status: str = ""
+
+
+def balance_from_final(sources: pd.DataFrame) -> pd.Series:
+    """Balance of a purchase order: final amount (or total when unset) minus what was billed."""
+    final = frame_clean.clean_amounts(sources["最後採購金額"])
+    final = final.where(final != 0, frame_clean.clean_amounts(sources["總金額"]))
+    return final - frame_clean.clean_amounts(sources["已請款金額"])
+
+
+def balance_from_unbilled(sources: pd.DataFrame) -> pd.Series:
+    """Balance kept in the 尚未請款金額 column (quotations)."""
+    return frame_clean.clean_amounts(sources["尚未請款金額"])
+
+
+def _load_sources(db_path: str, ids: list[str]) -> pd.DataFrame:
+    sources = form_store.load_forms(db_path, form_store.FORM_COLUMNS + [form_store.VERSION_COLUMN], {"單號": ids})
+    return sources.drop_duplicates("單號").set_index("單號", drop=False)  # 與 get_form 相同，取第一筆
+
+
+def convert_forms(
+    db_path: str, requests: Iterable[tuple[str, object]], rule: ConversionRule, new_ids: Optional[Callable] = None
+) -> list[ConversionRow]:
+    """Convert every (source id, amount) in *requests* and return one ``ConversionRow`` per request.
+
+    Only rows whose result is ``"ok"`` were written. *new_ids(prefix, count)*
+    defaults to ``form_store.allocate_form_ids`` on *db_path*.
+    """
+    batch = pd.DataFrame(list(requests), columns=["source_id", "amount"])
+    if batch.empty:
+        return []
+    batch["source_id"] = batch["source_id"].astype(str)
+    batch["amount"], bad = frame_clean.parse_amounts(batch["amount"])
+    sources = _load_sources(db_path, batch["source_id"].unique().tolist())
+
+    # ★ 整批比對餘額：同一張來源單依序分配，超過剩餘餘額的列不轉，也不扣掉後面列可用的餘額
+    balance = rule.available(sources) if not sources.empty else pd.Series(dtype="int64")
+    batch["available"] = batch["source_id"].map(balance).fillna(0).astype("int64")
+    found = batch["source_id"].isin(sources.index)
+    valid = found & ~bad & (batch["amount"] > 0)
+    left = batch.loc[valid].groupby("source_id")["available"].first().to_dict()
+    over = []
+    for index, source_id, amount in batch.loc[valid, ["source_id", "amount"]].itertuples():
+        if amount > left[source_id]:
+            over.append(index)
+        else:
+            left[source_id] -= amount
+    batch["result"] = "ok"
+    batch.loc[over, "result"] = "over_balance"
+    batch.loc[found & ~valid, "result"] = "bad_amount"
+    batch.loc[~found, "result"] = "missing"
+    batch["new_id"] = ""
+
+    ok = batch.index[batch["result"] == "ok"]
+    if len(ok):
+        rows = sources.loc[batch.loc[ok, "source_id"].unique()].to_dict("index")
+        # 依前綴分組，一次配發一段單號
+        prefixes = batch.loc[ok, "source_id"].map(lambda source_id: rule.id_prefix(rows[source_id]))
+        allocate = new_ids or (lambda prefix, count: form_store.allocate_form_ids(db_path, prefix, count))
+        for prefix, index in prefixes.groupby(prefixes).groups.items():
+            batch.loc[index, "new_id"] = allocate(prefix, len(index))
+
+        totals = batch.loc[ok].groupby("source_id")["amount"].sum()
+        billed = frame_clean.clean_amounts(sources.loc[totals.index, "已請款金額"]) + totals
+        remaining = balance[totals.index] - totals
+        updates, versions = {}, {}
+        for source_id in totals.index:
+            updates[source_id] = {"已請款金額": int(billed[source_id]), "尚未請款金額": int(remaining[source_id])}
+            if rule.status:
+                updates[source_id]["請款狀態"] = rule.status
+            versions[source_id] = rows[source_id][form_store.VERSION_COLUMN]
+        new_forms = [rule.build(rows[r.source_id], int(r.amount), r.new_id) for r in batch.loc[ok].itertuples()]
+        try:
+            form_store.update_forms(db_path, updates, new_forms, expected_versions=versions)
+        except form_store.VersionConflict:
+            batch.loc[ok, "result"] = "conflict"
+            batch.loc[ok, "new_id"] = ""
+
+    return [
+        ConversionRow(r.source_id, int(r.amount), r.result, int(r.available), r.new_id)
+        for r in batch.itertuples()
+    ]
+
+
+def _self_check() -> None:
+    """Convert a batch with every kind of failure, then a large batch, against a temporary database."""
+    import os
+    import tempfile
+    import time
+
+    rule = ConversionRule(
+        available=balance_from_final,
+        id_prefix=lambda row: "20250101",
+        build=lambda row, amount, new_id: {"單號": new_id, "類型": "請款單", "總金額": amount, "專案名稱": row["專案名稱"]},
+        status="已轉請款單",
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        db = os.path.join(folder, "forms.db")
+        form_store.insert_form(db, {"單號": "20250101-01", "類型": "請款單"})
+        form_store.insert_form(db, {"單號": "P1", "類型": "採購單", "總金額": 1000, "專案名稱": "A"})
+        form_store.insert_form(db, {"單號": "P2", "類型": "採購單", "總金額": 900, "最後採購金額": 500, "已請款金額": 200})
+        report = convert_forms(db, [("P1", 600), ("P1", 300), ("P1", 200), ("P2", 400), ("P9", 10), ("P2", "abc")], rule)
+        assert [r.result for r in report] == ["ok", "ok", "over_balance", "over_balance", "missing", "bad_amount"], report
+        assert [r.new_id for r in report[:2]] == ["20250101-02", "20250101-03"]
+        p1 = form_store.get_form(db, "P1")
+        assert (p1["已請款金額"], p1["尚未請款金額"], p1["請款狀態"]) == (900, 100, "已轉請款單")
+        assert form_store.get_form(db, "20250101-03")["總金額"] == 300
+        assert form_store.get_form(db, "P2")["已請款金額"] == 200  # 沒有成功的列，來源單不變
+
+        # 超過餘額而不轉的列不佔用餘額，排在後面、金額夠的列仍可轉
+        form_store.insert_form(db, {"單號": "P3", "類型": "採購單", "總金額": 1000})
+        report = convert_forms(db, [("P3", 1200), ("P3", 100), ("P3", 900), ("P3", 1)], rule)
+        assert [r.result for r in report] == ["over_balance", "ok", "ok", "over_balance"], report
+        assert form_store.get_form(db, "P3")["尚未請款金額"] == 0
+
+        # 讀取後、寫入前被別人修改：整批不寫入
+        def bump(prefix: str, count: int) -> list[str]:
+            form_store.update_form(db, "P1", {"請款狀態": "他人修改"})
+            return form_store.allocate_form_ids(db, prefix, count)
+
+        report = convert_forms(db, [("P1", 50)], rule, new_ids=bump)
+        assert report[0].result == "conflict" and form_store.get_form(db, "P1")["已請款金額"] == 900, report
+
+        count = 2000
+        form_store.update_forms(db, {}, [{"單號": f"B{i}", "類型": "採購單", "總金額": 100} for i in range(count)])
+        started = time.perf_counter()
+        report = convert_forms(db, [(f"B{i}", 40) for i in range(count)], rule)
+        elapsed = (time.perf_counter() - started) * 1000
+        assert all(r.result == "ok" for r in report) and len({r.new_id for r in report}) == count
+        assert form_store.get_form(db, f"B{count - 1}")["尚未請款金額"] == 60
+        print(f"ok: failure cases reported per row, {count} purchase orders converted in {elapsed:.0f} ms")
+
+
+if __name__ == "__main__":
+    _self_check()
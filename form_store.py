@@ -0,0 +1,864 @@
+"""共用的表單資料庫（SQLite）。
+
+採購、請款與報價三個系統原本都直接讀寫 database.csv：每次核准、駁回或上傳附件
+都要整份解析、再把包含附件的每一列整份覆寫。這裡改以 SQLite 保存表單，單筆異動
+只 UPDATE／INSERT 該列，並在單號、狀態、專案負責人與申請人建立索引。
+每列另有「版本」欄，每次更新加一；寫入時可帶入讀取當下的版本做比對（compare-and-swap），
+版本不符即回報衝突，兩位主管同時簽核或修改時不會互相覆蓋。整批匯入還原或整份存檔時，
+新的列從「目前最大版本＋1」起算而不是歸零，還原前開啟編輯的人存檔時一樣會被擋下。
+
+請款單與報價單把未稅金額、稅額、發票號碼、附件名稱與報價細項打包成 JSON 放在
+「請款說明」。寫入「請款說明」時會同時展開成 `DERIVED_COLUMNS` 的具型別欄位與
+quote_items 表（舊資料在資料庫開啟時補算一次），畫面、列印與報表直接讀欄位，
+不必每次解析 JSON；CSV 備份仍只含 `FORM_COLUMNS`。
+
+新單號由 `new_form_id` 配發：每個前綴（日期、Q＋日期等）一個持久序號，在交易內
+遞增，兩個人同時存檔或刪除表單後都不會拿到重複的單號；序號第一次使用時從既有
+單號補齊，整批匯入或還原後會重新補齊。
+
+待簽核、待初審與待複審的表單另外登記在 inbox 表（單號、類型、狀態、簽核人＝專案負責人
+的名字），每次寫入狀態、類型或專案負責人時同步增減；簽核清單與側邊欄的待簽核數量
+由 `load_inbox` / `inbox_count` 直接查這張小表，不必篩選整張表單。
+
+整批寫入（匯入、還原、刪除、整份存檔、欄位改寫）在交易提交後會自行呼叫
+`data_cache.invalidate`，呼叫端不必記得；SQLite 寫入不一定會改變資料庫檔的修改時間。
+
+資料庫第一次開啟時，會自動把舊的 database.csv（測試區為 demo_database.csv）
+匯入一次；之後 CSV 只作為備份下載與還原的交換格式。
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Mapping, Optional, Union
+
+import pandas as pd
+
+import data_cache
+import frame_clean
+
+FORM_COLUMNS = [
+    "單號", "日期", "類型", "申請人", "代申請人", "專案負責人", "專案名稱", "專案編號",
+    "請款說明", "總金額", "幣別", "付款方式", "請款廠商", "匯款帳戶",
+    "帳戶影像Base64", "狀態", "影像Base64", "提交時間", "申請人信箱",
+    "初審人", "初審時間", "複審人", "複審時間", "刪除人", "刪除時間",
+    "刪除原因", "駁回原因", "匯款狀態", "匯款日期",
+    "支付條件", "支付期數", "請款狀態", "已請款金額", "尚未請款金額", "最後採購金額",
+]
+AMOUNT_COLUMNS = ("總金額", "已請款金額", "尚未請款金額", "最後採購金額")
+INDEXED_COLUMNS = {"單號": "form_id", "類型": "type", "狀態": "status", "專案負責人": "owner", "申請人": "applicant"}
+LEGACY_COLUMN_NAMES = {"專案執行人": "專案負責人"}
+# 狀態欄若誤貼了 LINE 通知文字，依關鍵字還原成對應狀態
+LEGACY_STATUS_FIXES = {"需要財務長": "待複審", "需要執行長": "待簽核"}
+# 每次更新都會遞增的列版本，用來偵測「讀取後已被別人改過」的寫入衝突
+VERSION_COLUMN = "版本"
+# transition_forms 的逐筆結果：成功、查無單號、狀態不符、無權限、版本衝突
+TRANSITION_RESULTS = ("ok", "missing", "wrong_state", "denied", "conflict")
+
+# 由「請款說明」展開的欄位與預設值；只在寫入「請款說明」時計算，呼叫端不直接寫入
+DERIVED_COLUMNS = {
+    "說明內容": "", "未稅金額": 0, "稅額": 0, "手續費": 0, "發票號碼": "",
+    "帳戶附件名稱": "", "憑證附件名稱": "", "客戶名稱": "", "施工地址": "", "開立發票": 0,
+}
+REQUEST_MARK = "[請款單資料]"
+QUOTE_MARK = "[報價單資料]"
+NAME_SEPARATOR = "\n"  # 憑證附件名稱以換行分隔
+QUOTE_ITEM_FIELDS = ("eng", "name", "unit", "qty", "price", "note")
+# 登記在 inbox 的待簽核狀態，以及變動時要重新登記的欄位
+INBOX_STATUSES = ("待簽核", "待初審", "待複審")
+INBOX_COLUMNS = ("類型", "狀態", "專案負責人")
+
+_LEGACY_IMPORT_KEY = "legacy_csv_imported"
+_DERIVED_KEY = "derived_fields_v1"
+_VERSION_FLOOR_KEY = "replacement_version_floor"
+_MAX_SQL_PARAMS = 500
+
+_schema_lock = threading.Lock()
+_ready_paths: set[str] = set()
+_imported_paths: set[str] = set()
+
+
+class VersionConflict(Exception):
+    """Raised when a form changed since the caller read its version."""
+
+    def __init__(self, form_ids: Iterable[str]) -> None:
+        self.form_ids = list(form_ids)
+        super().__init__("表單已被其他人修改：" + "、".join(self.form_ids))
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _clean_amount(value: object) -> int:
+    if value is None:
+        return 0
+    try:
+        if pd.isna(value):
+            return 0
+    except (TypeError, ValueError):
+        pass
+    text = str(value).replace(",", "").replace("$", "").replace("，", "").replace(" ", "").strip()
+    if not text:
+        return 0
+    try:
+        return int(float(text))
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+def _clean_text(value: object) -> str:
+    if value is None:
+        return ""
+    try:
+        if pd.isna(value):
+            return ""
+    except (TypeError, ValueError):
+        pass
+    return str(value)
+
+
+def _db_value(column: str, value: object) -> object:
+    return _clean_amount(value) if column in AMOUNT_COLUMNS else _clean_text(value)
+
+
+def _clean_number(value: object) -> float:
+    try:
+        number = float(str(value).replace(",", "").strip())
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if pd.isna(number) else number
+
+
+def unpack_description(desc: object) -> tuple[dict, list[dict]]:
+    """Return the ``DERIVED_COLUMNS`` values and quote items packed into a 請款說明 cell.
+
+    Plain text (purchase orders, legacy or malformed cells) becomes 說明內容 as is.
+    """
+    text = _clean_text(desc)
+    values = dict(DERIVED_COLUMNS)
+    mark = REQUEST_MARK if REQUEST_MARK in text else QUOTE_MARK if QUOTE_MARK in text else ""
+    data = None
+    if mark:
+        try:
+            data = json.loads(text.split(mark)[1].strip())
+        except ValueError:
+            pass
+    if not isinstance(data, dict):
+        values["說明內容"] = text
+        return values, []
+    if mark == REQUEST_MARK:
+        names = data.get("ims_names") or []
+        values.update({
+            "說明內容": _clean_text(data.get("desc")),
+            "未稅金額": _clean_amount(data.get("net_amt")),
+            "稅額": _clean_amount(data.get("tax_amt")),
+            "手續費": _clean_amount(data.get("fee")),
+            "發票號碼": _clean_text(data.get("inv_no")),
+            "帳戶附件名稱": _clean_text(data.get("acc_name")),
+            "憑證附件名稱": NAME_SEPARATOR.join(_clean_text(n) for n in ([names] if isinstance(names, str) else names)),
+        })
+        return values, []
+    values.update({
+        "客戶名稱": _clean_text(data.get("c_name")),
+        "施工地址": _clean_text(data.get("address")),
+        "開立發票": int(bool(data.get("is_inv"))),
+        "發票號碼": _clean_text(data.get("inv_no")),
+        "稅額": _clean_amount(data.get("tax")),
+    })
+    items = [
+        {**{f: _clean_text(item.get(f)) for f in ("eng", "name", "unit", "note")},
+         "qty": _clean_number(item.get("qty")), "price": _clean_amount(item.get("price"))}
+        for item in data.get("items") or [] if isinstance(item, dict)
+    ]
+    return values, items
+
+
+@contextmanager
+def _connect(db_path: str) -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _create_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS forms (id INTEGER PRIMARY KEY AUTOINCREMENT)")
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(forms)")}
+    for column in FORM_COLUMNS:
+        if column in existing:
+            continue
+        if column in AMOUNT_COLUMNS:
+            conn.execute(f"ALTER TABLE forms ADD COLUMN {_quote(column)} INTEGER NOT NULL DEFAULT 0")
+        else:
+            conn.execute(f"ALTER TABLE forms ADD COLUMN {_quote(column)} TEXT NOT NULL DEFAULT ''")
+    if VERSION_COLUMN not in existing:
+        conn.execute(f"ALTER TABLE forms ADD COLUMN {_quote(VERSION_COLUMN)} INTEGER NOT NULL DEFAULT 0")
+    for column, default in DERIVED_COLUMNS.items():
+        if column not in existing:
+            kind = "INTEGER NOT NULL DEFAULT 0" if isinstance(default, int) else "TEXT NOT NULL DEFAULT ''"
+            conn.execute(f"ALTER TABLE forms ADD COLUMN {_quote(column)} {kind}")
+    conn.execute("CREATE TABLE IF NOT EXISTS form_sequences (prefix TEXT PRIMARY KEY, last INTEGER NOT NULL)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS quote_items (form_row INTEGER NOT NULL, line_no INTEGER NOT NULL,"
+        " eng TEXT NOT NULL, name TEXT NOT NULL, unit TEXT NOT NULL, qty REAL NOT NULL, price INTEGER NOT NULL,"
+        " note TEXT NOT NULL, PRIMARY KEY (form_row, line_no))"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS inbox (form_row INTEGER PRIMARY KEY, form_id TEXT NOT NULL,"
+        " type TEXT NOT NULL, status TEXT NOT NULL, approver TEXT NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inbox_approver ON inbox (type, approver, status)")
+    for column, suffix in INDEXED_COLUMNS.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_forms_{suffix} ON forms ({_quote(column)})")
+    for keyword, status in LEGACY_STATUS_FIXES.items():
+        conn.execute(f"UPDATE forms SET {_quote('狀態')} = ? WHERE {_quote('狀態')} LIKE ?", (status, f"%{keyword}%"))
+
+
+def _write_items(conn: sqlite3.Connection, row_id: int, items: list[dict]) -> None:
+    conn.execute("DELETE FROM quote_items WHERE form_row = ?", (row_id,))
+    if items:
+        conn.executemany(
+            f"INSERT INTO quote_items (form_row, line_no, {', '.join(QUOTE_ITEM_FIELDS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(row_id, n, *(item[f] for f in QUOTE_ITEM_FIELDS)) for n, item in enumerate(items)],
+        )
+
+
+def _sync_derived(conn: sqlite3.Connection, form_ids: Iterable[str], desc: object) -> None:
+    """Refresh the derived columns and quote items of forms whose 請款說明 was just written."""
+    values, items = unpack_description(desc)
+    assignments = ", ".join(f"{_quote(c)} = ?" for c in values)
+    for form_id in form_ids:
+        for (row_id,) in conn.execute(f"SELECT id FROM forms WHERE {_quote('單號')} = ?", (form_id,)).fetchall():
+            conn.execute(f"UPDATE forms SET {assignments} WHERE id = ?", list(values.values()) + [row_id])
+            _write_items(conn, row_id, items)
+
+
+def _inbox_select(condition: str) -> str:
+    # 簽核人取專案負責人的第一個字（同 clean_name）："Andy (執行長)" -> "Andy"
+    owner = f"trim({_quote('專案負責人')})"
+    approver = f"CASE WHEN instr({owner}, ' ') > 0 THEN substr({owner}, 1, instr({owner}, ' ') - 1) ELSE {owner} END"
+    statuses = ", ".join(f"'{s}'" for s in INBOX_STATUSES)
+    return (
+        f"INSERT INTO inbox (form_row, form_id, type, status, approver) SELECT id, {_quote('單號')}, {_quote('類型')},"
+        f" trim({_quote('狀態')}), {approver} FROM forms WHERE trim({_quote('狀態')}) IN ({statuses}) AND {condition}"
+    )
+
+
+def _sync_inbox(conn: sqlite3.Connection, form_ids: Iterable[str]) -> None:
+    """Re-register *form_ids* in the inbox after their status, type or owner was written."""
+    ids = list(dict.fromkeys(str(i) for i in form_ids))
+    for start in range(0, len(ids), _MAX_SQL_PARAMS):
+        chunk = ids[start:start + _MAX_SQL_PARAMS]
+        marks = ", ".join("?" for _ in chunk)
+        conn.execute(f"DELETE FROM inbox WHERE form_id IN ({marks})", chunk)
+        conn.execute(_inbox_select(f"{_quote('單號')} IN ({marks})"), chunk)
+
+
+def _rebuild_inbox(conn: sqlite3.Connection) -> None:
+    conn.execute("DELETE FROM inbox")
+    conn.execute(_inbox_select("1"))
+
+
+def _backfill_derived(conn: sqlite3.Connection) -> int:
+    """Fill the derived columns of rows written before they existed."""
+    assignments = ", ".join(f"{_quote(c)} = ?" for c in DERIVED_COLUMNS)
+    rows = conn.execute(f"SELECT id, {_quote('請款說明')} FROM forms").fetchall()
+    for row_id, desc in rows:
+        values, items = unpack_description(desc)
+        conn.execute(f"UPDATE forms SET {assignments} WHERE id = ?", list(values.values()) + [row_id])
+        _write_items(conn, row_id, items)
+    return len(rows)
+
+
+def _get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM store_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def read_legacy_csv(source: Union[str, bytes, io.IOBase]) -> pd.DataFrame:
+    """Read a database.csv style file (path, bytes or buffer) as strings."""
+    raw = source
+    if isinstance(source, str):
+        if not os.path.exists(source):
+            return pd.DataFrame(columns=FORM_COLUMNS)
+        with open(source, "rb") as f:
+            raw = f.read()
+    elif hasattr(source, "read"):
+        raw = source.read()
+    # 先用偵測到的編碼解析一次，失敗才改試其他編碼
+    sniffed = data_cache.detect_encoding(raw[:data_cache.SNIFF_BYTES], truncated=len(raw) > data_cache.SNIFF_BYTES)
+    for enc in (sniffed,) + tuple(e for e in data_cache.CSV_ENCODINGS if e != sniffed):
+        try:
+            return pd.read_csv(io.BytesIO(raw), encoding=enc, dtype=str).fillna("")
+        except (UnicodeDecodeError, pd.errors.ParserError):
+            continue
+        except pd.errors.EmptyDataError:
+            break
+    return pd.DataFrame(columns=FORM_COLUMNS)
+
+
+def normalize_frame(df: pd.DataFrame, issues: Optional[list] = None) -> pd.DataFrame:
+    """Return *df* with the canonical form columns, legacy names and clean amounts.
+
+    Amounts that cannot be parsed are stored as 0; when *issues* is given,
+    ``(單號, column, original text)`` is appended for each of them.
+    """
+    df = df.copy()
+    df.columns = [str(c).strip() for c in df.columns]
+    df = df.rename(columns={old: new for old, new in LEGACY_COLUMN_NAMES.items() if new not in df.columns})
+    for column in FORM_COLUMNS:
+        if column not in df.columns:
+            df[column] = ""
+    df = df[FORM_COLUMNS].reset_index(drop=True)
+    # ★ 整欄清理，不再逐格呼叫 _clean_amount / _clean_text
+    cleaned = {}
+    for column in FORM_COLUMNS:
+        if column in AMOUNT_COLUMNS:
+            cleaned[column], failed = frame_clean.parse_amounts(df[column])
+            if issues is not None and failed.any():
+                ids = frame_clean.clean_texts(df.loc[failed, "單號"])
+                issues.extend(zip(ids, [column] * len(ids), df.loc[failed, column].astype(str)))
+        else:
+            cleaned[column] = frame_clean.clean_texts(df[column]).astype(object)
+    df = pd.DataFrame(cleaned, columns=FORM_COLUMNS)
+    for keyword, status in LEGACY_STATUS_FIXES.items():
+        df.loc[df["狀態"].str.contains(keyword, regex=False), "狀態"] = status
+    return df
+
+
+def _insert_rows(conn: sqlite3.Connection, df: pd.DataFrame, version: int = 0) -> int:
+    if df.empty:
+        return 0
+    selected = FORM_COLUMNS + list(DERIVED_COLUMNS)
+    placeholders = ", ".join("?" for _ in selected)
+    sql = (
+        f"INSERT INTO forms ({', '.join(_quote(c) for c in selected)}, {_quote(VERSION_COLUMN)})"
+        f" VALUES ({placeholders}, {int(version)})"
+    )
+    desc_at = FORM_COLUMNS.index("請款說明")
+    status_at = FORM_COLUMNS.index("狀態")
+    pending = []
+    for row in df[FORM_COLUMNS].itertuples(index=False, name=None):
+        values, items = unpack_description(row[desc_at])
+        row_id = conn.execute(sql, row + tuple(values.values())).lastrowid
+        if items:
+            _write_items(conn, row_id, items)
+        if str(row[status_at]).strip() in INBOX_STATUSES:
+            pending.append(row_id)
+    for start in range(0, len(pending), _MAX_SQL_PARAMS):
+        chunk = pending[start:start + _MAX_SQL_PARAMS]
+        conn.execute(_inbox_select(f"id IN ({', '.join('?' for _ in chunk)})"), chunk)
+    return len(df)
+
+
+def _replacement_version(conn: sqlite3.Connection) -> int:
+    """Version for rows that replace the whole table: above every version handed out so far.
+
+    An editor who read a form before a restore still holds its old version;
+    restarting at 0 would let that stale save silently overwrite the restored row.
+    """
+    current = conn.execute(f"SELECT MAX({_quote(VERSION_COLUMN)}) FROM forms").fetchone()[0]
+    floor = int(_get_meta(conn, _VERSION_FLOOR_KEY) or 0)
+    version = max(floor, (current if current is not None else -1) + 1)
+    _set_meta(conn, _VERSION_FLOOR_KEY, str(version + 1))
+    return version
+
+
+def open_store(db_path: str, legacy_csv: Optional[str] = None) -> str:
+    """Create the schema once per process and import *legacy_csv* the first time."""
+    key = os.path.abspath(db_path)
+    if key in _ready_paths and (legacy_csv is None or key in _imported_paths):
+        return db_path
+    with _schema_lock:
+        with _connect(db_path) as conn:
+            if key not in _ready_paths:
+                _create_schema(conn)
+                _rebuild_inbox(conn)  # 舊資料與狀態修復後的待簽核表單
+                if _get_meta(conn, _DERIVED_KEY) is None:
+                    _set_meta(conn, _DERIVED_KEY, str(_backfill_derived(conn)))
+            if legacy_csv is not None and key not in _imported_paths:
+                if _get_meta(conn, _LEGACY_IMPORT_KEY) is None:
+                    imported = 0
+                    has_rows = conn.execute("SELECT 1 FROM forms LIMIT 1").fetchone()
+                    if not has_rows and os.path.exists(legacy_csv):
+                        imported = _insert_rows(conn, normalize_frame(read_legacy_csv(legacy_csv)))
+                    _set_meta(conn, _LEGACY_IMPORT_KEY, f"{os.path.basename(legacy_csv)}:{imported}")
+                _imported_paths.add(key)
+        _ready_paths.add(key)
+    return db_path
+
+
+def import_csv(
+    db_path: str, source: Union[str, bytes, io.IOBase], replace: bool = False, issues: Optional[list] = None
+) -> int:
+    """Import a database.csv export; with *replace* the current forms are discarded.
+
+    Unparsable amounts are reported through *issues* like ``normalize_frame``.
+    """
+    df = normalize_frame(read_legacy_csv(source), issues)
+    with _connect(open_store(db_path)) as conn:
+        version = _replacement_version(conn) if replace else 0
+        if replace:
+            conn.execute("DELETE FROM forms")
+            conn.execute("DELETE FROM quote_items")
+            conn.execute("DELETE FROM inbox")
+        conn.execute("DELETE FROM form_sequences")  # 匯入的單號可能超過現有序號，下次配發時重新補齊
+        imported = _insert_rows(conn, df, version)
+    data_cache.invalidate(db_path)
+    return imported
+
+
+def _where_clause(where: Optional[Mapping[str, object]]) -> tuple[str, list]:
+    if not where:
+        return "", []
+    clauses, params = [], []
+    for column, value in where.items():
+        if column not in FORM_COLUMNS:
+            raise KeyError(column)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            values = [_db_value(column, v) for v in value]
+            if not values:
+                return " WHERE 0", []
+            clauses.append(f"{_quote(column)} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+        else:
+            clauses.append(f"{_quote(column)} = ?")
+            params.append(_db_value(column, value))
+    return " WHERE " + " AND ".join(clauses), params
+
+
+def load_forms(
+    db_path: str,
+    columns: Optional[Iterable[str]] = None,
+    where: Optional[Mapping[str, object]] = None,
+) -> pd.DataFrame:
+    """Return forms as a DataFrame.
+
+    *columns* limits which columns are read (default: ``FORM_COLUMNS`` followed by
+    ``DERIVED_COLUMNS``); *where* maps a
+    column to a value or a collection of accepted values, e.g.
+    ``{"類型": "請款單", "狀態": ["待簽核", "待初審"]}``. Filtering happens in
+    SQLite, so unwanted rows are never decoded. ``VERSION_COLUMN`` is only
+    returned when asked for explicitly.
+    """
+    readable = FORM_COLUMNS + list(DERIVED_COLUMNS)
+    selected = readable if columns is None else [c for c in readable if c in set(columns)]
+    if columns is not None and VERSION_COLUMN in set(columns):
+        selected = selected + [VERSION_COLUMN]
+    clause, params = _where_clause(where)
+    sql = f"SELECT {', '.join(_quote(c) for c in selected)} FROM forms{clause} ORDER BY id"
+    with _connect(open_store(db_path)) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return pd.DataFrame(rows, columns=selected)
+
+
+def get_form(db_path: str, form_id: str) -> Optional[dict]:
+    """Return the first form with *form_id* (with its derived columns and ``VERSION_COLUMN``), or None."""
+    selected = FORM_COLUMNS + list(DERIVED_COLUMNS) + [VERSION_COLUMN]
+    columns = ", ".join(_quote(c) for c in selected)
+    with _connect(open_store(db_path)) as conn:
+        row = conn.execute(
+            f"SELECT {columns} FROM forms WHERE {_quote('單號')} = ? ORDER BY id LIMIT 1", (str(form_id),)
+        ).fetchone()
+    return dict(zip(selected, row)) if row else None
+
+
+def insert_form(db_path: str, values: Mapping[str, object]) -> None:
+    """Insert one new form; missing columns get their empty defaults."""
+    row = {c: _db_value(c, values.get(c)) for c in FORM_COLUMNS}
+    with _connect(open_store(db_path)) as conn:
+        _insert_rows(conn, pd.DataFrame([row], columns=FORM_COLUMNS))
+
+
+def _highest_suffix(conn: sqlite3.Connection, prefix: str) -> int:
+    # 「前綴-」開頭的單號恰好落在 [前綴-, 前綴.) 之間，可以走單號索引
+    rows = conn.execute(
+        f"SELECT {_quote('單號')} FROM forms WHERE {_quote('單號')} >= ? AND {_quote('單號')} < ?",
+        (prefix + "-", prefix + "."),
+    )
+    suffixes = [row[0][len(prefix) + 1:] for row in rows]
+    return max((int(s) for s in suffixes if s.isdigit()), default=0)
+
+
+def allocate_form_ids(db_path: str, prefix: str, count: int = 1) -> list[str]:
+    """Reserve *count* new ids ``<prefix>-NN`` in one transaction.
+
+    The sequence of *prefix* is seeded from the highest existing id the first
+    time it is used; afterwards each call only increments it, so concurrent
+    sessions and deleted forms never lead to a reused id.
+    """
+    with _connect(open_store(db_path)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("SELECT last FROM form_sequences WHERE prefix = ?", (prefix,)).fetchone()
+        last = row[0] if row else _highest_suffix(conn, prefix)
+        conn.execute("INSERT OR REPLACE INTO form_sequences (prefix, last) VALUES (?, ?)", (prefix, last + count))
+    return [f"{prefix}-{n:02d}" for n in range(last + 1, last + count + 1)]
+
+
+def new_form_id(db_path: str, prefix: str) -> str:
+    """Reserve one new id, e.g. ``new_form_id(db, "20250101")`` -> ``"20250101-03"``."""
+    return allocate_form_ids(db_path, prefix)[0]
+
+
+def load_quote_items(db_path: str, form_id: str) -> list[dict]:
+    """Return the quote line items of the first form with *form_id*, in order."""
+    fields = ", ".join(QUOTE_ITEM_FIELDS)
+    with _connect(open_store(db_path)) as conn:
+        rows = conn.execute(
+            f"SELECT {fields} FROM quote_items WHERE form_row = "
+            f"(SELECT id FROM forms WHERE {_quote('單號')} = ? ORDER BY id LIMIT 1) ORDER BY line_no",
+            (str(form_id),),
+        ).fetchall()
+    return [dict(zip(QUOTE_ITEM_FIELDS, row)) for row in rows]
+
+
+def load_inbox(
+    db_path: str,
+    form_type: str,
+    statuses: Iterable[str] = INBOX_STATUSES,
+    approver: Optional[str] = None,
+    columns: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """Return the pending forms of *form_type* in *statuses*, like ``load_forms``.
+
+    With *approver* only forms whose 專案負責人 is that person are returned.
+    Only the inbox entries are scanned, never the whole forms table.
+    """
+    readable = FORM_COLUMNS + list(DERIVED_COLUMNS)
+    selected = readable if columns is None else [c for c in readable if c in set(columns)]
+    if columns is not None and VERSION_COLUMN in set(columns):
+        selected = selected + [VERSION_COLUMN]
+    statuses = list(statuses)
+    if not statuses:
+        return pd.DataFrame(columns=selected)
+    clause = f"inbox.type = ? AND inbox.status IN ({', '.join('?' for _ in statuses)})"
+    params = [form_type] + statuses
+    if approver is not None:
+        clause += " AND inbox.approver = ?"
+        params.append(str(approver))
+    sql = (
+        f"SELECT {', '.join('forms.' + _quote(c) for c in selected)} FROM inbox"
+        f" JOIN forms ON forms.id = inbox.form_row WHERE {clause} ORDER BY forms.id"
+    )
+    with _connect(open_store(db_path)) as conn:
+        rows = conn.execute(sql, params).fetchall()
+    return pd.DataFrame(rows, columns=selected)
+
+
+def inbox_count(
+    db_path: str, form_type: str, statuses: Iterable[str] = INBOX_STATUSES, approver: Optional[str] = None
+) -> int:
+    """Count the pending forms ``load_inbox`` would return, without reading them."""
+    statuses = list(statuses)
+    if not statuses:
+        return 0
+    clause = f"type = ? AND status IN ({', '.join('?' for _ in statuses)})"
+    params = [form_type] + statuses
+    if approver is not None:
+        clause += " AND approver = ?"
+        params.append(str(approver))
+    with _connect(open_store(db_path)) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM inbox WHERE {clause}", params).fetchone()[0]
+
+
+def _update_statement(values: Mapping[str, object]) -> tuple[str, list]:
+    columns = [c for c in values if c in FORM_COLUMNS and c != "單號"]
+    if not columns:
+        return "", []
+    assignments = ", ".join(f"{_quote(c)} = ?" for c in columns)
+    version = _quote(VERSION_COLUMN)
+    return (
+        f"UPDATE forms SET {assignments}, {version} = {version} + 1 WHERE {_quote('單號')} = ?",
+        [_db_value(c, values[c]) for c in columns],
+    )
+
+
+def _apply_update(
+    conn: sqlite3.Connection, sql: str, params: list, form_id: str, expected_version: Optional[int]
+) -> int:
+    """Run one update; with *expected_version* it only applies if the version still matches."""
+    if expected_version is None:
+        return conn.execute(sql, params + [form_id]).rowcount
+    changed = conn.execute(f"{sql} AND {_quote(VERSION_COLUMN)} = ?", params + [form_id, int(expected_version)]).rowcount
+    if not changed and conn.execute(f"SELECT 1 FROM forms WHERE {_quote('單號')} = ?", (form_id,)).fetchone():
+        raise VersionConflict([form_id])
+    return changed
+
+
+def update_form(
+    db_path: str, form_id: str, values: Mapping[str, object], expected_version: Optional[int] = None
+) -> int:
+    """Update the given columns of one form and return the number of rows changed.
+
+    With *expected_version* the write is a compare-and-swap: if the form's
+    ``VERSION_COLUMN`` moved on since it was read, nothing is written and
+    ``VersionConflict`` is raised.
+    """
+    sql, params = _update_statement(values)
+    if not sql:
+        return 0
+    with _connect(open_store(db_path)) as conn:
+        changed = _apply_update(conn, sql, params, str(form_id), expected_version)
+        if changed and "請款說明" in values:
+            _sync_derived(conn, [str(form_id)], values["請款說明"])
+        if changed and any(c in values for c in INBOX_COLUMNS):
+            _sync_inbox(conn, [str(form_id)])
+        return changed
+
+
+def update_forms(
+    db_path: str,
+    updates: Mapping[str, Mapping[str, object]],
+    new_forms: Iterable[Mapping[str, object]] = (),
+    expected_versions: Optional[Mapping[str, int]] = None,
+) -> int:
+    """Apply several per-form updates (and optional inserts) in a single transaction.
+
+    Forms listed in *expected_versions* are compare-and-swapped like
+    ``update_form``; one conflict rolls back the whole batch.
+    """
+    changed = 0
+    expected = {str(k): v for k, v in (expected_versions or {}).items()}
+    rows = [{c: _db_value(c, values.get(c)) for c in FORM_COLUMNS} for values in new_forms]
+    with _connect(open_store(db_path)) as conn:
+        for form_id, values in updates.items():
+            sql, params = _update_statement(values)
+            if sql:
+                applied = _apply_update(conn, sql, params, str(form_id), expected.get(str(form_id)))
+                if applied and "請款說明" in values:
+                    _sync_derived(conn, [str(form_id)], values["請款說明"])
+                if applied and any(c in values for c in INBOX_COLUMNS):
+                    _sync_inbox(conn, [str(form_id)])
+                changed += applied
+        if rows:
+            _insert_rows(conn, pd.DataFrame(rows, columns=FORM_COLUMNS))
+    return changed
+
+
+def transition_forms(
+    db_path: str,
+    form_ids: Iterable[str],
+    from_states: Iterable[str],
+    to_state: str,
+    fields: Optional[Mapping[str, object]] = None,
+    allowed: Optional[Callable[[dict], bool]] = None,
+    expected_versions: Optional[Mapping[str, int]] = None,
+) -> dict[str, str]:
+    """Move forms currently in *from_states* to *to_state* in one transaction.
+
+    *fields* are written alongside the new status and *allowed(row)* can veto a
+    form. Forms listed in *expected_versions* whose version moved on are
+    reported as ``"conflict"``. Returns ``{form_id: result}`` where result is one
+    of ``TRANSITION_RESULTS``; only ``"ok"`` forms were changed.
+    """
+    ids = list(dict.fromkeys(str(i) for i in form_ids))
+    expected = {str(k): int(v) for k, v in (expected_versions or {}).items()}
+    states = {str(s) for s in from_states}
+    sql, params = _update_statement({**(fields or {}), "狀態": to_state})
+    selected = FORM_COLUMNS + [VERSION_COLUMN]
+    columns = ", ".join(_quote(c) for c in selected)
+    results: dict[str, str] = {}
+    with _connect(open_store(db_path)) as conn:
+        # 先鎖定寫入，避免讀取狀態後、更新前被其他人搶先簽核
+        conn.execute("BEGIN IMMEDIATE")
+        current: dict[str, dict] = {}
+        for start in range(0, len(ids), _MAX_SQL_PARAMS):
+            chunk = ids[start:start + _MAX_SQL_PARAMS]
+            marks = ", ".join("?" for _ in chunk)
+            for row in conn.execute(
+                f"SELECT {columns} FROM forms WHERE {_quote('單號')} IN ({marks}) ORDER BY id", chunk
+            ):
+                current.setdefault(row[0], dict(zip(selected, row)))
+        for form_id in ids:
+            row = current.get(form_id)
+            if row is None:
+                results[form_id] = "missing"
+            elif form_id in expected and row[VERSION_COLUMN] != expected[form_id]:
+                results[form_id] = "conflict"
+            elif row["狀態"] not in states:
+                results[form_id] = "wrong_state"
+            elif allowed is not None and not allowed(row):
+                results[form_id] = "denied"
+            else:
+                results[form_id] = "ok"
+        done = [form_id for form_id, result in results.items() if result == "ok"]
+        conn.executemany(sql, [params + [form_id] for form_id in done])
+        if fields and "請款說明" in fields:
+            _sync_derived(conn, done, fields["請款說明"])
+        _sync_inbox(conn, done)
+    return results
+
+
+def delete_forms(db_path: str, form_ids: Iterable[str]) -> int:
+    """Permanently delete the given forms."""
+    ids = [(str(i),) for i in form_ids]
+    if not ids:
+        return 0
+    with _connect(open_store(db_path)) as conn:
+        conn.executemany(
+            f"DELETE FROM quote_items WHERE form_row IN (SELECT id FROM forms WHERE {_quote('單號')} = ?)", ids
+        )
+        conn.executemany("DELETE FROM inbox WHERE form_id = ?", ids)
+        deleted = conn.executemany(f"DELETE FROM forms WHERE {_quote('單號')} = ?", ids).rowcount
+    data_cache.invalidate(db_path)
+    return deleted
+
+
+def rewrite_columns(
+    db_path: str,
+    columns: Iterable[str],
+    convert: Callable[[str], str],
+    skip_prefix: str = "",
+) -> int:
+    """Pass non-empty cells of *columns* through *convert* and store the results.
+
+    Cells already starting with *skip_prefix* are left alone. Changed rows get a
+    new version like any other write. Returns the number of rows changed.
+    """
+    columns = [c for c in columns if c in FORM_COLUMNS]
+    if not columns:
+        return 0
+    if skip_prefix:
+        pending = " OR ".join(f"({_quote(c)} != '' AND {_quote(c)} NOT LIKE ?)" for c in columns)
+        params = [skip_prefix + "%"] * len(columns)
+    else:
+        pending = " OR ".join(f"{_quote(c)} != ''" for c in columns)
+        params = []
+    selected = ", ".join(_quote(c) for c in columns)
+    version = _quote(VERSION_COLUMN)
+    changed = 0
+    with _connect(open_store(db_path)) as conn:
+        rows = conn.execute(f"SELECT id, {selected} FROM forms WHERE {pending}", params).fetchall()
+        for row in rows:
+            values = {}
+            for column, cell in zip(columns, row[1:]):
+                if not cell or (skip_prefix and cell.startswith(skip_prefix)):
+                    continue
+                new_cell = convert(cell)
+                if new_cell != cell:
+                    values[column] = new_cell
+            if not values:
+                continue
+            assignments = ", ".join(f"{_quote(c)} = ?" for c in values)
+            conn.execute(
+                f"UPDATE forms SET {assignments}, {version} = {version} + 1 WHERE id = ?", list(values.values()) + [row[0]]
+            )
+            if "請款說明" in values:
+                derived, items = unpack_description(values["請款說明"])
+                conn.execute(
+                    f"UPDATE forms SET {', '.join(f'{_quote(c)} = ?' for c in derived)} WHERE id = ?",
+                    list(derived.values()) + [row[0]],
+                )
+                _write_items(conn, row[0], items)
+            changed += 1
+        if changed and any(c in columns for c in INBOX_COLUMNS):
+            _rebuild_inbox(conn)
+    if changed:
+        data_cache.invalidate(db_path)
+    return changed
+
+
+def save_frame(db_path: str, df: pd.DataFrame) -> None:
+    """Replace every form with *df* in one transaction (bulk editors and restores)."""
+    normalized = normalize_frame(df)
+    with _connect(open_store(db_path)) as conn:
+        version = _replacement_version(conn)
+        conn.execute("DELETE FROM forms")
+        conn.execute("DELETE FROM quote_items")
+        conn.execute("DELETE FROM inbox")
+        conn.execute("DELETE FROM form_sequences")
+        _insert_rows(conn, normalized, version)
+    data_cache.invalidate(db_path)
+
+
+def export_csv(db_path: str) -> bytes:
+    """Return all forms as database.csv compatible UTF-8 (BOM) bytes."""
+    return load_forms(db_path, FORM_COLUMNS).to_csv(index=False).encode("utf-8-sig")
+
+
+def _self_check() -> None:
+    """Check the inbox against a full scan after every kind of write, then time both on 20k forms."""
+    import tempfile
+    import time
+
+    def scanned(db: str) -> list[str]:
+        df = load_forms(db, ["單號", "狀態"])
+        return sorted(df.loc[df["狀態"].str.strip().isin(INBOX_STATUSES), "單號"])
+
+    def indexed(db: str) -> list[str]:
+        return sorted(load_inbox(db, "請款單", columns=["單號"])["單號"])
+
+    with tempfile.TemporaryDirectory() as folder:
+        db = os.path.join(folder, "forms.db")
+        insert_form(db, {"單號": "A", "類型": "請款單", "狀態": "待簽核", "專案負責人": "Andy (執行長)"})
+        insert_form(db, {"單號": "B", "類型": "請款單", "狀態": "已儲存", "專案負責人": "Eason"})
+        update_forms(db, {"B": {"狀態": "待簽核"}}, [{"單號": "C", "類型": "請款單", "狀態": " 待複審 ", "專案負責人": "Eason"}])
+        assert indexed(db) == scanned(db) == ["A", "B", "C"]
+        assert inbox_count(db, "請款單", ["待簽核"], "Andy") == 1 and inbox_count(db, "請款單", ["待複審"]) == 1
+        transition_forms(db, ["A"], ["待簽核"], "待複審")
+        update_form(db, "B", {"專案負責人": "Andy"})
+        assert list(load_inbox(db, "請款單", ["待簽核"], "Andy")["單號"]) == ["B"]
+        update_form(db, "C", {"狀態": "已核准"})
+        delete_forms(db, ["B"])
+        assert indexed(db) == scanned(db) == ["A"]
+        stale = get_form(db, "A")[VERSION_COLUMN]
+        save_frame(db, pd.DataFrame([{"單號": "D", "類型": "請款單", "狀態": "待初審"}, {"單號": "A", "類型": "請款單"}]))
+        assert indexed(db) == scanned(db) == ["D"]
+        try:  # 還原前讀到的版本不能覆蓋還原後的資料
+            update_form(db, "A", {"狀態": "已核准"}, expected_version=stale)
+            raise AssertionError("stale version accepted after save_frame")
+        except VersionConflict:
+            pass
+        restored = get_form(db, "A")[VERSION_COLUMN]
+        import_csv(db, export_csv(db), replace=True)
+        assert get_form(db, "A")[VERSION_COLUMN] > restored
+        before = get_form(db, "A")[VERSION_COLUMN]
+        update_form(db, "A", {"影像Base64": "legacy"})
+        assert rewrite_columns(db, ["影像Base64"], lambda cell: "att:" + cell, "att:") == 1
+        try:  # 附件搬移前讀到的版本不能寫回舊的附件欄位
+            update_form(db, "A", {"影像Base64": "legacy"}, expected_version=before + 1)
+            raise AssertionError("stale version accepted after rewrite_columns")
+        except VersionConflict:
+            pass
+
+        count = 20_000
+        statuses = ["已核准"] * 97 + ["待簽核", "待初審", "待複審"]
+        update_forms(db, {}, [
+            {"單號": f"F{i}", "類型": "請款單", "狀態": statuses[i % 100], "專案負責人": f"P{i % 7}"} for i in range(count)
+        ])
+        assert indexed(db) == scanned(db)
+        started = time.perf_counter()
+        full = load_forms(db, where={"類型": "請款單", "狀態": ["待簽核", "待初審"]})
+        full = full[full["專案負責人"] == "P3"]
+        scan_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        pending = load_inbox(db, "請款單", ["待簽核", "待初審"], "P3")
+        inbox_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        badge = inbox_count(db, "請款單", ["待簽核", "待初審"], "P3")
+        count_ms = (time.perf_counter() - started) * 1000
+        assert list(pending["單號"]) == list(full["單號"]) and badge == len(pending)
+        print(
+            f"ok: inbox matches a full scan; {count} forms, one approver's {badge} pending: "
+            f"filter {scan_ms:.1f} ms, inbox {inbox_ms:.1f} ms, badge {count_ms:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    _self_check()
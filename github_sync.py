@@ -0,0 +1,381 @@
+"""GitHub 背景備份佇列。
+
+原本每次存檔都在畫面執行緒裡對 GitHub 做一次 GET＋PUT（整份檔案 base64），
+簽核一次就要等兩趟網路往返。這裡改由背景執行緒處理：存檔時只把檔案路徑放進
+佇列，等一小段時間（debounce）收集同一波的變動後，透過 Git Data API
+（blob → tree → commit → 更新 ref）把所有變動檔案合併成一次 commit。
+
+失敗會保留在佇列中並以指數退避重試；尚未設定 Token 或 Repository 時檔案只留在佇列，
+不嘗試推送也不累計失敗，等 `configure` 補上設定後才送出。設定頁可讀取 `status()` 顯示佇列長度與
+最後成功時間。直接執行本檔（`python github_sync.py`）會啟動本機假 GitHub
+伺服器做一次端對端自我檢查。
+"""
+
+from __future__ import annotations
+
+import base64
+import datetime as _datetime
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import requests
+
+DEFAULT_API_BASE = "https://api.github.com"
+
+
+@dataclass
+class SyncStatus:
+    pending: int
+    last_success: Optional[_datetime.datetime]
+    last_error: str
+    last_commit: str
+    commits: int
+    failures: int
+
+
+class SyncError(Exception):
+    pass
+
+
+_MISSING_CONFIG = "缺少 GitHub Token 或 Repository"
+
+
+def _read_snapshot(path: str) -> bytes:
+    """Read *path*; SQLite databases are copied through the backup API so the upload is consistent."""
+    if not path.endswith(".db"):
+        with open(path, "rb") as f:
+            return f.read()
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        src = sqlite3.connect(path, timeout=30)
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        with open(tmp, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(tmp)
+
+
+class SyncWorker:
+    """Coalesce file changes and push them to one GitHub branch in a background thread."""
+
+    def __init__(
+        self,
+        root_dir: str,
+        api_base: str = DEFAULT_API_BASE,
+        debounce: float = 3.0,
+        max_delay: float = 30.0,
+        max_backoff: float = 300.0,
+    ) -> None:
+        self.root_dir = os.path.abspath(root_dir)
+        self.api_base = api_base.rstrip("/")
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_backoff = max_backoff
+        self._cond = threading.Condition()
+        self._pending: set[str] = set()
+        self._in_flight: list[str] = []
+        self._pushed: dict[str, tuple[int, int]] = {}
+        self._first_enqueue = 0.0
+        self._last_enqueue = 0.0
+        self._retry_at = 0.0
+        self._flush_requested = False
+        self._config = ("", "", "main")
+        self._last_success: Optional[_datetime.datetime] = None
+        self._last_error = ""
+        self._last_commit = ""
+        self._commits = 0
+        self._failures = 0
+        self._failures_in_row = 0
+        self._thread = threading.Thread(target=self._run, name="github-sync", daemon=True)
+        self._thread.start()
+
+    # --- public API ----------------------------------------------------
+
+    def configure(self, token: str, repo: str, branch: str = "main") -> None:
+        with self._cond:
+            if (token, repo, branch) != self._config:
+                self._config = (token, repo, branch or "main")
+                self._retry_at = 0.0
+                self._cond.notify_all()
+
+    def enqueue(self, *paths: str) -> None:
+        """Schedule *paths* for the next commit; unchanged files already pushed are skipped."""
+        now = time.monotonic()
+        with self._cond:
+            for path in paths:
+                path = os.path.abspath(path)
+                if not os.path.exists(path) or self._pushed.get(path) == self._signature(path):
+                    continue
+                if not self._pending:
+                    self._first_enqueue = now
+                self._pending.add(path)
+                self._last_enqueue = now
+            self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending) + len(self._in_flight)
+
+    def status(self) -> SyncStatus:
+        with self._cond:
+            return SyncStatus(
+                pending=len(self._pending) + len(self._in_flight),
+                last_success=self._last_success,
+                last_error=self._last_error,
+                last_commit=self._last_commit,
+                commits=self._commits,
+                failures=self._failures,
+            )
+
+    def flush(self, timeout: float = 60.0) -> bool:
+        """Push pending files now (skipping the debounce window) and wait for the queue to drain.
+
+        Returns False right away when pending files cannot be pushed because nothing is configured.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._retry_at = 0.0
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                if not self._in_flight and not self._configured():
+                    return False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    # --- worker ----------------------------------------------------------
+
+    @staticmethod
+    def _signature(path: str) -> Optional[tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _configured(self) -> bool:
+        token, repo, _ = self._config
+        return bool(token and repo)
+
+    def _ready_at(self) -> float:
+        if self._flush_requested:
+            return 0.0
+        ready = min(self._last_enqueue + self.debounce, self._first_enqueue + self.max_delay)
+        return max(ready, self._retry_at)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    # 沒有設定時不推送、不退避，等 configure 通知後再處理留在佇列的檔案
+                    if not self._pending:
+                        self._flush_requested = False
+                        self._cond.wait()
+                    elif not self._configured():
+                        self._last_error = _MISSING_CONFIG
+                        self._cond.wait()
+                    else:
+                        delay = self._ready_at() - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self._cond.wait(delay)
+                batch = sorted(self._pending)
+                self._pending.clear()
+                self._in_flight = batch
+                token, repo, branch = self._config
+            signatures = {path: self._signature(path) for path in batch}
+            try:
+                commit = self._push(token, repo, branch, batch)
+                error = ""
+            except Exception as e:
+                commit, error = "", str(e)
+            with self._cond:
+                self._in_flight = []
+                if error:
+                    self._pending.update(batch)
+                    self._failures += 1
+                    self._failures_in_row += 1
+                    self._last_error = error
+                    self._flush_requested = False
+                    self._retry_at = time.monotonic() + min(self.max_backoff, 5.0 * 2 ** (self._failures_in_row - 1))
+                else:
+                    for path, signature in signatures.items():
+                        if signature is not None:
+                            self._pushed[path] = signature
+                    self._failures_in_row = 0
+                    self._last_error = ""
+                    self._last_success = _datetime.datetime.now()
+                    if commit:
+                        self._last_commit = commit
+                        self._commits += 1
+                    if not self._pending:
+                        self._flush_requested = False
+                self._cond.notify_all()
+
+    def _repo_path(self, path: str) -> str:
+        return os.path.relpath(path, self.root_dir).replace(os.sep, "/")
+
+    def _push(self, token: str, repo: str, branch: str, paths: list[str]) -> str:
+        """Commit *paths* on top of *branch*; returns the new commit sha ("" when nothing changed)."""
+        if not token or not repo:
+            raise SyncError(_MISSING_CONFIG)
+        files = [(self._repo_path(p), _read_snapshot(p)) for p in paths if os.path.exists(p)]
+        if not files:
+            return ""
+        session = requests.Session()
+        session.headers.update({"Authorization": f"token {token}", "Accept": "application/vnd.github+json"})
+        base = f"{self.api_base}/repos/{repo}/git"
+
+        def call(method: str, url: str, **kwargs) -> dict:
+            resp = session.request(method, url, timeout=30, **kwargs)
+            if resp.status_code not in (200, 201):
+                try:
+                    detail = resp.json().get("message", resp.text)
+                except ValueError:
+                    detail = resp.text
+                raise SyncError(f"{method} {url.rsplit('/git/', 1)[-1]} → {resp.status_code}：{detail}")
+            return resp.json()
+
+        blobs = [
+            {"path": name, "mode": "100644", "type": "blob",
+             "sha": call("POST", f"{base}/blobs", json={"content": base64.b64encode(data).decode(), "encoding": "base64"})["sha"]}
+            for name, data in files
+        ]
+        message = f"Auto sync {len(files)} file(s) from TimeLab System: " + ", ".join(name for name, _ in files[:5])
+        for attempt in range(3):
+            head = call("GET", f"{base}/ref/heads/{branch}")["object"]["sha"]
+            base_tree = call("GET", f"{base}/commits/{head}")["tree"]["sha"]
+            tree = call("POST", f"{base}/trees", json={"base_tree": base_tree, "tree": blobs})["sha"]
+            if tree == base_tree:
+                return ""
+            commit = call("POST", f"{base}/commits", json={"message": message, "tree": tree, "parents": [head]})["sha"]
+            try:
+                call("PATCH", f"{base}/refs/heads/{branch}", json={"sha": commit, "force": False})
+                return commit
+            except SyncError:
+                # 分支在這段期間被別人推進（非 fast-forward），重新以最新 HEAD 再做一次
+                if attempt == 2:
+                    raise
+
+
+_registry_lock = threading.Lock()
+_workers: dict[tuple[str, str], SyncWorker] = {}
+
+
+def get_worker(root_dir: str, api_base: str = DEFAULT_API_BASE, **kwargs) -> SyncWorker:
+    """Return the process-wide worker for *root_dir* (started on first use)."""
+    key = (os.path.abspath(root_dir), api_base)
+    with _registry_lock:
+        worker = _workers.get(key)
+        if worker is None:
+            worker = _workers[key] = SyncWorker(root_dir, api_base=api_base, **kwargs)
+        return worker
+
+
+def _self_check() -> None:
+    """Push three quickly-saved files to an in-process fake GitHub and expect one commit."""
+    import hashlib
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    objects: dict[str, dict] = {}
+    refs: dict[str, str] = {}
+    lock = threading.Lock()
+
+    def put(obj: dict) -> str:
+        sha = hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+        objects[sha] = obj
+        return sha
+
+    refs["main"] = put({"type": "commit", "tree": put({"type": "tree", "entries": {}}), "parents": []})
+
+    class FakeGitHub(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> dict:
+            return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        def do_GET(self):
+            tail = self.path.split("/git/", 1)[-1]
+            with lock:
+                if tail.startswith("ref/heads/"):
+                    return self._reply(200, {"object": {"sha": refs[tail[len("ref/heads/"):]]}})
+                if tail.startswith("commits/"):
+                    return self._reply(200, {"tree": {"sha": objects[tail[len("commits/"):]]["tree"]}})
+            self._reply(404, {"message": "Not Found"})
+
+        def do_POST(self):
+            tail, body = self.path.split("/git/", 1)[-1], self._body()
+            with lock:
+                if tail == "blobs":
+                    return self._reply(201, {"sha": put({"type": "blob", "content": body["content"]})})
+                if tail == "trees":
+                    entries = dict(objects[body["base_tree"]]["entries"])
+                    entries.update({e["path"]: e["sha"] for e in body["tree"]})
+                    return self._reply(201, {"sha": put({"type": "tree", "entries": entries})})
+                if tail == "commits":
+                    return self._reply(201, {"sha": put({"type": "commit", "tree": body["tree"], "parents": body["parents"]})})
+            self._reply(404, {"message": "Not Found"})
+
+        def do_PATCH(self):
+            tail, body = self.path.split("/git/", 1)[-1], self._body()
+            with lock:
+                refs[tail[len("refs/heads/"):]] = body["sha"]
+            self._reply(200, {"object": {"sha": body["sha"]}})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGitHub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, "attachments", "ab"))
+        names = ["projects.csv", "vendors.csv", "attachments/ab/abcdef"]
+        for name in names:
+            with open(os.path.join(root, name), "w", encoding="utf-8") as f:
+                f.write(f"content of {name}\n")
+        db = os.path.join(root, "forms.db")
+        with sqlite3.connect(db) as conn:
+            conn.execute("CREATE TABLE t (x)")
+        worker = SyncWorker(root, api_base=f"http://127.0.0.1:{server.server_address[1]}/api", debounce=0.2)
+        started = time.monotonic()
+        for name in names:
+            worker.enqueue(os.path.join(root, name))
+        worker.enqueue(db)
+        enqueue_ms = (time.monotonic() - started) * 1000
+        # 尚未設定時只留在佇列，不算失敗
+        assert not worker.flush(1) and worker.status().failures == 0 and worker.queue_depth() == 4, worker.status()
+        worker.configure("token", "owner/repo", "main")
+        assert worker.flush(10), worker.status()
+        status = worker.status()
+        tree = objects[objects[refs["main"]]["tree"]]["entries"]
+        assert status.commits == 1 and status.pending == 0, status
+        assert sorted(tree) == sorted(names + ["forms.db"]), tree
+        worker.enqueue(*[os.path.join(root, name) for name in names])
+        assert worker.queue_depth() == 0, "unchanged files should not be re-queued"
+        print(f"ok: 4 files in 1 commit {status.last_commit[:8]}, enqueue took {enqueue_ms:.2f} ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    _self_check()
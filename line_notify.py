@@ -0,0 +1,265 @@
+"""LINE 推播的背景發送佇列。
+
+原本 `send_line_message` 直接在畫面執行緒呼叫 LINE broadcast API（逾時 5 秒），
+批次核准 30 筆就要逐筆等待。這裡改為：通知先寫入本機 SQLite 佇列（重啟後仍會
+繼續發送），由背景執行緒送出；同一位簽核人的多筆「待簽核」通知會在短時間內
+合併成一則摘要。發送失敗以指數退避重試，超過次數才記為失敗；累計的成功／失敗
+數量可由 `stats()` 取得。
+
+直接執行本檔（`python line_notify.py`）會對本機假 LINE 伺服器做一次自我檢查。
+"""
+
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import requests
+
+BROADCAST_URL = "https://api.line.me/v2/bot/message/broadcast"
+MAX_TEXT_LENGTH = 5000
+
+
+@dataclass
+class DispatchStats:
+    pending: int
+    sent: int
+    failed: int
+    last_error: str
+
+
+@contextmanager
+def _connect(path: str) -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _digest_text(header: str, lines: list[str]) -> str:
+    text = header.replace("{count}", str(len(lines)))
+    more = f"\n…等共 {len(lines)} 筆"
+    for line in lines:
+        if len(text) + len(line) + 1 + len(more) > MAX_TEXT_LENGTH:
+            return text + more
+        text += "\n" + line
+    return text
+
+
+class LineDispatcher:
+    """Persisted LINE broadcast queue drained by a background thread."""
+
+    def __init__(
+        self,
+        queue_path: str,
+        endpoint: str = BROADCAST_URL,
+        digest_window: float = 5.0,
+        max_attempts: int = 6,
+        max_backoff: float = 300.0,
+    ) -> None:
+        self.queue_path = queue_path
+        self.endpoint = endpoint
+        self.digest_window = digest_window
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self._token = ""
+        self._last_error = ""
+        self._wake = threading.Event()
+        with _connect(queue_path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL,"
+                " digest_key TEXT NOT NULL DEFAULT '', header TEXT NOT NULL DEFAULT '', line TEXT NOT NULL DEFAULT '',"
+                " text TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._thread = threading.Thread(target=self._run, name="line-notify", daemon=True)
+        self._thread.start()
+
+    def configure(self, token: str) -> None:
+        """Set the channel token; queued messages wait (without using up retries) until one is set."""
+        if token != self._token:
+            self._token = token
+            self._wake.set()
+
+    def notify(self, text: str, digest_key: str = "", digest_header: str = "", digest_line: str = "") -> None:
+        """Queue *text*; messages sharing *digest_key* inside the digest window are merged.
+
+        A merged message is *digest_header* (``{count}`` is replaced by the number of
+        events) followed by each event's *digest_line*.
+        """
+        with _connect(self.queue_path) as conn:
+            conn.execute(
+                "INSERT INTO outbox (created, digest_key, header, line, text) VALUES (?, ?, ?, ?, ?)",
+                (time.time(), digest_key, digest_header, digest_line, text),
+            )
+        self._wake.set()
+
+    def stats(self) -> DispatchStats:
+        with _connect(self.queue_path) as conn:
+            pending = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        return DispatchStats(pending, counters.get("sent", 0), counters.get("failed", 0), self._last_error)
+
+    # --- worker ----------------------------------------------------------
+
+    def _next_batch(self, conn: sqlite3.Connection, now: float) -> tuple[list[int], str, int]:
+        """Return (row ids, message text, attempts) for the next message that is due."""
+        rows = conn.execute(
+            "SELECT id, created, digest_key, header, line, text, attempts FROM outbox"
+            " WHERE next_attempt <= ? ORDER BY id",
+            (now,),
+        ).fetchall()
+        for row_id, created, key, header, line, text, attempts in rows:
+            if not key:
+                return [row_id], text, attempts
+            if created + self.digest_window > now and attempts == 0:
+                continue
+            group = [r for r in rows if r[2] == key]
+            if len(group) == 1:
+                return [row_id], text, attempts
+            return [r[0] for r in group], _digest_text(header, [r[4] for r in group]), max(r[6] for r in group)
+        return [], "", 0
+
+    def _sleep_seconds(self, conn: sqlite3.Connection, now: float) -> Optional[float]:
+        row = conn.execute(
+            "SELECT MIN(CASE WHEN digest_key != '' AND attempts = 0 THEN MAX(next_attempt, created + ?)"
+            " ELSE next_attempt END) FROM outbox",
+            (self.digest_window,),
+        ).fetchone()
+        return None if row[0] is None else max(0.05, row[0] - now)
+
+    def _bump(self, conn: sqlite3.Connection, name: str, amount: int = 1) -> None:
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (name, amount, amount),
+        )
+
+    def _send(self, text: str) -> None:
+        resp = requests.post(
+            self.endpoint,
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self._token}"},
+            json={"messages": [{"type": "text", "text": text}]},
+            timeout=10,
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(f"LINE 回應 {resp.status_code}：{resp.text[:200]}")
+
+    def _run(self) -> None:
+        while True:
+            # 先清除喚醒旗標再檢查佇列，避免漏接檢查期間送進來的通知
+            self._wake.clear()
+            if not self._token:
+                # 重啟後尚未有頁面提供 Token：保留佇列，等 configure 喚醒
+                self._wake.wait()
+                continue
+            now = time.time()
+            try:
+                with _connect(self.queue_path) as conn:
+                    ids, text, attempts = self._next_batch(conn, now)
+                    wait = None if ids else self._sleep_seconds(conn, now)
+            except sqlite3.Error as e:
+                self._last_error = str(e)
+                ids, wait = [], 5.0
+            if not ids:
+                self._wake.wait(wait)
+                continue
+            try:
+                self._send(text)
+                error = ""
+            except Exception as e:
+                error = str(e)
+            marks = ",".join("?" for _ in ids)
+            with _connect(self.queue_path) as conn:
+                if not error:
+                    conn.execute(f"DELETE FROM outbox WHERE id IN ({marks})", ids)
+                    self._bump(conn, "sent")
+                    self._last_error = ""
+                elif attempts + 1 >= self.max_attempts:
+                    conn.execute(f"DELETE FROM outbox WHERE id IN ({marks})", ids)
+                    self._bump(conn, "failed")
+                    self._last_error = error
+                else:
+                    delay = min(self.max_backoff, 2.0 * 2 ** attempts)
+                    conn.execute(
+                        f"UPDATE outbox SET attempts = ?, next_attempt = ? WHERE id IN ({marks})",
+                        [attempts + 1, time.time() + delay] + ids,
+                    )
+                    self._last_error = error
+
+
+_registry_lock = threading.Lock()
+_dispatchers: dict[str, LineDispatcher] = {}
+
+
+def get_dispatcher(queue_path: str, **kwargs) -> LineDispatcher:
+    """Return the process-wide dispatcher for *queue_path* (started on first use)."""
+    key = os.path.abspath(queue_path)
+    with _registry_lock:
+        dispatcher = _dispatchers.get(key)
+        if dispatcher is None:
+            dispatcher = _dispatchers[key] = LineDispatcher(queue_path, **kwargs)
+        return dispatcher
+
+
+def _self_check() -> None:
+    """Queue 30 approvals for one approver against a flaky fake LINE server; expect one digest."""
+    import json
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    received: list[str] = []
+    calls = {"n": 0}
+
+    class FakeLine(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            calls["n"] += 1
+            status = 500 if calls["n"] == 1 else 200  # 第一次故意失敗以驗證重試
+            if status == 200:
+                received.append(body["messages"][0]["text"])
+            self.send_response(status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLine)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        dispatcher = LineDispatcher(
+            os.path.join(tmp, "outbox.db"), endpoint=f"http://127.0.0.1:{server.server_address[1]}/broadcast",
+            digest_window=0.3,
+        )
+        dispatcher.configure("token")
+        started = time.monotonic()
+        for i in range(30):
+            dispatcher.notify(
+                f"單號 F{i:02d} 需要財務長簽核", digest_key="pending:Charles",
+                digest_header="🔔【待簽核提醒】以下 {count} 筆表單需要財務長 (Charles) 簽核：", digest_line=f"F{i:02d}",
+            )
+        dispatcher.notify("單筆通知")
+        enqueue_ms = (time.monotonic() - started) * 1000
+        deadline = time.monotonic() + 15
+        while dispatcher.stats().pending and time.monotonic() < deadline:
+            time.sleep(0.1)
+        stats = dispatcher.stats()
+        assert stats.pending == 0 and stats.sent == 2 and stats.failed == 0, stats
+        assert any("30 筆" in text for text in received), received
+        print(f"ok: 31 events → {stats.sent} messages after 1 retry, enqueue took {enqueue_ms:.1f} ms")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    _self_check()
@@ -0,0 +1,104 @@
+"""清單分頁與搜尋。
+
+申請追蹤清單與簽核清單原本逐列 `iterrows` 建立容器、欄位與好幾個按鈕，直式手機的
+卡片又把每一列再畫一次；歷史單據一多，每次重跑頁面就要建立上千個元件。這裡先在
+伺服器端（已快取的 DataFrame 上）依搜尋字串整欄篩選、切出目前這一頁，頁面只為這一
+頁的單據建立操作按鈕；手機卡片與桌機欄位清單共用同一個分頁結果。
+
+搜尋框比對單號、專案名稱與廠商（不分大小寫，以空白分隔的每個關鍵字都要出現）；
+Streamlit 的文字框在按 Enter 或離開欄位時才重跑，所以是「輸入後即搜尋」。
+每頁筆數可選，搜尋字串或每頁筆數改變時回到第一頁。
+
+直接執行本檔（`python list_pager.py`）會檢查搜尋與分頁計算。
+"""
+
+from __future__ import annotations
+
+from typing import Iterable
+
+import pandas as pd
+import streamlit as st
+
+PAGE_SIZES = (10, 20, 50, 100)
+DEFAULT_PAGE_SIZE = 20
+SEARCH_COLUMNS = ("單號", "專案名稱", "請款廠商")
+
+
+def filter_rows(df: pd.DataFrame, query: str, columns: Iterable[str] = SEARCH_COLUMNS) -> pd.DataFrame:
+    """Keep rows where every word of *query* appears in one of *columns* (case-insensitive)."""
+    terms = str(query or "").split()
+    columns = [c for c in columns if c in df.columns]
+    if not terms or not columns or df.empty:
+        return df
+    texts = [df[c].fillna("").astype(str) for c in columns]
+    keep = pd.Series(True, index=df.index)
+    for term in terms:
+        hit = pd.Series(False, index=df.index)
+        for text in texts:
+            hit |= text.str.contains(term, case=False, regex=False)
+        keep &= hit
+    return df[keep]
+
+
+def page_bounds(total: int, page: int, size: int) -> tuple[int, int, int, int]:
+    """Return (page clamped to range, page count, start row, stop row) for 1-based *page*."""
+    pages = max(1, -(-total // size))
+    page = min(max(int(page), 1), pages)
+    start = (page - 1) * size
+    return page, pages, start, min(start + size, total)
+
+
+def paginate(
+    df: pd.DataFrame,
+    key: str,
+    columns: Iterable[str] = SEARCH_COLUMNS,
+    page_sizes: tuple[int, ...] = PAGE_SIZES,
+    default_size: int = DEFAULT_PAGE_SIZE,
+) -> pd.DataFrame:
+    """Render the search box, page size and page picker; return only the visible rows.
+
+    The original index is kept, so row keys built from it stay unique across pages.
+    """
+    c_search, c_size, c_page = st.columns([4, 1.3, 1.3])
+    query = c_search.text_input(
+        "搜尋", key=f"{key}_query", placeholder="🔍 搜尋單號／專案名稱／廠商", label_visibility="collapsed"
+    )
+    size = c_size.selectbox(
+        "每頁筆數", page_sizes, index=page_sizes.index(default_size), key=f"{key}_size",
+        format_func=lambda n: f"每頁 {n} 筆", label_visibility="collapsed",
+    )
+    rows = filter_rows(df, query, columns)
+
+    page_key, filter_key = f"{key}_page", f"{key}_filter"
+    if st.session_state.get(filter_key) != (query, size):
+        st.session_state[filter_key] = (query, size)
+        st.session_state[page_key] = 1
+    # 資料變少（簽核、刪除）時頁碼可能超出範圍，先校正再建立元件
+    page, pages, start, stop = page_bounds(len(rows), st.session_state.get(page_key, 1), size)
+    st.session_state[page_key] = page
+    c_page.number_input("頁數", min_value=1, max_value=pages, step=1, key=page_key, label_visibility="collapsed")
+    if len(rows):
+        st.caption(f"共 {len(rows)} 筆，第 {page} / {pages} 頁（第 {start + 1}–{stop} 筆）")
+    return rows.iloc[start:stop]
+
+
+def _self_check() -> None:
+    df = pd.DataFrame({
+        "單號": ["20250101-01", "20250101-02", "20250102-01", "20250103-01"],
+        "專案名稱": ["信義案 Phase A", "大安案", None, "信義案 Phase B"],
+        "請款廠商": ["木作行", "水電行", "木作行", ""],
+    })
+    assert filter_rows(df, "").equals(df)
+    assert list(filter_rows(df, "信義")["單號"]) == ["20250101-01", "20250103-01"]
+    assert list(filter_rows(df, "phase 木作")["單號"]) == ["20250101-01"]  # 每個關鍵字都要出現，不分大小寫
+    assert list(filter_rows(df, "0102")["單號"]) == ["20250102-01"]
+    assert filter_rows(df, "[(").empty  # 不當作正規表示式
+    assert page_bounds(0, 3, 20) == (1, 1, 0, 0)
+    assert page_bounds(45, 3, 20) == (3, 3, 40, 45)
+    assert page_bounds(45, 9, 20) == (3, 3, 40, 45)
+    assert page_bounds(40, 0, 20) == (1, 2, 0, 20)
+    print("ok: search and page bounds")
+
+
+if __name__ == "__main__":
+    _self_check()
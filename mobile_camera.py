@@ -21,8 +21,23 @@ class MobileCameraUpload:
         return self.data
 
 
-def mobile_camera_input(label, key):
-    value = _COMPONENT(label=label, key=key, default=None)
+# 手機端先縮圖壓縮再回傳：最長邊、JPEG 畫質與目標檔案大小（超過時瀏覽器會再降畫質／尺寸）
+MAX_DIMENSION = 1600
+JPEG_QUALITY = 0.8
+MAX_BYTES = 600_000
+
+
+def mobile_camera_input(label, key, max_dimension=MAX_DIMENSION, quality=JPEG_QUALITY, max_bytes=MAX_BYTES, grayscale=False, allow_grayscale=False):
+    """Camera/photo picker that downscales and JPEG-compresses on the phone before upload.
+
+    grayscale turns on document mode by default; allow_grayscale shows the toggle so
+    the user can switch it for receipts.
+    """
+    value = _COMPONENT(
+        label=label, key=key, default=None,
+        max_dimension=int(max_dimension), quality=float(quality), max_bytes=int(max_bytes),
+        grayscale=bool(grayscale), allow_grayscale=bool(allow_grayscale or grayscale),
+    )
     if not isinstance(value, dict) or not value.get("data"):
         return None
     try:
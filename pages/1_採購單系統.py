@@ -6,6 +6,16 @@ import base64
 import time
 import requests  
 import json 
+import form_store
+import form_conversion
+import frame_clean
+import attachment_store
+import export_store
+import avatar_store
+import data_cache
+import atomic_io
+import presence
+import line_notify
 from ai_assistant import render_ai_operations_assistant
 
 # --- 強制系統身分鎖定 ---
@@ -97,10 +107,18 @@ input, textarea { color: var(--ink) !important; }
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 B_DIR = os.path.dirname(CURRENT_DIR) 
 D_FILE = os.path.join(B_DIR, "database.csv")
+FORMS_DB = os.path.join(B_DIR, "forms.db")
 S_FILE = os.path.join(B_DIR, "staff_v2.csv")
-O_FILE = os.path.join(B_DIR, "online.csv")
+O_FILE = os.path.join(B_DIR, "online_heartbeat.tsv")
 L_FILE = os.path.join(B_DIR, "line_credentials.txt") 
 
+# 表單改存於 SQLite；第一次開啟時自動匯入舊的 database.csv
+form_store.open_store(FORMS_DB, D_FILE)
+# ★ LINE 推播與請款單系統共用同一個背景佇列
+LINE_NOTIFY = line_notify.get_dispatcher(os.path.join(B_DIR, "line_outbox.db"))
+# 附件改存 attachments/（依內容 SHA-256 去重），舊的 base64 附件第一次開啟時搬出
+attachment_store.migrate_forms(FORMS_DB)
+
 # 定義核心角色
 ADMINS = ["Anita"]
 CFO_NAME = "Charles"
@@ -120,25 +138,18 @@ def clean_name(val):
     if pd.isna(val) or val is None or str(val).strip() == "": return ""
     return str(val).strip().split(" ")[0]
 
+# ★ 在線名單改由 presence 在記憶體維護、各工作階段共用；心跳檔只偶爾附加一行，不再每次點擊都改寫檔案
+ONLINE = presence.registry(O_FILE)
+SYS_NAME = "採購單系統"
+
 def get_online_users(curr_user):
-    try:
-        if not curr_user: return 1
-        now = time.time()
-        df = pd.DataFrame(columns=["user", "time"])
-        if os.path.exists(O_FILE):
-            try: df = pd.read_csv(O_FILE)
-            except: pass
-        if "user" not in df.columns or "time" not in df.columns:
-            df = pd.DataFrame(columns=["user", "time"])
-        df = df[df["user"] != curr_user]
-        df = pd.concat([df, pd.DataFrame([{"user": curr_user, "time": now}])], ignore_index=True)
-        df["time"] = pd.to_numeric(df["time"], errors='coerce').fillna(now)
-        df = df[now - df["time"] <= 300]
-        try: df.to_csv(O_FILE, index=False)
-        except: pass
-        return len(df["user"].unique())
+    try: ONLINE.touch(SYS_NAME, curr_user); return max(ONLINE.count(), 1)
     except: return 1
 
+def system_online_counts():
+    try: return ONLINE.counts()
+    except: return {}
+
 def get_line_credentials():
     if os.path.exists(L_FILE):
         try:
@@ -150,61 +161,123 @@ def get_line_credentials():
 
 def save_line_credentials(token, user_id):
     try:
-        with open(L_FILE, "w", encoding="utf-8") as f:
-            f.write(f"{token.strip()}\n{user_id.strip()}")
+        atomic_io.write_text(L_FILE, f"{token.strip()}\n{user_id.strip()}")
     except: pass
 
-def send_line_message(msg, target_name=""):
+# ★ 只寫入背景佇列，不再阻塞畫面；同一位 target_name 短時間內的多筆提醒會合併成一則摘要
+def send_line_message(msg, target_name="", digest_line=""):
     token, _ = get_line_credentials()
     if not token: return  
-    url = "https://api.line.me/v2/bot/message/broadcast"
-    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
-    try: requests.post(url, headers=headers, json={"messages": [{"type": "text", "text": msg}]}, timeout=5)
+    LINE_NOTIFY.configure(token)
+    try:
+        if target_name: LINE_NOTIFY.notify(msg, f"sign:{target_name}", f"🔔【待簽核提醒】\n共 {{count}} 筆表單需要{target_name} 進行簽核：", digest_line)
+        else: LINE_NOTIFY.notify(msg)
     except: pass
 
+# ★ 依檔案修改時間快取解析結果，檔案未變動時不再重新解析
 def read_csv_robust(filepath):
-    if not os.path.exists(filepath): return None
-    for enc in ['utf-8-sig', 'utf-8', 'cp950', 'big5']:
-        try: return pd.read_csv(filepath, encoding=enc, dtype=str).fillna("")
-        except: continue
-    return pd.DataFrame()
-
-def load_data():
-    cols = ["單號", "日期", "類型", "申請人", "代申請人", "專案負責人", "專案名稱", "專案編號", 
-            "請款說明", "總金額", "幣別", "付款方式", "請款廠商", "匯款帳戶", 
-            "帳戶影像Base64", "狀態", "影像Base64", "提交時間", "申請人信箱",
-            "初審人", "初審時間", "複審人", "複審時間", "刪除人", "刪除時間", 
-            "刪除原因", "駁回原因", "匯款狀態", "匯款日期",
-            "支付條件", "支付期數", "請款狀態", "已請款金額", "尚未請款金額", "最後採購金額"]
-    df = read_csv_robust(D_FILE)
-    if df is None or df.empty: return pd.DataFrame(columns=cols)
-    if "專案執行人" in df.columns: df = df.rename(columns={"專案執行人": "專案負責人"})
-    for c in cols:
-        if c not in df.columns: df[c] = ""
-    for col in ["總金額", "已請款金額", "尚未請款金額", "最後採購金額"]:
-        df[col] = df[col].apply(clean_amount)
-    df["專案負責人"] = df["專案負責人"].astype(str).apply(clean_name)
-    df["申請人"] = df["申請人"].astype(str).apply(clean_name)
-    df["代申請人"] = df["代申請人"].astype(str).apply(clean_name)
+    return data_cache.read_csv(filepath)
+
+def _read_forms(where):
+    return _clean_forms(form_store.load_forms(FORMS_DB, where=where))
+
+def _clean_forms(df):
+    # ★ 整欄清理姓名，不再逐格 apply(clean_name)
+    for col in ["專案負責人", "申請人", "代申請人"]: df[col] = frame_clean.clean_names(df[col])
     df["狀態"] = df["狀態"].astype(str).str.strip()
-    return df[cols]
+    return df
 
-def save_data(df):
+# 「幣別 $金額」顯示字串，整欄計算
+def amount_labels(df):
+    cur = df["幣別"].astype(str).str.replace("nan", "TWD") if "幣別" in df.columns else pd.Series("TWD", index=df.index)
+    return cur + " $" + frame_clean.clean_amounts(df["總金額"]).map("{:,.0f}".format)
+
+def load_data(where=None):
+    try: return data_cache.load(FORMS_DB, lambda: _read_forms(where), ("forms", str(where)))
+    except Exception: return pd.DataFrame(columns=form_store.FORM_COLUMNS)
+
+# ★ 待簽核清單與數量直接查 inbox 索引，不必篩選整張表單；approver=None 為全部簽核人
+def load_pending(statuses, approver=None):
+    columns = form_store.FORM_COLUMNS + [form_store.VERSION_COLUMN]  # 簽核時以版本確認單據沒被其他人改過
+    try: return data_cache.load(FORMS_DB, lambda: _clean_forms(form_store.load_inbox(FORMS_DB, "採購單", statuses, approver, columns)), ("inbox", tuple(statuses), approver))
+    except Exception: return pd.DataFrame(columns=form_store.FORM_COLUMNS)
+
+def my_pending_count():
     try:
-        for col in ["總金額", "已請款金額", "尚未請款金額", "最後採購金額"]:
-            df[col] = df[col].apply(clean_amount)
-        df["專案負責人"] = df["專案負責人"].astype(str).apply(clean_name)
-        df.reset_index(drop=True).to_csv(D_FILE, index=False, encoding='utf-8-sig')
-    except PermissionError:
-        st.error("⚠️ 警告：無法寫入檔案！請關閉 Excel。")
+        n = form_store.inbox_count(FORMS_DB, "採購單", ["待簽核", "待初審"], curr_name)
+        return n + form_store.inbox_count(FORMS_DB, "採購單", ["待複審"]) if curr_name == CFO_NAME else n
+    except Exception: return 0
+
+# ★ 單筆異動只更新該列，不再整份讀出再整份寫回
+def form_version(form_id):
+    r = form_store.get_form(FORMS_DB, form_id)
+    return None if r is None else r[form_store.VERSION_COLUMN]
+
+# ★ expected_version：開啟編輯時的版本，期間若被別人改過就拒絕寫入
+def save_form_fields(form_id, values, expected_version=None):
+    try: form_store.update_form(FORMS_DB, form_id, values, expected_version)
+    except form_store.VersionConflict as e:
+        st.error(f"⚠️ 單據 {e.form_ids[0]} 在您編輯期間已被其他人修改，為避免覆蓋對方的變更，本次未存檔。請取消修改後重新開啟。")
         st.stop()
+    except Exception as e:
+        st.error(f"⚠️ 警告：無法寫入資料庫！錯誤：{e}")
+        st.stop()
+    data_cache.invalidate(FORMS_DB)
+
+# ★ 簽核關卡：待簽核／待初審 →（執行長）→ 已核准；待複審 →（財務長）→ 已核准
+CEO_SIGN_STATES = ["待簽核", "待初審"]
+
+def ceo_allowed(row): return is_active and clean_name(row["專案負責人"]) == curr_name
+
+def cfo_allowed(row): return is_active and curr_name == CFO_NAME
+
+# ★ 簽核／駁回：一次交易內確認狀態、權限與畫面上的版本再更新，兩人同時簽核時後到者不會蓋掉前者
+def sign_form(r, from_states, to_state, fields, allowed):
+    try:
+        res = form_store.transition_forms(FORMS_DB, [r["單號"]], from_states, to_state, fields, allowed=allowed, expected_versions={r["單號"]: r[form_store.VERSION_COLUMN]})[r["單號"]]
+    except Exception as e:
+        st.error(f"⚠️ 警告：無法寫入資料庫！錯誤：{e}")
+        st.stop()
+    data_cache.invalidate(FORMS_DB)
+    if res == "conflict": st.error(f"⚠️ 單據 {r['單號']} 已被其他人修改，本次未簽核。請重新檢視後再操作。")
+    elif res != "ok": st.warning(f"⚠️ {r['單號']} 未處理：{ {'missing': '找不到單號', 'wrong_state': '狀態已變更', 'denied': '無簽核權限'}.get(res, res)}")
+    return res == "ok"
+
+def save_forms_fields(updates, new_forms=()):
+    try: form_store.update_forms(FORMS_DB, updates, new_forms)
+    except Exception as e:
+        st.error(f"⚠️ 警告：無法寫入資料庫！錯誤：{e}")
+        st.stop()
+    data_cache.invalidate(FORMS_DB)
+
+# ★ 採購單轉請款單：餘額比對、單號配發與寫入由 form_conversion 整批處理
+def po_to_payment_form(po, amount, new_id):
+    return {"單號": new_id, "日期": str(datetime.date.today()), "類型": "請款單", "申請人": "Anita", "代申請人": "", "專案負責人": po.get("專案負責人",""), "專案名稱": po.get("專案名稱",""), "專案編號": po.get("專案編號",""), "請款說明": f"自採購單 {po['單號']} 轉換 (轉換金額: {amount})", "總金額": amount, "幣別": po.get("幣別") or "TWD", "付款方式": po.get("付款方式",""), "請款廠商": po.get("請款廠商",""), "匯款帳戶": po.get("匯款帳戶",""), "帳戶影像Base64": po.get("帳戶影像Base64",""), "狀態": "已儲存", "影像Base64": po.get("影像Base64",""), "申請人信箱": "Anita", "已請款金額": 0, "尚未請款金額": 0, "最後採購金額": 0}
+
+PO_TO_PAYMENT = form_conversion.ConversionRule(available=form_conversion.balance_from_final, id_prefix=lambda po: datetime.date.today().strftime('%Y%m%d'), build=po_to_payment_form, status="已轉請款單")
+
+def convert_forms(requests, rule):
+    try: report = form_conversion.convert_forms(FORMS_DB, requests, rule)
+    except Exception as e:
+        st.error(f"⚠️ 警告：無法寫入資料庫！錯誤：{e}")
+        st.stop()
+    data_cache.invalidate(FORMS_DB)
+    return report
+
+def add_form(values):
+    try: form_store.insert_form(FORMS_DB, values)
+    except Exception as e:
+        st.error(f"⚠️ 警告：無法寫入資料庫！錯誤：{e}")
+        st.stop()
+    data_cache.invalidate(FORMS_DB)
 
 def load_staff():
+    avatar_store.migrate_staff_csv(S_FILE)
     default_df = pd.DataFrame({"name": DEFAULT_STAFF, "status": ["在職"]*5, "password": ["0000"]*5, "avatar": [""]*5, "line_uid": [""]*5})
     df = read_csv_robust(S_FILE)
     if df is None or df.empty:
         df = default_df.copy()
-        df.to_csv(S_FILE, index=False, encoding='utf-8-sig')
+        atomic_io.write_csv(df, S_FILE); data_cache.invalidate(S_FILE)
         return df
     if "status" not in df.columns: df["status"] = "在職"
     if "avatar" not in df.columns: df["avatar"] = ""
@@ -215,7 +288,8 @@ def load_staff():
     return df
 
 def save_staff(df):
-    df.reset_index(drop=True).to_csv(S_FILE, index=False, encoding='utf-8-sig')
+    atomic_io.write_csv(df.reset_index(drop=True), S_FILE)
+    data_cache.invalidate(S_FILE)
 
 def get_b64_logo():
     try:
@@ -260,23 +334,27 @@ curr_name = st.session_state.user_id
 is_active = (st.session_state.user_status == "在職")
 is_admin = (curr_name in ADMINS)
 
-avatar_b64 = ""
+# ★ 只在側邊欄顯示時讀取目前使用者的大頭貼縮圖
+avatar_src = ""
 try:
     curr_user_row = st.session_state.staff_df[st.session_state.staff_df["name"] == curr_name].iloc[0]
-    avatar_b64 = curr_user_row.get("avatar", "")
+    avatar_src = avatar_store.avatar_url(curr_user_row.get("avatar", ""))
 except: pass
 
 # --- 左側側邊欄 (與請款單系統 100% 一致) ---
 st.sidebar.markdown(f"**📌 目前系統：** `{st.session_state.sys_choice}`")
 st.sidebar.divider()
 
-if avatar_b64:
-    st.sidebar.markdown(f'<div style="display: flex; align-items: center; gap: 12px; margin-bottom: 15px;"><img src="data:image/jpeg;base64,{avatar_b64}" style="width: 60px; height: 60px; border-radius: 50%; object-fit: cover; border: 3px solid #eee; box-shadow: 0 2px 4px rgba(0,0,0,0.1);"><span style="font-size: 22px; font-weight: bold; color: #333;">{curr_name}</span></div>', unsafe_allow_html=True)
+if avatar_src:
+    st.sidebar.markdown(f'<div style="display: flex; align-items: center; gap: 12px; margin-bottom: 15px;"><img src="{avatar_src}" style="width: 60px; height: 60px; border-radius: 50%; object-fit: cover; border: 3px solid #eee; box-shadow: 0 2px 4px rgba(0,0,0,0.1);"><span style="font-size: 22px; font-weight: bold; color: #333;">{curr_name}</span></div>', unsafe_allow_html=True)
 else:
     st.sidebar.markdown(f"### 👤 {curr_name}")
 
 online_count = get_online_users(curr_name)
-st.sidebar.info(f"🟢 目前在線人數：**{online_count}** 人")
+online_by_system = "｜".join(f"{k} {v} 人" for k, v in system_online_counts().items())
+st.sidebar.info(f"🟢 目前在線人數：**{online_count}** 人" + (f"\n\n{online_by_system}" if online_by_system else ""))
+pending_count = my_pending_count()
+if pending_count: st.sidebar.warning(f"📥 待您簽核：**{pending_count}** 筆")
 
 if not is_active: st.sidebar.error("⛔ 已離職")
 
@@ -284,10 +362,10 @@ with st.sidebar.expander("📸 修改大頭貼"):
     new_avatar = st.file_uploader("上傳您的圖片", type=["jpg", "jpeg", "png"])
     if st.button("更新大頭貼", disabled=not is_active):
         if new_avatar is not None:
-            b64 = base64.b64encode(new_avatar.getvalue()).decode()
+            ref = avatar_store.store_avatar(new_avatar.getvalue())
             staff_df = st.session_state.staff_df
             idx = staff_df[staff_df["name"] == curr_name].index[0]
-            staff_df.at[idx, "avatar"] = b64
+            staff_df.at[idx, "avatar"] = ref
             save_staff(staff_df)
             st.session_state.staff_df = staff_df
             st.success("大頭貼已更新！")
@@ -367,8 +445,8 @@ if 'menu_radio' in st.session_state and st.session_state.menu_radio not in menu_
 menu = st.sidebar.radio("工作項目", menu_options, key="menu_radio")
 
 def get_filtered_db():
-    db = load_data()
-    return db[db["類型"] == "採購單"]
+    # 由資料庫端先篩選採購單，不再讀出全部表單
+    return load_data(where={"類型": "採購單"})
 
 # --- HTML 渲染 ---
 def render_html(row):
@@ -400,10 +478,11 @@ def render_html(row):
     h += f'<tr><td colspan="3" align="right">預計採購金額</td><td align="right">{c_cur} {amt:,.0f}</td></tr>'
     h += f'<tr><td colspan="3" align="right">實付</td><td align="right">{c_cur} {amt-fee:,.0f}</td></tr></table>'
     
-    if row.get('帳戶影像Base64'):
+    acc_b64 = attachment_store.cell_to_b64(row.get('帳戶影像Base64'))
+    if acc_b64:
         h += '<br><b>存摺：</b><br>'
-        if is_pdf(row['帳戶影像Base64']): h += f'<embed src="data:application/pdf;base64,{row["帳戶影像Base64"]}" width="100%" height="300px" type="application/pdf">'
-        else: h += f'<img src="data:image/jpeg;base64,{row["帳戶影像Base64"]}" width="100%">'
+        if is_pdf(acc_b64): h += f'<embed src="data:application/pdf;base64,{acc_b64}" width="100%" height="300px" type="application/pdf">'
+        else: h += f'<img src="data:image/jpeg;base64,{acc_b64}" width="100%">'
         
     if row["狀態"] == "已駁回" and str(row.get("駁回原因", "")) != "":
         h += f'<div style="color:red;border:1px solid red;padding:5px;margin-top:5px;"><b>❌ 駁回原因：</b>{row["駁回原因"]}</div>'
@@ -417,11 +496,10 @@ def render_upload_popover(container, r, prefix):
         new_f_acc = st.file_uploader("上傳新存摺", type=["png", "jpg", "jpeg", "pdf"], key=f"{prefix}_acc")
         new_f_ims = st.file_uploader("上傳新憑證", type=["png", "jpg", "jpeg", "pdf"], accept_multiple_files=True, key=f"{prefix}_ims")
         if st.button("💾 儲存附件", key=f"{prefix}_btn"):
-            fresh_db = load_data()
-            idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-            if new_f_acc: fresh_db.at[idx, "帳戶影像Base64"] = base64.b64encode(new_f_acc.getvalue()).decode()
-            if new_f_ims: fresh_db.at[idx, "影像Base64"] = "|".join([base64.b64encode(f.getvalue()).decode() for f in new_f_ims])
-            save_data(fresh_db)
+            upd = {}
+            if new_f_acc: upd["帳戶影像Base64"] = attachment_store.store_files([new_f_acc.getvalue()])
+            if new_f_ims: upd["影像Base64"] = attachment_store.store_files([f.getvalue() for f in new_f_ims])
+            save_form_fields(r["單號"], upd)
             st.success("附件已更新！"); time.sleep(0.5); st.rerun()
 
 # --- 頁面 1: 填寫申請單 ---
@@ -481,8 +559,9 @@ if menu == "1. 填寫申請單":
             del_acc = False
             if dv["ab64"]:
                 st.write("✅ 已有存摺")
-                if is_pdf(dv["ab64"]): display_pdf(dv["ab64"], height=250)
-                else: st.image(base64.b64decode(dv["ab64"]), width=200)
+                acc_b64 = attachment_store.cell_to_b64(dv["ab64"])
+                if is_pdf(acc_b64): display_pdf(acc_b64, height=250)
+                elif acc_b64: st.image(base64.b64decode(acc_b64), width=200)
                 del_acc = st.checkbox("❌ 刪除此存摺", key=f"da_{mode_suffix}")
             f_acc = st.file_uploader("上傳存摺 (支援圖片與PDF)", type=["png", "jpg", "jpeg", "pdf"], key=f"fa_{mode_suffix}")
             
@@ -497,23 +576,22 @@ if menu == "1. 填寫申請單":
                 if not (pn and pi and amt>0 and desc):
                     st.error("請確認必填欄位 (專案名稱、編號、金額、說明) 已填寫")
                 else:
-                    b_acc = base64.b64encode(f_acc.getvalue()).decode() if f_acc else ("" if del_acc else dv["ab64"])
-                    b_ims = "|".join([base64.b64encode(f.getvalue()).decode() for f in f_ims]) if f_ims else ("" if del_ims else dv["ib64"])
+                    b_acc = attachment_store.store_files([f_acc.getvalue()]) if f_acc else ("" if del_acc else dv["ab64"])
+                    b_ims = attachment_store.store_files([f.getvalue() for f in f_ims]) if f_ims else ("" if del_ims else dv["ib64"])
                     proxy_val = curr_name if app_val != curr_name else ""
                     
                     if st.session_state.edit_id:
-                        idx = db[db["單號"]==st.session_state.edit_id].index[0]
-                        db.loc[idx, ["申請人", "代申請人", "專案名稱", "專案負責人", "專案編號", "總金額", "請款說明", "幣別", "付款方式", "請款廠商", "匯款帳戶", "帳戶影像Base64", "影像Base64", "支付條件", "支付期數", "最後採購金額", "請款狀態", "已請款金額", "尚未請款金額"]] = [app_val, proxy_val, pn, exe, pi, amt, desc, currency, pay, vdr, acc, b_acc, b_ims, pay_cond, pay_inst, final_amt, bill_stat, billed_amt, unbilled_amt]
+                        edit_cols = ["申請人", "代申請人", "專案名稱", "專案負責人", "專案編號", "總金額", "請款說明", "幣別", "付款方式", "請款廠商", "匯款帳戶", "帳戶影像Base64", "影像Base64", "支付條件", "支付期數", "最後採購金額", "請款狀態", "已請款金額", "尚未請款金額"]
+                        save_form_fields(st.session_state.edit_id, dict(zip(edit_cols, [app_val, proxy_val, pn, exe, pi, amt, desc, currency, pay, vdr, acc, b_acc, b_ims, pay_cond, pay_inst, final_amt, bill_stat, billed_amt, unbilled_amt])), st.session_state.get("edit_version"))
                         st.session_state.edit_id = None
                     else:
-                        today_str = datetime.date.today().strftime('%Y%m%d')
-                        next_num = len(db[db["單號"].astype(str).str.startswith(today_str)]) + 1 if not db.empty else 1
-                        tid = f"{today_str}-{next_num:02d}"
+                        # ★ 單號由資料庫序號配發，同時存檔或刪單後都不會重複
+                        tid = form_store.new_form_id(FORMS_DB, datetime.date.today().strftime('%Y%m%d'))
                         nr = {"單號":tid, "日期":str(datetime.date.today()), "類型":sys_save_type, "申請人":app_val, "代申請人":proxy_val, "專案負責人":exe, "專案名稱":pn, "專案編號":pi, "請款說明":desc, "總金額":amt, "幣別":currency, "付款方式":pay, "請款廠商":vdr, "匯款帳戶":acc, "帳戶影像Base64":b_acc, "狀態":"已儲存", "影像Base64":b_ims, "提交時間":"", "申請人信箱":curr_name, "初審人":"", "初審時間":"", "複審人":"", "複審時間":"", "刪除人":"", "刪除時間":"", "刪除原因":"", "駁回原因":"", "支付條件": pay_cond, "支付期數": pay_inst, "請款狀態": bill_stat, "已請款金額": billed_amt, "尚未請款金額": amt, "最後採購金額": final_amt}
-                        db = pd.concat([db, pd.DataFrame([nr])], ignore_index=True)
+                        add_form(nr)
                         st.session_state.last_id = tid
                         st.session_state.form_key += 1
-                    save_data(db); st.success("成功"); st.rerun()
+                    st.success("成功"); st.rerun()
 
         if st.session_state.last_id:
             c1, c2, c3, c4, c5 = st.columns(5)
@@ -523,17 +601,16 @@ if menu == "1. 填寫申請單":
 
             if c1.button("🚀 提交", disabled=not can_edit_or_submit):
                 idx = temp_db[temp_db["單號"]==st.session_state.last_id].index[0]
-                temp_db.loc[idx, ["狀態", "提交時間", "初審人", "初審時間", "複審人", "複審時間", "駁回原因"]] = ["待簽核", get_taiwan_time(), "", "", "", "", ""]
-                save_data(temp_db)
+                save_form_fields(st.session_state.last_id, {"狀態": "待簽核", "提交時間": get_taiwan_time(), "初審人": "", "初審時間": "", "複審人": "", "複審時間": "", "駁回原因": ""})
                 exe_name = clean_name(temp_db.at[idx, "專案負責人"])
-                send_line_message(f"🔔【待簽核提醒】\n單號：{st.session_state.last_id}\n專案名稱：{temp_db.at[idx, '專案名稱']}\n有一筆新的表單需要負責執行長 ({exe_name}) 進行簽核！")
+                send_line_message(f"🔔【待簽核提醒】\n單號：{st.session_state.last_id}\n專案名稱：{temp_db.at[idx, '專案名稱']}\n有一筆新的表單需要負責執行長 ({exe_name}) 進行簽核！", f"負責執行長 ({exe_name})", f"{st.session_state.last_id}｜{temp_db.at[idx, '專案名稱']}")
                 st.success("已成功提交，等待主管簽核！"); st.rerun()
             if c2.button("🔍 線上預覽"): st.session_state.view_id = st.session_state.last_id; st.rerun()
             if c3.button("🖨️ 線上列印"):
                 js = "var w=window.open();w.document.write('" + clean_for_js(render_html(temp_db[temp_db["單號"]==st.session_state.last_id].iloc[0])) + "');w.print();w.close();"
                 st.components.v1.html(f"<script>{js}</script>", height=0)
             if c4.button("✏️ 修改", disabled=not can_edit_or_submit):
-                st.session_state.edit_id = st.session_state.last_id; st.session_state.last_id = None; st.rerun()
+                st.session_state.edit_id = st.session_state.last_id; st.session_state.edit_version = form_version(st.session_state.edit_id); st.session_state.last_id = None; st.rerun()
             if c5.button("🆕 下一筆"): st.session_state.last_id = None; st.rerun()
 
         st.divider()
@@ -558,16 +635,14 @@ if menu == "1. 填寫申請單":
                 can_po_post_edit = (stt == "已核准" and is_active)
                 
                 if b1.button("提交", key=f"s{i}", disabled=not can_edit):
-                    fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-                    fresh_db.loc[idx, ["狀態", "提交時間", "初審人", "初審時間", "複審人", "複審時間", "駁回原因"]] = ["待簽核", get_taiwan_time(), "", "", "", "", ""]
-                    save_data(fresh_db)
-                    send_line_message(f"🔔【待簽核提醒】\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n有一筆新的表單需要負責執行長 ({clean_name(r['專案負責人'])}) 進行簽核！")
+                    save_form_fields(r["單號"], {"狀態": "待簽核", "提交時間": get_taiwan_time(), "初審人": "", "初審時間": "", "複審人": "", "複審時間": "", "駁回原因": ""})
+                    send_line_message(f"🔔【待簽核提醒】\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n有一筆新的表單需要負責執行長 ({clean_name(r['專案負責人'])}) 進行簽核！", f"負責執行長 ({clean_name(r['專案負責人'])})", f"{r['單號']}｜{r['專案名稱']}")
                     st.rerun()
                 if b2.button("預覽", key=f"v{i}"): st.session_state.view_id = r["單號"]; st.rerun()
                 if b3.button("列印", key=f"p{i}"):
                     js_p = "var w=window.open();w.document.write('" + clean_for_js(render_html(r)) + "');w.print();w.close();"
                     st.components.v1.html('<script>' + js_p + '</script>', height=0)
-                if b4.button("修改", key=f"e{i}", disabled=not can_edit): st.session_state.edit_id = r["單號"]; st.rerun()
+                if b4.button("修改", key=f"e{i}", disabled=not can_edit): st.session_state.edit_id = r["單號"]; st.session_state.edit_version = form_version(r["單號"]); st.rerun()
                 
                 if can_po_post_edit:
                     with b5.popover("📝 更新"):
@@ -577,9 +652,8 @@ if menu == "1. 填寫申請單":
                         new_unbilled = st.number_input("尚未請款金額", value=int(clean_amount(r.get("尚未請款金額", 0))), min_value=0, key=f"m1_ua_{i}")
                         new_desc = st.text_area("修改說明內容", value=str(r.get("請款說明", "")), key=f"m1_desc_{i}")
                         if st.button("💾 儲存修改", key=f"m1_save_pur_{i}"):
-                            fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-                            fresh_db.loc[idx, ["請款狀態", "已請款金額", "尚未請款金額", "請款說明"]] = [new_bill_stat, new_billed, new_unbilled, new_desc]
-                            save_data(fresh_db); st.success("已更新！"); time.sleep(0.5); st.rerun()
+                            save_form_fields(r["單號"], {"請款狀態": new_bill_stat, "已請款金額": new_billed, "尚未請款金額": new_unbilled, "請款說明": new_desc})
+                            st.success("已更新！"); time.sleep(0.5); st.rerun()
                 else:
                     if can_edit:
                         with b5.popover("刪除"):
@@ -587,9 +661,8 @@ if menu == "1. 填寫申請單":
                             if st.button("確認", key=f"d{i}"):
                                 if not reason: st.error("請輸入原因")
                                 else:
-                                    fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-                                    fresh_db.loc[idx, ["狀態", "刪除人", "刪除時間", "刪除原因"]] = ["已刪除", curr_name, get_taiwan_time(), reason]
-                                    save_data(fresh_db); st.rerun()
+                                    save_form_fields(r["單號"], {"狀態": "已刪除", "刪除人": curr_name, "刪除時間": get_taiwan_time(), "刪除原因": reason})
+                                    st.rerun()
                     else: b5.button("刪除", disabled=True, key=f"fake_d_{i}")
                 render_upload_popover(b6, r, f"m1_up_{i}")
 
@@ -600,8 +673,7 @@ elif menu == "2. 專案執行長簽核":
     render_header()
     st.subheader("🔍 專案執行長簽核")
     try:
-        sys_db = get_filtered_db()
-        p_df = sys_db[(sys_db["狀態"].isin(["待簽核", "待初審"]))] if is_admin else sys_db[(sys_db["狀態"].isin(["待簽核", "待初審"])) & (sys_db["專案負責人"] == curr_name)]
+        p_df = load_pending(CEO_SIGN_STATES, None if is_admin else curr_name)
         
         st.subheader("⏳ 待簽核清單")
         if p_df.empty: st.info("目前無待簽核單據")
@@ -619,23 +691,22 @@ elif menu == "2. 專案執行長簽核":
                     
                     if b1.button("預覽", key=f"ceo_v_{i}"): st.session_state.view_id = r["單號"]; st.rerun()
                     if b2.button("✅ 核准", key=f"ceo_ok_{i}", disabled=not can_sign):
-                        fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-                        fresh_db.loc[idx, ["狀態", "初審人", "初審時間"]] = ["已核准", curr_name, get_taiwan_time()]
-                        send_line_message(f"🔔 【採購單核准】\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n執行長已核准此採購單！")
-                        save_data(fresh_db); st.rerun()
+                        if sign_form(r, CEO_SIGN_STATES, "已核准", {"初審人": curr_name, "初審時間": get_taiwan_time()}, ceo_allowed):
+                            send_line_message(f"🔔 【採購單核准】\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n執行長已核准此採購單！")
+                            st.rerun()
                         
                     if can_sign:
                         with b3.popover("❌ 駁回"):
                             reason = st.text_input("駁回原因", key=f"ceo_r_{i}")
                             if st.button("確認", key=f"ceo_no_{i}"):
-                                fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-                                fresh_db.loc[idx, ["狀態", "駁回原因", "初審人", "初審時間"]] = ["已駁回", reason, curr_name, get_taiwan_time()]
-                                save_data(fresh_db); st.rerun()
+                                if sign_form(r, CEO_SIGN_STATES, "已駁回", {"駁回原因": reason, "初審人": curr_name, "初審時間": get_taiwan_time()}, ceo_allowed):
+                                    st.rerun()
                     else: b3.button("❌ 駁回", disabled=True, key=f"fake_ceo_no_{i}")
         
         st.divider()
         st.subheader("📜 歷史紀錄 (已核准/已駁回)")
-        h_df = sys_db[sys_db["狀態"].isin(["待複審", "已核准", "已駁回"])] if is_admin else sys_db[(sys_db["專案負責人"] == curr_name) & (sys_db["狀態"].isin(["待複審", "已核准", "已駁回"]))]
+        h_df = load_data(where={"類型": "採購單", "狀態": ["待複審", "已核准", "已駁回"]})
+        if not is_admin: h_df = h_df[h_df["專案負責人"] == curr_name]
             
         if h_df.empty: st.info("尚無紀錄")
         else: 
@@ -661,9 +732,8 @@ elif menu == "2. 專案執行長簽核":
                             new_unbilled = st.number_input("尚未請款金額", value=int(clean_amount(r.get("尚未請款金額", 0))), min_value=0, key=f"c_ua_{i}")
                             new_desc = st.text_area("修改說明內容", value=str(r.get("請款說明", "")), key=f"c_desc_{i}")
                             if st.button("💾 儲存修改", key=f"ceo_save_pur_{i}"):
-                                fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-                                fresh_db.loc[idx, ["請款狀態", "已請款金額", "尚未請款金額", "請款說明"]] = [new_bill_stat, new_billed, new_unbilled, new_desc]
-                                save_data(fresh_db); st.success("已更新！"); time.sleep(0.5); st.rerun()
+                                save_form_fields(r["單號"], {"請款狀態": new_bill_stat, "已請款金額": new_billed, "尚未請款金額": new_unbilled, "請款說明": new_desc})
+                                st.success("已更新！"); time.sleep(0.5); st.rerun()
                     else: lb3.button("✏️ 修改", disabled=True, key=f"fake_ceo_edit_{i}")
                     render_upload_popover(lb4, r, f"ceo_h_up_{i}")
     except Exception as e: st.error(f"錯誤：{str(e)}")
@@ -673,9 +743,8 @@ elif menu == "3. 財務長簽核":
     render_header()
     st.subheader("🏁 財務長簽核 (功能保留)")
     try:
-        sys_db = get_filtered_db()
         st.subheader("⏳ 待財務長簽核")
-        p_df = sys_db[sys_db["狀態"] == "待複審"] if is_admin or curr_name == CFO_NAME else sys_db[(sys_db["狀態"] == "待複審") & (sys_db["專案負責人"] == curr_name)]
+        p_df = load_pending(["待複審"], None if is_admin or curr_name == CFO_NAME else curr_name)
             
         if p_df.empty: st.info("無待審單據")
         else: 
@@ -689,18 +758,19 @@ elif menu == "3. 財務長簽核":
                     is_cfo_action = (curr_name == CFO_NAME) and is_active
                     if b1.button("預覽", key=f"cfo_v_{i}"): st.session_state.view_id = r["單號"]; st.rerun()
                     if b2.button("👑 核准", key=f"cok_{i}", disabled=not is_cfo_action):
-                        fresh_db = load_data(); fresh_db.loc[fresh_db["單號"]==r["單號"], ["狀態", "複審人", "複審時間"]] = ["已核准", curr_name, get_taiwan_time()]
-                        save_data(fresh_db); st.rerun()
+                        if sign_form(r, ["待複審"], "已核准", {"複審人": curr_name, "複審時間": get_taiwan_time()}, cfo_allowed):
+                            st.rerun()
                     if is_cfo_action:
                         with b3.popover("❌ 駁回"):
                             reason = st.text_input("原因", key=f"cr_{i}")
                             if st.button("確認", key=f"cno_{i}"):
-                                fresh_db = load_data(); fresh_db.loc[fresh_db["單號"]==r["單號"], ["狀態", "駁回原因", "複審人", "複審時間"]] = ["已駁回", reason, curr_name, get_taiwan_time()]
-                                save_data(fresh_db); st.rerun()
+                                if sign_form(r, ["待複審"], "已駁回", {"駁回原因": reason, "複審人": curr_name, "複審時間": get_taiwan_time()}, cfo_allowed):
+                                    st.rerun()
                     else: b3.button("❌ 駁回", disabled=True, key=f"fake_cfo_no_{i}")
         st.divider()
         st.subheader("📜 歷史紀錄 (已核准/已駁回)")
-        f_df = sys_db[sys_db["狀態"].isin(["已核准", "已駁回"])] if is_admin or curr_name == CFO_NAME else sys_db[(sys_db["專案負責人"] == curr_name) & (sys_db["狀態"].isin(["已核准", "已駁回"]))]
+        f_df = load_data(where={"類型": "採購單", "狀態": ["已核准", "已駁回"]})
+        if not (is_admin or curr_name == CFO_NAME): f_df = f_df[f_df["專案負責人"] == curr_name]
         if f_df.empty: st.info("尚無紀錄")
         else: 
             lh1, lh2, lnx, lh3, lh4, lh5, lh6 = st.columns([1.2, 1.8, 1.2, 1, 1.2, 1, 3.0])
@@ -731,10 +801,10 @@ elif menu == "4. 表單狀態總覽及轉請款單":
             display_df.insert(0, "轉成請款單", False)
             display_df.insert(1, "本次請款金額(點擊輸入)", 0)
             display_df["負責執行長"] = display_df["專案負責人"]
-            display_df["預計採購金額"] = display_df.apply(lambda x: f"{str(x.get('幣別','TWD')).replace('nan','TWD')} ${clean_amount(x.get('總金額',0)):,.0f}", axis=1)
+            display_df["預計採購金額"] = amount_labels(display_df)
             display_df["請款狀態"] = display_df["請款狀態"].fillna("").astype(str)
-            display_df["已請款金額"] = display_df["已請款金額"].apply(clean_amount)
-            display_df["尚未請款金額"] = display_df["尚未請款金額"].apply(clean_amount)
+            display_df["已請款金額"] = frame_clean.clean_amounts(display_df["已請款金額"])
+            display_df["尚未請款金額"] = frame_clean.clean_amounts(display_df["尚未請款金額"])
             display_df = display_df.rename(columns={"單號": "申請單號"})
             
             target_cols = ["轉成請款單", "本次請款金額(點擊輸入)", "申請單號", "專案名稱", "負責執行長", "申請人", "預計採購金額", "狀態", "請款狀態", "已請款金額", "尚未請款金額"]
@@ -746,41 +816,19 @@ elif menu == "4. 表單狀態總覽及轉請款單":
             )
             
             if st.button("🚀 確認將勾選項目轉成請款單"):
-                fresh_db = load_data()
-                converted_count = 0
+                # ★ 整批轉換：一次比對餘額、一次配發單號、同一個交易寫入，並逐列回報結果
+                picked = edited_df[edited_df["轉成請款單"].astype(bool)]
+                report = convert_forms(zip(picked["申請單號"], picked["本次請款金額(點擊輸入)"]), PO_TO_PAYMENT)
+                converted_count = sum(r.result == "ok" for r in report)
                 has_error = False
-                for i, row in edited_df.iterrows():
-                    conv_amt = row.get("本次請款金額(點擊輸入)")
-                    if bool(row.get("轉成請款單")) and pd.notna(conv_amt) and int(float(conv_amt)) > 0:
-                        orig_id = row["申請單號"]
-                        orig_idx = fresh_db[fresh_db["單號"]==orig_id].index[0]
-                        orig_row = fresh_db.iloc[orig_idx]
-                        real_conv_amt = int(float(conv_amt))
-                        
-                        final_amt = clean_amount(orig_row.get("最後採購金額", 0))
-                        if final_amt == 0: final_amt = clean_amount(orig_row.get("總金額", 0))
-                        
-                        current_billed = clean_amount(orig_row.get("已請款金額", 0))
-                        current_unbilled = final_amt - current_billed
-                        
-                        if real_conv_amt > current_unbilled:
-                            st.error(f"❌ 單號 {orig_id} 失敗：本次請款金額 ({real_conv_amt:,}) 超過尚未請款金額 ({current_unbilled:,})！")
-                            has_error = True; continue 
-                        
-                        fresh_db.at[orig_idx, "已請款金額"] = current_billed + real_conv_amt
-                        fresh_db.at[orig_idx, "尚未請款金額"] = current_unbilled - real_conv_amt
-                        fresh_db.at[orig_idx, "請款狀態"] = "已轉請款單"
-                        
-                        today_str = datetime.date.today().strftime('%Y%m%d')
-                        today_count = len(fresh_db[fresh_db["單號"].astype(str).str.startswith(today_str)])
-                        new_tid = f"{today_str}-{today_count+1:02d}"
-                        
-                        nr = {"單號": new_tid, "日期": str(datetime.date.today()), "類型": "請款單", "申請人": "Anita", "代申請人": "", "專案負責人": orig_row.get("專案負責人",""), "專案名稱": orig_row.get("專案名稱",""), "專案編號": orig_row.get("專案編號",""), "請款說明": f"自採購單 {orig_id} 轉換 (轉換金額: {real_conv_amt})", "總金額": real_conv_amt, "幣別": orig_row.get("幣別","TWD"), "付款方式": orig_row.get("付款方式",""), "請款廠商": orig_row.get("請款廠商",""), "匯款帳戶": orig_row.get("匯款帳戶",""), "帳戶影像Base64": orig_row.get("帳戶影像Base64",""), "狀態": "已儲存", "影像Base64": orig_row.get("影像Base64",""), "提交時間": "", "申請人信箱": "Anita", "初審人": "", "初審時間": "", "複審人": "", "複審時間": "", "刪除人": "", "刪除時間": "", "刪除原因": "", "駁回原因": "", "支付條件": "", "支付期數": "", "請款狀態": "", "已請款金額": 0, "尚未請款金額": 0, "最後採購金額": 0}
-                        fresh_db = pd.concat([fresh_db, pd.DataFrame([nr])], ignore_index=True)
-                        converted_count += 1
+                for r in report:
+                    if r.result == "over_balance": st.error(f"❌ 單號 {r.source_id} 失敗：本次請款金額 ({r.amount:,}) 超過尚未請款金額 ({r.available:,})！")
+                    elif r.result == "missing": st.error(f"❌ 單號 {r.source_id} 失敗：找不到該採購單，可能已被刪除。")
+                    elif r.result == "conflict": st.error(f"❌ 單號 {r.source_id} 失敗：採購單在轉換期間已被其他人修改，本次未轉換，請重新整理後再試。")
+                    else: continue
+                    has_error = True
                 
                 if converted_count > 0:
-                    save_data(fresh_db)
                     st.success(f"✅ 成功轉換 {converted_count} 筆！原始採購單餘額已更新，請切換至「請款單系統」進行後續提交。")
                     time.sleep(1.5); st.rerun()
                 elif not has_error: st.warning("請確保有勾選項目，且輸入金額大於 0！")
@@ -797,28 +845,35 @@ elif menu == "5. 請款狀態/系統設定":
         col_down, col_up = st.columns(2)
         with col_down:
             st.write("⬇️ **步驟一：下載最新表單資料庫**")
-            if os.path.exists(D_FILE):
-                with open(D_FILE, "rb") as f:
-                    st.download_button("下載表單備份檔", f, file_name=f"時研系統表單備份_{datetime.date.today()}.csv", mime="text/csv")
+            if os.path.exists(FORMS_DB) and st.button("產生表單備份檔"):
+                handle, zip_path = export_store.create(f"時研系統表單備份_{datetime.date.today()}.zip", "application/zip")
+                attachment_store.export_forms_zip(FORMS_DB, zip_path)
+                with export_store.open_export(handle) as f: st.download_button("下載表單備份檔", f, file_name=handle.name, mime=handle.mime)
         with col_up:
             st.write("⬆️ **步驟二：還原表單資料庫**")
-            uploaded_db = st.file_uploader("上傳表單 CSV 檔", type=["csv"], key="up_db", label_visibility="collapsed")
+            uploaded_db = st.file_uploader("上傳表單備份檔 (zip 或 CSV)", type=["zip", "csv"], key="up_db", label_visibility="collapsed")
             if uploaded_db and st.button("確認還原表單"):
-                with open(D_FILE, "wb") as f: f.write(uploaded_db.getbuffer())
-                st.success("表單資料庫已還原！"); time.sleep(1); st.rerun()
+                # ★ 無法辨識的金額會記為 0 並列出，不再默默變成 0
+                amount_issues = []
+                attachment_store.restore_forms_backup(FORMS_DB, uploaded_db.name, uploaded_db, issues=amount_issues)
+                if amount_issues: st.warning(f"⚠️ 表單已還原，但有 {len(amount_issues)} 個金額無法辨識，已記為 0，請手動更正：\n" + "\n".join(f"- {fid}｜{col}：{raw}" for fid, col, raw in amount_issues[:20]))
+                else: st.success("表單資料庫已還原！"); time.sleep(1); st.rerun()
 
     with st.expander("👥 2. 人員與大頭貼資料備份與還原"):
         col_down2, col_up2 = st.columns(2)
         with col_down2:
             st.write("⬇️ **步驟一：下載最新人員資料 (含大頭貼與LINE ID)**")
-            if os.path.exists(S_FILE):
-                with open(S_FILE, "rb") as f:
-                    st.download_button("下載人員備份檔", f, file_name=f"時研系統人員備份_{datetime.date.today()}.csv", mime="text/csv")
+            # ★ 名單只存大頭貼代號，備份為 zip（名單 CSV + 大頭貼檔），換主機還原後大頭貼才不會遺失
+            if os.path.exists(S_FILE) and st.button("產生人員備份檔"):
+                handle, zip_path = export_store.create(f"時研系統人員備份_{datetime.date.today()}.zip", "application/zip")
+                avatar_store.export_staff_zip(S_FILE, zip_path)
+                with export_store.open_export(handle) as f: st.download_button("下載人員備份檔", f, file_name=handle.name, mime=handle.mime)
         with col_up2:
             st.write("⬆️ **步驟二：還原人員資料**")
-            uploaded_staff = st.file_uploader("上傳人員 CSV 檔", type=["csv"], key="up_staff", label_visibility="collapsed")
+            uploaded_staff = st.file_uploader("上傳人員備份檔 (zip 或 CSV)", type=["zip", "csv"], key="up_staff", label_visibility="collapsed")
             if uploaded_staff and st.button("確認還原人員資料"):
-                with open(S_FILE, "wb") as f: f.write(uploaded_staff.getbuffer())
+                # 舊的 CSV 備份若含內嵌 base64 大頭貼，還原後會重新搬到附件儲存區
+                avatar_store.restore_staff_backup(S_FILE, uploaded_staff.name, uploaded_staff.getvalue())
                 st.session_state.staff_df = load_staff()
                 st.success("人員資料已還原！"); time.sleep(1); st.rerun()
 
@@ -830,6 +885,10 @@ elif menu == "5. 請款狀態/系統設定":
         if st.button("💾 儲存 LINE 設定"):
             save_line_credentials(new_token, new_uid) 
             st.success("LINE 推播設定已成功儲存並啟用！"); time.sleep(1); st.rerun()
+        ls = LINE_NOTIFY.stats()
+        lc1, lc2, lc3 = st.columns(3)
+        lc1.metric("已送出", ls.sent); lc2.metric("等待發送", ls.pending); lc3.metric("發送失敗", ls.failed)
+        if ls.last_error: st.caption(f"最近一次錯誤：{ls.last_error}")
 
     st.divider()
     st.subheader("💰 請款狀態 (Admin)")
@@ -839,7 +898,7 @@ elif menu == "5. 請款狀態/系統設定":
         display_df = sys_db.copy()
         if not display_df.empty:
             display_df["負責執行長"] = display_df["專案負責人"]
-            display_df["總金額"] = display_df.apply(lambda x: f"{str(x.get('幣別','TWD')).replace('nan','TWD')} ${clean_amount(x.get('總金額',0)):,.0f}", axis=1)
+            display_df["總金額"] = amount_labels(display_df)
             display_df = display_df.rename(columns={"單號": "申請單號"})
             
             def parse_date(d_str):
@@ -863,13 +922,11 @@ elif menu == "5. 請款狀態/系統設定":
                         st.error(f"❌ 申請單號 {row['申請單號']}：選擇「已匯款」時，必須填寫匯款日期！"); valid = False
                 
                 if valid:
-                    fresh_db = load_data()
+                    remit_updates = {}
                     for i, row in edited_df.iterrows():
-                        orig_idx = fresh_db[fresh_db["單號"]==row["申請單號"]].index[0]
-                        fresh_db.at[orig_idx, "匯款狀態"] = str(row["匯款狀態"]) if row["匯款狀態"] else "尚未匯款"
                         date_val = row["匯款日期"]
-                        fresh_db.at[orig_idx, "匯款日期"] = str(date_val) if pd.notna(date_val) and str(date_val) != "NaT" else ""
-                    save_data(fresh_db); st.success("✅ 匯款資訊已成功更新！"); time.sleep(1); st.rerun()
+                        remit_updates[row["申請單號"]] = {"匯款狀態": str(row["匯款狀態"]) if row["匯款狀態"] else "尚未匯款", "匯款日期": str(date_val) if pd.notna(date_val) and str(date_val) != "NaT" else ""}
+                    save_forms_fields(remit_updates); st.success("✅ 匯款資訊已成功更新！"); time.sleep(1); st.rerun()
         else: st.info("尚無資料。")
     except Exception as e: st.error(f"錯誤：{str(e)}")
 
@@ -877,7 +934,8 @@ elif menu == "5. 請款狀態/系統設定":
 if st.session_state.view_id:
     st.markdown("---")
     try:
-        r = load_data(); r = r[r["單號"]==st.session_state.view_id]
+        v = form_store.get_form(FORMS_DB, st.session_state.view_id)
+        r = pd.DataFrame([v]) if v else pd.DataFrame()
         if not r.empty:
             c1, c2 = st.columns([8, 2])
             c1.markdown("### 🔍 表單預覽")
@@ -887,7 +945,7 @@ if st.session_state.view_id:
             
             if r.iloc[0].get("影像Base64"):
                 st.markdown("#### 📎 附件檔案")
-                for img in r.iloc[0]["影像Base64"].split('|'):
-                    if is_pdf(img): display_pdf(img)
-                    else: st.image(base64.b64decode(img), use_container_width=True)
+                for raw in attachment_store.load_cell(r.iloc[0]["影像Base64"]):
+                    if raw.startswith(b"%PDF"): display_pdf(base64.b64encode(raw).decode())
+                    else: st.image(raw, use_container_width=True)
     except Exception as e: st.error(f"預覽發生錯誤：{str(e)}")
@@ -8,8 +8,23 @@ import requests
 import json
 import io
 import threading
+import form_store
+import frame_clean
+import list_pager
+import excel_preview
+import print_service
+import expense_report
+import export_store
+import attachment_store
+import avatar_store
+import data_cache
+import atomic_io
+import presence
+import github_sync
+import line_notify
 from ai_assistant import render_ai_operations_assistant
 from mobile_camera import mobile_camera_input
+from chunked_upload import StagedUpload, chunked_file_uploader
 try:
     import openpyxl
     from openpyxl.styles import Border, Side, Alignment
@@ -366,14 +381,18 @@ st.sidebar.markdown("<h2 class='时研logo'>時研國際設計股份有限公司
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 B_DIR = os.path.dirname(CURRENT_DIR) 
 D_FILE = os.path.join(B_DIR, "database.csv")
+FORMS_DB = os.path.join(B_DIR, "forms.db")
 S_FILE = os.path.join(B_DIR, "staff_v2.csv")
-O_FILE = os.path.join(B_DIR, "online.csv")
+O_FILE = os.path.join(B_DIR, "online_heartbeat.tsv")
 L_FILE = os.path.join(B_DIR, "line_credentials.txt") 
 G_FILE = os.path.join(B_DIR, "github_credentials.txt") 
 
 P_FILE = os.path.join(B_DIR, "projects.csv")
 V_FILE = os.path.join(B_DIR, "vendors.csv")
 
+# 表單改存於 SQLite；第一次開啟時自動匯入舊的 database.csv
+form_store.open_store(FORMS_DB, D_FILE)
+
 # =========================================================================
 # ★ GitHub 設定：Token 從 Streamlit Secrets／環境變數載入，避免部署重啟遺失 ★
 # =========================================================================
@@ -444,71 +463,19 @@ ADMINS = ["Anita"]
 CFO_NAME = "Charles"
 DEFAULT_STAFF = ["Andy", "Charles", "Eason", "Sunglin", "Anita"]
 
-# --- GitHub 自動同步引擎 (★完全放行上傳，由 Base64 負責躲避掃描) ---
-def sync_to_github_core(filepath):
-    filename = os.path.basename(filepath)
-
-    # 憑證含有 Token，GitHub Secret Push Protection 會以 409 拒絕；
-    # 保留在部署環境，不上傳敏感憑證檔案。
-    if os.path.abspath(filepath) in {
-        os.path.abspath(G_FILE),
-        os.path.abspath(L_FILE)
-    }:
-        return True, "敏感憑證檔案不予上傳"
-
-    token, repo, branch, _ = get_github_config()
-
-    if not token or not repo or not os.path.exists(filepath):
-        return False, "缺少 GitHub Token、Repository 或本機檔案"
-
-    get_url = f"https://api.github.com/repos/{repo}/contents/{filename}"
-    headers = {
-        "Authorization": f"token {token}",
-        "Accept": "application/vnd.github.v3+json",
-        "Cache-Control": "no-cache"
-    }
-
-    try:
-        with open(filepath, "rb") as f:
-            content = base64.b64encode(f.read()).decode()
-        data = {"message": f"Auto sync {filename} from TimeLab System", "content": content, "branch": branch}
-
-        for attempt in range(3):
-            remote = requests.get(f"{get_url}?ref={branch}", headers=headers, timeout=5)
-            if remote.status_code == 200:
-                sha = remote.json().get("sha")
-                if not sha:
-                    return False, "GitHub 遠端檔案未回傳 sha，已停止上傳"
-                data["sha"] = sha
-            elif remote.status_code == 404:
-                data.pop("sha", None)
-            else:
-                try:
-                    detail = remote.json().get("message", remote.text)
-                except Exception:
-                    detail = remote.text
-                return False, f"讀取 GitHub 遠端檔案失敗（錯誤碼：{remote.status_code}）：{detail}"
-
-            resp = requests.put(get_url, headers=headers, json=data, timeout=10)
-            if resp.status_code in [200, 201]:
-                return True, "同步成功"
-            if resp.status_code != 409 or attempt == 2:
-                try:
-                    detail = resp.json().get("message", resp.text)
-                except Exception:
-                    detail = resp.text
-                return False, f"上傳 {filename} 被 GitHub 拒絕（錯誤碼：{resp.status_code}）：{detail}"
-            time.sleep(0.5)
-    except Exception as e:
-        return False, f"上傳 {filename} 時發生錯誤：{e}"
+# --- GitHub 自動同步引擎 (★背景佇列：存檔只排入佇列，合併成一次 commit 上傳) ---
+GITHUB_SYNC = github_sync.get_worker(B_DIR)
+# ★ LINE 推播改由背景佇列發送（佇列存於本機，重啟後續送；不同步到 GitHub）
+LINE_OUTBOX = os.path.join(B_DIR, "line_outbox.db")
+LINE_NOTIFY = line_notify.get_dispatcher(LINE_OUTBOX)
 
-def sync_to_github(filepath):
+def sync_to_github(*filepaths):
     # 憑證檔案含有 Token，禁止送往 GitHub，避免 Secret Push Protection 409。
-    if os.path.basename(filepath) in {"github_credentials.txt", "line_credentials.txt"}:
-        return
-    success, msg = sync_to_github_core(filepath)
-    if not success:
-        st.error(f"⚠️ 雲端備份失敗！請截圖此訊息：{msg}")
+    paths = [p for p in filepaths if os.path.abspath(p) not in {os.path.abspath(G_FILE), os.path.abspath(L_FILE)}]
+    if not paths: return
+    token, repo, branch, _ = get_github_config()
+    GITHUB_SYNC.configure(token, repo, branch)
+    GITHUB_SYNC.enqueue(*paths)
 
 # --- 3. 基礎工具 ---
 def get_taiwan_time(): 
@@ -536,16 +503,18 @@ def get_fallback_date(r):
         return f"{d[:4]}-{d[4:6]}-{d[6:]}"
     return "2026-03-18"
 
+# ★ 在線名單改由 presence 在記憶體維護、各工作階段共用；心跳檔只偶爾附加一行，不再每次點擊都改寫檔案
+ONLINE = presence.registry(O_FILE)
+SYS_NAME = "請款單系統"
+
 def get_online_users(curr_user):
-    try:
-        now = time.time()
-        df = pd.read_csv(O_FILE) if os.path.exists(O_FILE) else pd.DataFrame(columns=["user", "time"])
-        df = df[df["user"] != curr_user]
-        df = pd.concat([df, pd.DataFrame([{"user": curr_user, "time": now}])], ignore_index=True)
-        df = df[now - pd.to_numeric(df["time"], errors='coerce').fillna(0) <= 300]
-        df.to_csv(O_FILE, index=False); return len(df["user"].unique())
+    try: ONLINE.touch(SYS_NAME, curr_user); return max(ONLINE.count(), 1)
     except: return 1
 
+def system_online_counts():
+    try: return ONLINE.counts()
+    except: return {}
+
 # ★ 修改：加入 Base64 自動解碼，還原您儲存的 LINE Token
 def get_line_credentials():
     if os.path.exists(L_FILE):
@@ -570,52 +539,144 @@ def save_line_credentials(token, user_id):
     try:
         enc_t = base64.b64encode(token.strip().encode()).decode() if token.strip() else ""
         enc_u = base64.b64encode(user_id.strip().encode()).decode() if user_id.strip() else ""
-        with open(L_FILE, "w", encoding="utf-8") as f: 
-            f.write(f"{enc_t}\n{enc_u}")
+        atomic_io.write_text(L_FILE, f"{enc_t}\n{enc_u}")
         sync_to_github(L_FILE)
     except: pass
 
-def send_line_message(msg):
+# ★ 只寫入背景佇列，不再阻塞畫面；指定 signer 時，同一簽核人短時間內的多筆提醒會合併成一則摘要
+def send_line_message(msg, signer="", digest_line=""):
     token, _ = get_line_credentials()
-    if token:
-        try: requests.post("https://api.line.me/v2/bot/message/broadcast", headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"}, json={"messages": [{"type": "text", "text": msg}]}, timeout=5)
-        except: pass
+    if not token: return
+    LINE_NOTIFY.configure(token)
+    try:
+        if signer: LINE_NOTIFY.notify(msg, f"sign:{signer}", f"🔔【待簽核提醒】\n共 {{count}} 筆表單需要{signer} 進行簽核：", digest_line)
+        else: LINE_NOTIFY.notify(msg)
+    except: pass
 
+# ★ 依檔案修改時間快取解析結果，檔案未變動時不再重新解析
 def read_csv_robust(filepath):
-    if not os.path.exists(filepath): return None
-    for enc in ['utf-8-sig', 'utf-8', 'cp950', 'big5']:
-        try: return pd.read_csv(filepath, encoding=enc, dtype=str).fillna("")
-        except: continue
-    return pd.DataFrame()
+    return data_cache.read_csv(filepath)
 
 def load_data():
-    cols = ["單號", "日期", "類型", "申請人", "代申請人", "專案負責人", "專案名稱", "專案編號", "請款說明", "總金額", "幣別", "付款方式", "請款廠商", "匯款帳戶", "帳戶影像Base64", "狀態", "影像Base64", "提交時間", "申請人信箱", "初審人", "初審時間", "複審人", "複審時間", "刪除人", "刪除時間", "刪除原因", "駁回原因", "匯款狀態", "匯款日期", "支付條件", "支付期數", "請款狀態", "已請款金額", "尚未請款金額", "最後採購金額"]
-    df = read_csv_robust(D_FILE)
-    if df is None or df.empty: return pd.DataFrame(columns=cols)
+    # 誤貼到狀態欄的 LINE 通知文字已由 form_store 在匯入時修復
     try:
-        df.columns = [c.strip() for c in df.columns]
-        if "專案執行人" in df.columns: df = df.rename(columns={"專案執行人": "專案負責人"})
-        for c in cols:
-            if c not in df.columns: df[c] = ""
-        for c in ["總金額", "已請款金額", "尚未請款金額"]:
-            df[c] = df[c].apply(clean_amount)
-            
-        if "狀態" in df.columns:
-            df.loc[df["狀態"].astype(str).str.contains("需要財務長", na=False), "狀態"] = "待複審"
-            df.loc[df["狀態"].astype(str).str.contains("需要執行長", na=False), "狀態"] = "待簽核"
-
-        return df[cols]
-    except:
-        return pd.DataFrame(columns=cols)
-
-def save_data(df):
-    try: 
-        df.reset_index(drop=True).to_csv(D_FILE, index=False, encoding='utf-8-sig')
-        sync_to_github(D_FILE) 
-    except Exception as e: 
+        return data_cache.load(FORMS_DB, lambda: form_store.load_forms(FORMS_DB), "forms")
+    except Exception:
+        return pd.DataFrame(columns=form_store.FORM_COLUMNS)
+
+# ★ 簽核與總覽清單只讀取需要的欄位，並由資料庫先依類型／狀態篩選；
+#   附件與請款說明等到開啟預覽時才以 get_form 單筆讀取
+LIST_COLUMNS = ["單號", "類型", "申請人", "代申請人", "專案負責人", "專案名稱", "請款廠商", "總金額", "幣別", "狀態", "初審人", form_store.VERSION_COLUMN]
+
+def load_list(statuses=None, columns=LIST_COLUMNS):
+    where = {"類型": "請款單"}
+    if statuses is not None: where["狀態"] = statuses
+    try:
+        return data_cache.load(FORMS_DB, lambda: form_store.load_forms(FORMS_DB, columns=columns, where=where), ("list", str(where), tuple(columns)))
+    except Exception:
+        return pd.DataFrame(columns=columns)
+
+# ★ 待簽核清單與數量直接查 inbox 索引（只含待簽核／待初審／待複審的表單），不必篩選整張表單
+def load_pending(statuses, approver=None):
+    try:
+        return data_cache.load(FORMS_DB, lambda: form_store.load_inbox(FORMS_DB, "請款單", statuses, approver, LIST_COLUMNS), ("inbox", tuple(statuses), approver))
+    except Exception:
+        return pd.DataFrame(columns=LIST_COLUMNS)
+
+def my_pending_count():
+    try:
+        n = form_store.inbox_count(FORMS_DB, "請款單", ["待簽核", "待初審"], curr_name)
+        return n + form_store.inbox_count(FORMS_DB, "請款單", ["待複審"]) if curr_name == CFO_NAME else n
+    except Exception:
+        return 0
+
+# ★ 單筆異動只更新該列，不再整份讀出再整份寫回；
+#   帶入 expected_version 時，若開啟編輯後已被別人改過就拒絕寫入，不會蓋掉對方的變更
+def form_version(form_id):
+    r = form_store.get_form(FORMS_DB, form_id)
+    return None if r is None else r[form_store.VERSION_COLUMN]
+
+def save_form_fields(form_id, values, expected_version=None):
+    try:
+        form_store.update_form(FORMS_DB, form_id, values, expected_version)
+        data_cache.invalidate(FORMS_DB)
+        sync_to_github(FORMS_DB)
+    except form_store.VersionConflict as e:
+        st.error(f"⚠️ 單據 {e.form_ids[0]} 在您編輯期間已被其他人修改，為避免覆蓋對方的變更，本次未存檔。請取消修改後重新開啟。")
+        st.stop()
+    except Exception as e:
+        st.error(f"⚠️ 檔案寫入失敗！請重試。錯誤：{e}")
+        st.stop()
+
+def save_forms_fields(updates):
+    try:
+        form_store.update_forms(FORMS_DB, updates)
+        data_cache.invalidate(FORMS_DB)
+        sync_to_github(FORMS_DB)
+    except Exception as e:
+        st.error(f"⚠️ 檔案寫入失敗！請重試。錯誤：{e}")
+        st.stop()
+
+# ★ 簽核關卡：待簽核／待初審 →（執行長初審）→ 待複審 →（財務長複審）→ 已核准
+SIGN_STEPS = {"EXE": (("待簽核", "待初審"), "待複審", "初審"), "CFO": (("待複審",), "已核准", "複審")}
+
+def can_sign_form(row, actor):
+    if not is_active or actor == "Anita": return False
+    # 與 inbox 相同，以專案負責人的第一個字比對（"Andy (執行長)" 視為 Andy）
+    return clean_name(row["專案負責人"]) == actor if row["狀態"] in SIGN_STEPS["EXE"][0] else actor == CFO_NAME
+
+# ★ 批次／單筆簽核與駁回共用：一次交易內檢查狀態與權限並更新，回傳 {單號: 結果}
+def bulk_transition(ids, from_states, to_state, actor, fields, expected_versions=None):
+    try:
+        results = form_store.transition_forms(FORMS_DB, ids, from_states, to_state, fields, allowed=lambda row: can_sign_form(row, actor), expected_versions=expected_versions)
+    except Exception as e:
+        st.error(f"⚠️ 檔案寫入失敗！請重試。錯誤：{e}")
+        st.stop()
+    done = [i for i, res in results.items() if res == "ok"]
+    if done:
+        data_cache.invalidate(FORMS_DB)
+        sync_to_github(FORMS_DB)
+    if done and to_state == "待複審":
+        sys_name = st.session_state.get('sys_choice', '請款單系統')
+        for _, r in form_store.load_forms(FORMS_DB, columns=["單號", "專案名稱"], where={"單號": done}).iterrows():
+            send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n執行長已核准，有一筆表單需要財務長 ({CFO_NAME}) 進行簽核！", f"財務長 ({CFO_NAME})", f"{sys_name}｜{r['單號']}｜{r['專案名稱']}")
+    return results
+
+# versions：{單號: 畫面上看到的版本}，簽核期間若單據被修改就回報衝突而不簽核
+def sign_forms(ids, sign_type, approve, reason="", versions=None):
+    from_states, next_state, field_prefix = SIGN_STEPS[sign_type]
+    fields = {f"{field_prefix}人": curr_name, f"{field_prefix}時間": get_taiwan_time()}
+    if not approve: next_state = "已駁回"; fields["駁回原因"] = reason
+    results = bulk_transition(ids, list(from_states), next_state, curr_name, fields, versions)
+    skipped = {"missing": "找不到單號", "wrong_state": "狀態已變更", "denied": "無簽核權限", "conflict": "內容已被其他人修改，請重新檢視"}
+    for fid, res in results.items():
+        if res != "ok": st.warning(f"⚠️ {fid} 未處理：{skipped.get(res, res)}")
+    return sum(res == "ok" for res in results.values())
+
+def add_form(values):
+    try:
+        form_store.insert_form(FORMS_DB, values)
+        data_cache.invalidate(FORMS_DB)
+        sync_to_github(FORMS_DB)
+    except Exception as e:
         st.error(f"⚠️ 檔案寫入失敗！請重試。錯誤：{e}")
         st.stop()
 
+# ★ 附件改存 attachments/（依內容 SHA-256 去重），表單只保留附件代號；分段上傳的檔案已在儲存區，直接引用代號
+def store_uploads(files):
+    refs = [f.ref if isinstance(f, StagedUpload) else attachment_store.store_bytes(f.getvalue()) for f in files]
+    for ref in refs: excel_preview.warm(ref)  # Excel 附件上傳時就先產生預覽快取
+    sync_to_github(*[attachment_store.path_for(ref) for ref in refs])
+    return "|".join(refs)
+
+# 舊資料的 base64 附件第一次開啟時搬出表單資料庫，並備份新產生的附件檔
+_migrated_files = attachment_store.migrate_forms(FORMS_DB)
+if _migrated_files: sync_to_github(FORMS_DB, *_migrated_files)
+
+# 舊名單的 base64 大頭貼第一次讀取時搬到附件儲存區，並備份名單與新產生的縮圖
+_avatar_files = avatar_store.migrate_staff_csv(S_FILE)
+if _avatar_files: sync_to_github(S_FILE, *_avatar_files)
+
 def load_staff():
     df = read_csv_robust(S_FILE)
     default_roles = {"Andy": "執行長", "Charles": "執行長&財務長", "Eason": "執行長", "Sunglin": "執行長", "Anita": "管理員"}
@@ -638,39 +699,43 @@ def load_staff():
     return df
 
 def save_staff(df): 
-    df.reset_index(drop=True).to_csv(S_FILE, index=False, encoding='utf-8-sig')
+    atomic_io.write_csv(df.reset_index(drop=True), S_FILE)
+    data_cache.invalidate(S_FILE)
     sync_to_github(S_FILE) 
 
 def load_projects():
     if not os.path.exists(P_FILE):
-        pd.DataFrame(columns=["負責執行長", "專案名稱", "專案編號"]).to_csv(P_FILE, index=False, encoding='utf-8-sig')
+        atomic_io.write_csv(pd.DataFrame(columns=["負責執行長", "專案名稱", "專案編號"]), P_FILE)
     return read_csv_robust(P_FILE)
 
 def save_projects(df):
-    df.to_csv(P_FILE, index=False, encoding='utf-8-sig')
+    atomic_io.write_csv(df, P_FILE)
+    data_cache.invalidate(P_FILE)
     sync_to_github(P_FILE) 
 
 def load_vendors():
     if not os.path.exists(V_FILE):
-        pd.DataFrame(columns=["請款廠商", "匯款帳戶"]).to_csv(V_FILE, index=False, encoding='utf-8-sig')
+        atomic_io.write_csv(pd.DataFrame(columns=["請款廠商", "匯款帳戶"]), V_FILE)
     return read_csv_robust(V_FILE)
 
 def save_vendors(df):
-    df.to_csv(V_FILE, index=False, encoding='utf-8-sig')
+    atomic_io.write_csv(df, V_FILE)
+    data_cache.invalidate(V_FILE)
     sync_to_github(V_FILE) 
 
-# --- 4. 請款單資料打包解析器 ---
-def parse_req_json(desc_raw):
-    try:
-        if "[請款單資料]" in desc_raw:
-            return json.loads(desc_raw.split("[請款單資料]")[1].strip())
-    except: pass
-    return {"desc": desc_raw, "net_amt": 0, "tax_amt": 0, "fee": 0, "inv_no": "", "acc_name": "", "ims_names": []}
+# --- 4. 請款單資料 ---
+# ★ 金額、發票與附件名稱在存檔時已由 form_store 從打包的請款說明展開成欄位，這裡直接讀欄位，不再解析 JSON
+def req_fields(row):
+    names = safe_str(row.get("憑證附件名稱"))
+    return {"desc": safe_str(row.get("說明內容")), "net_amt": clean_amount(row.get("未稅金額")), "tax_amt": clean_amount(row.get("稅額")), "fee": clean_amount(row.get("手續費")), "inv_no": safe_str(row.get("發票號碼")), "acc_name": safe_str(row.get("帳戶附件名稱")), "ims_names": names.split(form_store.NAME_SEPARATOR) if names else []}
+
+def pack_req_json(fields):
+    return form_store.REQUEST_MARK + "\n" + json.dumps(fields, ensure_ascii=False)
 
 # --- 5. HTML 渲染 ---
 def render_html(row):
     amt = clean_amount(row['總金額'])
-    data = parse_req_json(row.get("請款說明", ""))
+    data = req_fields(row)
     
     app_name = safe_str(row.get('申請人'))
     proxy_name = safe_str(row.get('代申請人'))
@@ -738,32 +803,32 @@ def render_html(row):
     h += f'<p style="font-size:15px;margin-top:20px;line-height:1.6;">提交: {s_submit} | 初審: {s_first} | 複審: {s_second}</p></div>'
     return h
 
+# ★ Excel 附件依內容雜湊快取前 1000 列與列印用 HTML，大檔分頁顯示，不再每次重新解析整本活頁簿
+def set_excel_page(key, page): st.session_state[key] = page
+
+def render_excel_preview(raw, key):
+    page = st.session_state.get(key, 0)
+    try: pv = excel_preview.preview(raw, page)
+    except Exception: st.error("⚠️ 無法預覽此 Excel。請確保 requirements.txt 包含 openpyxl。"); return
+    st.dataframe(pv.frame, use_container_width=True)
+    if page or pv.has_more:
+        c_prev, c_info, c_next = st.columns([1, 2, 1])
+        c_prev.button("⬅️ 上一頁", key=f"{key}_prev", disabled=page == 0, on_click=set_excel_page, args=(key, page - 1))
+        c_info.caption(f"第 {pv.start + 1:,}–{pv.start + len(pv.frame):,} 列")
+        c_next.button("下一頁 ➡️", key=f"{key}_next", disabled=not pv.has_more, on_click=set_excel_page, args=(key, page + 1))
+
 def render_inline_preview(r, prefix_key):
+    # 清單列只帶部分欄位，預覽時再讀取完整表單
+    r = form_store.get_form(FORMS_DB, r["單號"]) or r
     with st.container():
         st.markdown(f"#### 🔍 單號 {r['單號']} 預覽")
         st.markdown(render_html(r), unsafe_allow_html=True)
-        all_files = []
-        acc_img = safe_str(r.get("帳戶影像Base64"))
-        if acc_img: all_files.append(acc_img)
-
-        req_img = safe_str(r.get("影像Base64"))
-        if req_img:
-            chunks = req_img.split('|') if '|' in req_img else req_img.split(',') if ',' in req_img else [req_img]
-            for chunk in chunks:
-                c = chunk.strip()
-                if c.startswith('data:'): c = c.split('base64,')[-1]
-                if c: all_files.append(c)
+        all_files = attachment_store.load_cell(r.get("帳戶影像Base64")) + attachment_store.load_cell(r.get("影像Base64"))
 
         if all_files:
-            for idx, f_b64 in enumerate(all_files):
+            for idx, raw in enumerate(all_files):
                 try:
-                    pad = f_b64 + "=" * ((4 - len(f_b64) % 4) % 4)
-                    raw = base64.b64decode(pad)
-                    if raw.startswith(b'PK\x03\x04') or raw.startswith(b'\xd0\xcf\x11\xe0'):
-                        try:
-                            st.dataframe(pd.read_excel(io.BytesIO(raw)), use_container_width=True)
-                        except:
-                            st.error("⚠️ 無法預覽此 Excel。請確保 requirements.txt 包含 openpyxl。")
+                    if excel_preview.is_excel(raw): render_excel_preview(raw, f"xls_{prefix_key}_{idx}")
                     else: st.image(raw, use_container_width=True)
                 except Exception: pass 
         
@@ -774,47 +839,41 @@ def render_inline_preview(r, prefix_key):
 
 def render_html_with_attachments(row):
     h = render_html(row)
-    all_files = []
-    acc_img = safe_str(row.get("帳戶影像Base64"))
-    if acc_img: all_files.append(acc_img)
-    req_img = safe_str(row.get("影像Base64"))
-    if req_img:
-        chunks = req_img.split('|') if '|' in req_img else req_img.split(',') if ',' in req_img else [req_img]
-        for chunk in chunks:
-            c = chunk.strip()
-            if c.startswith('data:'): c = c.split('base64,')[-1]
-            if c: all_files.append(c)
+    all_files = attachment_store.load_cell(row.get("帳戶影像Base64")) + attachment_store.load_cell(row.get("影像Base64"))
 
     if all_files:
         h += '<div style="max-width:900px;margin:auto;padding-top:30px;page-break-before:always;">'
-        for idx, f_b64 in enumerate(all_files):
+        for idx, raw in enumerate(all_files):
             try:
-                pad = f_b64 + "=" * ((4 - len(f_b64) % 4) % 4)
-                raw = base64.b64decode(pad)
                 if raw.startswith(b'PK\x03\x04') or raw.startswith(b'\xd0\xcf\x11\xe0'):
                     try:
-                        df_ex = pd.read_excel(io.BytesIO(raw))
-                        html_table = df_ex.to_html(index=False).replace('\n', '')
-                        css_rules = "<style>.xls-tbl { width: 100%; border-collapse: collapse; font-size: 11px; table-layout: fixed; } .xls-tbl th, .xls-tbl td { border: 1px solid #000; padding: 4px; word-wrap: break-word; overflow-wrap: break-word; white-space: normal; word-break: break-all; } .xls-tbl th { background-color: #f0f0f0; } .xls-tbl tr { page-break-inside: avoid !important; }</style>"
-                        html_table = html_table.replace('<table', f'{css_rules}<table class="xls-tbl"')
-                        h += f"{html_table}<br><br>"
+                        h += f"{excel_preview.print_html(raw)}<br><br>"
                     except Exception as e:
                         h += f"<div style='color:red;'>⚠️ Excel轉換列印失敗。請確保您的 GitHub `requirements.txt` 中已加入 `openpyxl` 套件。</div><br>"
                 else:
-                    mime = "image/png" if raw.startswith(b'\x89PNG') else "image/jpeg"
-                    h += f'<img src="data:{mime};base64,{pad}" style="max-width:100%; margin-bottom:20px; border:none;"><br><br>'
+                    h += f'{print_service.image_html(raw)}<br><br>'
             except Exception:
                 pass
         h += '</div>'
     return h
 
-def clean_for_js(h_str): return h_str.replace('\n', '').replace('\r', '').replace("'", "\\'")
+# ★ 列印文件依單號與表單內容在伺服器產生 PDF 並快取，以下載按鈕提供，不再把整份文件塞進 JavaScript；多筆合併成一份
+def print_forms(ids, key):
+    rows = {f["單號"]: f for f in (form_store.get_form(FORMS_DB, i) for i in ids) if f is not None}
+    if not rows: st.error("⚠️ 找不到要列印的單據，可能已被刪除。"); return
+    render = lambda fid: render_html_with_attachments(pd.Series(rows[fid]))
+    forms = list(rows.items())
+    if len(forms) == 1: doc = print_service.form_document(forms[0][0], forms[0][1], lambda: render(forms[0][0]))
+    else: doc = print_service.batch_document(forms, render)
+    data, ext, mime = doc.download()
+    st.download_button(f"⬇️ 下載列印檔 ({ext.upper()})", data, file_name=f"請款單_{'_'.join(rows)[:60]}.{ext}", mime=mime, key=f"{key}_file")
+    if ext != "pdf": st.caption("伺服器無法產生 PDF，請以瀏覽器開啟下載的檔案後列印。")
 
 def render_upload_popover(container, r, prefix):
     with container.popover("📎 附件"):
         st.write("**上傳附件 (圖/Excel)**")
-        nf_acc = st.file_uploader("存摺", type=["png", "jpg", "xlsx", "xls"], key=f"{prefix}_a")
-        nf_ims = st.file_uploader("憑證", type=["png", "jpg", "xlsx", "xls"], accept_multiple_files=True, key=f"{prefix}_i")
+        nf_acc = chunked_file_uploader("存摺", key=f"{prefix}_a")
+        nf_ims = chunked_file_uploader("憑證", key=f"{prefix}_i", multiple=True)
         cam_reset_key = f"{prefix}_cam_reset"
         if cam_reset_key not in st.session_state: st.session_state[cam_reset_key] = 0
         with st.container(key=f"mobile-camera-only-{prefix}"):
@@ -822,27 +881,28 @@ def render_upload_popover(container, r, prefix):
             cam_acc = mobile_camera_input("拍攝存摺／帳戶", key=f"{prefix}_cam_a_{st.session_state[cam_reset_key]}")
             if cam_acc and st.button("🔄 重新拍攝存摺／帳戶", key=f"{prefix}_cam_a_retake"):
                 st.session_state[cam_reset_key] += 1; st.rerun()
-            cam_ims = mobile_camera_input("拍攝憑證", key=f"{prefix}_cam_i_{st.session_state[cam_reset_key]}")
+            cam_ims = mobile_camera_input("拍攝憑證", key=f"{prefix}_cam_i_{st.session_state[cam_reset_key]}", allow_grayscale=True)
             if cam_ims and st.button("🔄 重新拍攝憑證", key=f"{prefix}_cam_i_retake"):
                 st.session_state[cam_reset_key] += 1; st.rerun()
         nf_acc = cam_acc or nf_acc
         nf_ims = list(nf_ims or [])
         if cam_ims: nf_ims.append(cam_ims)
         if st.button("💾 儲存附件", key=f"{prefix}_b"):
-            fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-            jd = parse_req_json(fresh_db.at[idx, "請款說明"])
-            
-            if nf_acc: 
-                fresh_db.at[idx, "帳戶影像Base64"] = base64.b64encode(nf_acc.getvalue()).decode()
+            fresh_r = form_store.get_form(FORMS_DB, r["單號"])
+            if fresh_r is None: st.error("⚠️ 找不到該單號資料，可能已被刪除。"); st.stop()
+            jd = req_fields(fresh_r)
+            updates = {}
+
+            if nf_acc:
+                updates["帳戶影像Base64"] = store_uploads([nf_acc])
                 jd["acc_name"] = nf_acc.name
-            if nf_ims: 
-                fresh_db.at[idx, "影像Base64"] = "|".join([base64.b64encode(f.getvalue()).decode() for f in nf_ims])
+            if nf_ims:
+                updates["影像Base64"] = store_uploads(nf_ims)
                 jd["ims_names"] = [f.name for f in nf_ims]
-            
+
             if nf_acc or nf_ims:
-                packed_desc = "[請款單資料]\n" + json.dumps(jd, ensure_ascii=False)
-                fresh_db.at[idx, "請款說明"] = packed_desc
-                save_data(fresh_db); st.rerun()
+                updates["請款說明"] = pack_req_json(jd)
+                save_form_fields(r["單號"], updates); st.rerun()
 
 # --- 6. Session 初始化與防呆重載 ---
 if st.session_state.get('user_id') is None: st.switch_page("app.py")
@@ -863,7 +923,7 @@ if not curr_user_info.empty and curr_user_info.iloc[0].get("status") == "離職"
     st.switch_page("app.py")
     st.stop()
 
-for k in ['req_edit_id', 'req_last_id', 'req_view_id', 'req_print_id', 'req_last_msg', 'req_review_id', 'req_review_type', 'temp_xlsx_data', 'temp_xlsx_name', 'temp_xlsx_selected']: 
+for k in ['req_edit_id', 'req_last_id', 'req_view_id', 'req_print_id', 'req_last_msg', 'req_review_id', 'req_review_type', 'temp_xlsx', 'temp_xlsx_selected']: 
     if k not in st.session_state: st.session_state[k] = None
 
 if 'req_uploader_key' not in st.session_state: st.session_state.req_uploader_key = 0
@@ -889,21 +949,26 @@ role_map_display = {
 display_title = role_map_display.get(curr_name, curr_role)
 display_name_text = f"{curr_name} - {display_title}"
 
-avatar_b64 = ""
-try: avatar_b64 = st.session_state.staff_df[st.session_state.staff_df["name"] == curr_name].iloc[0].get("avatar", "")
+# ★ 只在側邊欄顯示時讀取目前使用者的大頭貼縮圖
+avatar_src = ""
+try: avatar_src = avatar_store.avatar_url(st.session_state.staff_df[st.session_state.staff_df["name"] == curr_name].iloc[0].get("avatar", ""))
 except: pass
 
-if avatar_b64: st.sidebar.markdown(f'<div style="display:flex;align-items:center;gap:12px;margin-bottom:15px;"><img src="data:image/jpeg;base64,{avatar_b64}" style="width:60px;height:60px;border-radius:50%;object-fit:cover;border:3px solid #eee;"><span style="font-size:20px;font-weight:bold;color:white;">{display_name_text}</span></div>', unsafe_allow_html=True)
+if avatar_src: st.sidebar.markdown(f'<div style="display:flex;align-items:center;gap:12px;margin-bottom:15px;"><img src="{avatar_src}" style="width:60px;height:60px;border-radius:50%;object-fit:cover;border:3px solid #eee;"><span style="font-size:20px;font-weight:bold;color:white;">{display_name_text}</span></div>', unsafe_allow_html=True)
 else: st.sidebar.markdown(f"### 👤 <span style='color:white;'>{display_name_text}</span>", unsafe_allow_html=True)
 
-st.sidebar.info(f"🟢 目前在線人數：**{get_online_users(curr_name)}** 人")
+online_count = get_online_users(curr_name)
+online_by_system = "｜".join(f"{k} {v} 人" for k, v in system_online_counts().items())
+st.sidebar.info(f"🟢 目前在線人數：**{online_count}** 人" + (f"\n\n{online_by_system}" if online_by_system else ""))
+pending_count = my_pending_count()
+if pending_count: st.sidebar.warning(f"📥 待您簽核：**{pending_count}** 筆")
 
 with st.sidebar.expander("📸 修改大頭貼"):
     new_avatar = st.file_uploader("上傳圖片", type=["jpg", "png"], key="req_side_avatar")
     if st.button("更新大頭貼", key="req_update_avatar") and new_avatar:
         s_df = load_staff(); idx = s_df[s_df["name"] == curr_name].index[0]
-        s_df.at[idx, "avatar"] = base64.b64encode(new_avatar.getvalue()).decode()
-        save_staff(s_df); st.session_state.staff_df = s_df; st.rerun()
+        s_df.at[idx, "avatar"] = avatar_store.store_avatar(new_avatar.getvalue())
+        save_staff(s_df); sync_to_github(attachment_store.path_for(s_df.at[idx, "avatar"])); st.session_state.staff_df = s_df; st.rerun()
 
 with st.sidebar.expander("🔐 修改我的密碼"):
     new_pw = st.text_input("新密碼", type="password", key="req_side_pw")
@@ -1050,70 +1115,46 @@ st.markdown("""
 # ================= ★ 獨立全螢幕簽核視窗邏輯 ★ =================
 if st.session_state.get('req_review_id'):
     st.subheader(f"📝 簽核預覽視窗 - 單號: {st.session_state.req_review_id}")
-    r_df = load_data()
-    r_df = r_df[r_df["單號"]==st.session_state.req_review_id]
+    review_r = form_store.get_form(FORMS_DB, st.session_state.req_review_id)
     
-    if r_df.empty:
+    if review_r is None:
         st.warning("⚠️ 找不到該單號資料，可能已被刪除。")
         if st.button("❌ 關閉視窗"): st.session_state.req_review_id = None; st.rerun()
     else:
-        r = r_df.iloc[0]
+        r = pd.Series(review_r)
         sign_type = st.session_state.req_review_type
         
         c_btn1, c_btn2, c_btn3, _ = st.columns([1.5, 1.5, 1.5, 5])
         if c_btn1.button("⬅️ 關閉視窗"): 
             st.session_state.req_review_id = None; st.rerun()
             
-        can_sign = (r["專案負責人"] == curr_name if sign_type == "EXE" else curr_name == CFO_NAME) and is_active and curr_name != "Anita"
+        can_sign = (clean_name(r["專案負責人"]) == curr_name if sign_type == "EXE" else curr_name == CFO_NAME) and is_active and curr_name != "Anita"
         
         if c_btn2.button("✅ 確認核准", disabled=not can_sign):
             st.session_state.req_edit_id = None 
-            fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-            if sign_type == "EXE":
-                fresh_db.loc[idx, ["狀態", "初審人", "初審時間"]] = ["待複審", curr_name, get_taiwan_time()]
-                sys_name = st.session_state.get('sys_choice', '請款單系統')
-                send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n執行長已核准，有一筆表單需要財務長 ({CFO_NAME}) 進行簽核！")
-            else:
-                fresh_db.loc[idx, ["狀態", "複審人", "複審時間"]] = ["已核准", curr_name, get_taiwan_time()]
-            save_data(fresh_db); st.success("已核准！"); time.sleep(0.5)
-            st.session_state.req_review_id = None; st.rerun()
+            if sign_forms([r["單號"]], sign_type, approve=True, versions={r["單號"]: r[form_store.VERSION_COLUMN]}):
+                st.success("已核准！"); time.sleep(0.5)
+                st.session_state.req_review_id = None; st.rerun()
             
         if can_sign:
             with c_btn3.popover("❌ 駁回單據"):
                 reason = st.text_input("請輸入駁回原因")
                 if st.button("確認駁回", key="btn_rej_conf"):
                     st.session_state.req_edit_id = None 
-                    fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-                    field_prefix = "初審" if sign_type == "EXE" else "複審"
-                    fresh_db.loc[idx, ["狀態", "駁回原因", f"{field_prefix}人", f"{field_prefix}時間"]] = ["已駁回", reason, curr_name, get_taiwan_time()]
-                    save_data(fresh_db); st.success("已駁回！"); time.sleep(0.5)
-                    st.session_state.req_review_id = None; st.rerun()
+                    if sign_forms([r["單號"]], sign_type, approve=False, reason=reason, versions={r["單號"]: r[form_store.VERSION_COLUMN]}):
+                        st.success("已駁回！"); time.sleep(0.5)
+                        st.session_state.req_review_id = None; st.rerun()
         else:
             c_btn3.button("❌ 駁回單據", disabled=True)
 
         st.divider()
         st.markdown(render_html(r), unsafe_allow_html=True)
         
-        all_files = []
-        acc_img = safe_str(r.get("帳戶影像Base64"))
-        if acc_img: all_files.append(acc_img)
-        req_img = safe_str(r.get("影像Base64"))
-        if req_img:
-            chunks = req_img.split('|') if '|' in req_img else req_img.split(',') if ',' in req_img else [req_img]
-            for chunk in chunks:
-                c = chunk.strip()
-                if c.startswith('data:'): c = c.split('base64,')[-1]
-                if c: all_files.append(c)
+        all_files = attachment_store.load_cell(r.get("帳戶影像Base64")) + attachment_store.load_cell(r.get("影像Base64"))
         if all_files:
-            for f_b64 in all_files:
+            for idx, raw in enumerate(all_files):
                 try:
-                    pad = f_b64 + "=" * ((4 - len(f_b64) % 4) % 4)
-                    raw = base64.b64decode(pad)
-                    if raw.startswith(b'PK\x03\x04') or raw.startswith(b'\xd0\xcf\x11\xe0'):
-                        try:
-                            st.dataframe(pd.read_excel(io.BytesIO(raw)), use_container_width=True)
-                        except:
-                            st.error("⚠️ 無法預覽此 Excel。請確保 requirements.txt 包含 openpyxl。")
+                    if excel_preview.is_excel(raw): render_excel_preview(raw, f"xls_review_{r['單號']}_{idx}")
                     else: st.image(raw, use_container_width=True)
                 except Exception: pass 
 
@@ -1123,6 +1164,12 @@ else:
         if df_list.empty:
             st.info("目前無相關紀錄")
             return
+        # ★ 先搜尋、分頁，手機卡片與桌機清單都只為目前這一頁建立按鈕
+        if is_history: df_list = df_list.sort_values(by="單號", ascending=False).reset_index(drop=True)
+        df_list = list_pager.paginate(df_list, f"req_sign_{sign_type}_{is_history}")
+        if df_list.empty:
+            st.info("沒有符合搜尋條件的單據")
+            return
         st.markdown("<span class='req-mobile-signing-marker'></span>", unsafe_allow_html=True)
 
         # 直式手機：每筆簽核資料集中成卡片，避免原本多欄資料在窄螢幕被拆成長條直欄。
@@ -1139,21 +1186,11 @@ else:
 
                     if not is_history:
                         mobile_can_sign = (
-                            (mobile_r.get("專案負責人") == curr_name if sign_type == "EXE" else curr_name == CFO_NAME)
+                            (clean_name(mobile_r.get("專案負責人")) == curr_name if sign_type == "EXE" else curr_name == CFO_NAME)
                             and is_active and curr_name != "Anita"
                         )
                         if st.button("✅ 確認核准", key=f"mobile_sign_ok_{sign_type}_{mobile_id}_{mobile_i}", disabled=not mobile_can_sign, use_container_width=True):
-                            fresh_db = load_data()
-                            match_idx = fresh_db[fresh_db["單號"] == mobile_id].index
-                            if len(match_idx):
-                                idx = match_idx[0]
-                                if sign_type == "EXE":
-                                    fresh_db.loc[idx, ["狀態", "初審人", "初審時間"]] = ["待複審", curr_name, get_taiwan_time()]
-                                    sys_name = st.session_state.get('sys_choice', '請款單系統')
-                                    send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{mobile_id}\n專案名稱：{mobile_r['專案名稱']}\n執行長已核准，有一筆表單需要財務長 ({CFO_NAME}) 進行簽核！")
-                                else:
-                                    fresh_db.loc[idx, ["狀態", "複審人", "複審時間"]] = ["已核准", curr_name, get_taiwan_time()]
-                                save_data(fresh_db)
+                            if sign_forms([mobile_id], sign_type, approve=True, versions={mobile_id: mobile_r[form_store.VERSION_COLUMN]}):
                                 st.success("已核准！")
                                 time.sleep(0.5)
                                 st.rerun()
@@ -1163,13 +1200,7 @@ else:
                                 mobile_reason = st.text_input("請輸入駁回原因", key=f"mobile_sign_reason_{sign_type}_{mobile_id}_{mobile_i}")
                                 if st.button("確認駁回", key=f"mobile_sign_reject_{sign_type}_{mobile_id}_{mobile_i}", use_container_width=True):
                                     if mobile_reason.strip():
-                                        fresh_db = load_data()
-                                        match_idx = fresh_db[fresh_db["單號"] == mobile_id].index
-                                        if len(match_idx):
-                                            idx = match_idx[0]
-                                            field_prefix = "初審" if sign_type == "EXE" else "複審"
-                                            fresh_db.loc[idx, ["狀態", "駁回原因", f"{field_prefix}人", f"{field_prefix}時間"]] = ["已駁回", mobile_reason, curr_name, get_taiwan_time()]
-                                            save_data(fresh_db)
+                                        if sign_forms([mobile_id], sign_type, approve=False, reason=mobile_reason, versions={mobile_id: mobile_r[form_store.VERSION_COLUMN]}):
                                             st.success("已駁回！")
                                             time.sleep(0.5)
                                             st.rerun()
@@ -1193,7 +1224,7 @@ else:
             select_all = col_all.checkbox("☑️ 全選", key=f"sel_all_{sign_type}", disabled=chk_disabled)
             
             display_df = df_list[["單號", "專案名稱", "總金額"]].copy()
-            display_df["總金額"] = display_df["總金額"].apply(lambda x: f"${clean_amount(x):,}")
+            display_df["總金額"] = "$" + frame_clean.clean_amounts(display_df["總金額"]).map("{:,}".format)
             display_df = display_df.rename(columns={"總金額": "金額"})
             display_df.insert(0, "選擇", select_all)
             
@@ -1209,27 +1240,14 @@ else:
             selected_ids = edited_df[edited_df["選擇"] == True]["單號"].tolist()
 
             st.markdown("---")
-            batch_c1, batch_c2, _ = st.columns([2.5, 2.5, 5])
+            batch_c1, batch_c2, batch_c3, _ = st.columns([2.5, 2.5, 2.5, 2.5])
             
             is_btn_disabled = (len(selected_ids) == 0) or (curr_name == "Anita")
             
             if batch_c1.button(f"✅ 確認核准 (已選 {len(selected_ids)} 筆)", disabled=is_btn_disabled, key=f"bat_ok_{sign_type}"):
                 st.session_state.req_edit_id = None 
-                fresh_db = load_data()
-                success_count = 0
-                for sel_id in selected_ids:
-                    r_match = df_list[df_list["單號"] == sel_id].iloc[0]
-                    if (r_match["專案負責人"] == curr_name if sign_type == "EXE" else curr_name == CFO_NAME) and is_active and curr_name != "Anita":
-                        idx = fresh_db[fresh_db["單號"]==sel_id].index[0]
-                        if sign_type == "EXE":
-                            fresh_db.loc[idx, ["狀態", "初審人", "初審時間"]] = ["待複審", curr_name, get_taiwan_time()]
-                            sys_name = st.session_state.get('sys_choice', '請款單系統')
-                            send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{sel_id}\n專案名稱：{r_match['專案名稱']}\n執行長已核准，有一筆表單需要財務長 ({CFO_NAME}) 進行簽核！")
-                        else:
-                            fresh_db.loc[idx, ["狀態", "複審人", "複審時間"]] = ["已核准", curr_name, get_taiwan_time()]
-                        success_count += 1
-                if success_count > 0:
-                    save_data(fresh_db); st.success(f"成功核准 {success_count} 筆單據！"); time.sleep(1); st.rerun()
+                n_done = sign_forms(selected_ids, sign_type, approve=True, versions=dict(zip(df_list["單號"], df_list[form_store.VERSION_COLUMN])))
+                if n_done: st.success(f"成功核准 {n_done} 筆單據！"); time.sleep(1); st.rerun()
 
             if is_btn_disabled:
                 batch_c2.button(f"❌ 駁回單據 (已選 {len(selected_ids)} 筆)", disabled=True, key=f"fake_rej_{sign_type}")
@@ -1238,17 +1256,11 @@ else:
                     reason = st.text_input("請統一輸入駁回原因", key=f"rej_batch_{sign_type}")
                     if st.button("確認批次駁回"):
                         st.session_state.req_edit_id = None 
-                        fresh_db = load_data()
-                        success_count = 0
-                        for sel_id in selected_ids:
-                            r_match = df_list[df_list["單號"] == sel_id].iloc[0]
-                            if (r_match["專案負責人"] == curr_name if sign_type == "EXE" else curr_name == CFO_NAME) and is_active and curr_name != "Anita":
-                                idx = fresh_db[fresh_db["單號"]==sel_id].index[0]
-                                field_prefix = "初審" if sign_type == "EXE" else "複審"
-                                fresh_db.loc[idx, ["狀態", "駁回原因", f"{field_prefix}人", f"{field_prefix}時間"]] = ["已駁回", reason, curr_name, get_taiwan_time()]
-                                success_count += 1
-                        if success_count > 0:
-                            save_data(fresh_db); st.success(f"成功駁回 {success_count} 筆單據！"); time.sleep(1); st.rerun()
+                        n_done = sign_forms(selected_ids, sign_type, approve=False, reason=reason, versions=dict(zip(df_list["單號"], df_list[form_store.VERSION_COLUMN])))
+                        if n_done: st.success(f"成功駁回 {n_done} 筆單據！"); time.sleep(1); st.rerun()
+
+            if batch_c3.button(f"🖨️ 合併列印 (已選 {len(selected_ids)} 筆)", disabled=len(selected_ids) == 0, key=f"bat_print_{sign_type}"):
+                print_forms(selected_ids, f"bat_print_{sign_type}")
                         
             st.write("👉 **或選擇單號進入專屬簽核視窗：**")
             col_sel, col_btn_v, _ = st.columns([2.5, 2.5, 5])
@@ -1259,8 +1271,6 @@ else:
                 st.rerun()
                 
         else:
-            df_list = df_list.sort_values(by="單號", ascending=False).reset_index(drop=True)
-
             signing_header = st.container(key=f"req-mobile-signing-header-{sign_type}-{is_history}")
             if is_admin:
                 cols_header = signing_header.columns([1.2, 2.0, 1.2, 1.2, 1.2, 3.0])
@@ -1345,7 +1355,7 @@ else:
         if st.session_state.req_edit_id:
             match_r = db[db["單號"]==st.session_state.req_edit_id]
             if not match_r.empty:
-                r = match_r.iloc[0]; jd = parse_req_json(r["請款說明"])
+                r = match_r.iloc[0]; jd = req_fields(r)
                 legacy_net = clean_amount(r["總金額"]) if jd.get("net_amt", 0) == 0 and jd.get("tax_amt", 0) == 0 else jd.get("net_amt", 0)
                 dv.update({"app": r["申請人"], "pn": r["專案名稱"], "pi": r["專案編號"], "exe": r["專案負責人"], "net_amt": legacy_net, "tax_amt": jd.get("tax_amt", 0), "desc": jd.get("desc", ""), "ib64": r["影像Base64"], "cur": r.get("幣別","TWD"), "ab64": r["帳戶影像Base64"], "vdr": r.get("請款廠商",""), "acc": r.get("匯款帳戶",""), "pay": r.get("付款方式","匯款(扣30手續費)"), "inv_no": jd.get("inv_no", ""), "acc_name": jd.get("acc_name", ""), "ims_names": jd.get("ims_names", [])})
 
@@ -1403,8 +1413,8 @@ else:
             desc = st.text_area("請款說明", value=dv["desc"])
             st.info("💡 **提示：系統會自動加總「金額(未稅) + 稅額」，若選擇「扣30手續費」，最終存檔總金額會自動扣除 30 元。**")
             
-            f_acc = st.file_uploader("上傳存摺/匯款資料 (圖/Excel)", type=["png", "jpg", "xlsx", "xls"], key=f"req_f_acc_{up_key}")
-            f_ims = st.file_uploader("上傳請款憑證 (圖/Excel)", type=["png", "jpg", "xlsx", "xls"], accept_multiple_files=True, key=f"req_f_ims_{up_key}")
+            f_acc = chunked_file_uploader("上傳存摺/匯款資料 (圖/Excel)", key=f"req_f_acc_{up_key}")
+            f_ims = chunked_file_uploader("上傳請款憑證 (圖/Excel)", key=f"req_f_ims_{up_key}", multiple=True)
             cam_reset_key = f"req_cam_reset_{up_key}"
             if cam_reset_key not in st.session_state: st.session_state[cam_reset_key] = 0
             with st.container(key=f"mobile-camera-only-request-{up_key}"):
@@ -1412,7 +1422,7 @@ else:
                 cam_acc = mobile_camera_input("拍攝存摺／帳戶", key=f"req_cam_acc_{up_key}_{st.session_state[cam_reset_key]}")
                 if cam_acc and st.button("🔄 重新拍攝存摺／帳戶", key=f"req_cam_acc_retake_{up_key}"):
                     st.session_state[cam_reset_key] += 1; st.rerun()
-                cam_ims = mobile_camera_input("拍攝憑證", key=f"req_cam_ims_{up_key}_{st.session_state[cam_reset_key]}")
+                cam_ims = mobile_camera_input("拍攝憑證", key=f"req_cam_ims_{up_key}_{st.session_state[cam_reset_key]}", allow_grayscale=True)
                 if cam_ims and st.button("🔄 重新拍攝憑證", key=f"req_cam_ims_retake_{up_key}"):
                     st.session_state[cam_reset_key] += 1; st.rerun()
             f_acc = cam_acc or f_acc
@@ -1431,11 +1441,7 @@ else:
                     
                 req_img_str = safe_str(dv["ib64"])
                 if req_img_str:
-                    chunks = req_img_str.split('|') if '|' in req_img_str else req_img_str.split(',') if ',' in req_img_str else [req_img_str]
-                    for chunk in chunks:
-                        c = chunk.strip()
-                        if c.startswith('data:'): c = c.split('base64,')[-1]
-                        if c and len(c) > 50: existing_ims.append(c)
+                    existing_ims = [c for c in attachment_store.split_cell(req_img_str) if len(c) > 50]
                     
                     if existing_ims:
                         st.write("**已上傳之請款憑證：**")
@@ -1470,38 +1476,35 @@ else:
                 total_amt = net_amt + tax_amt - fee
                 if not pn or (net_amt + tax_amt) <= 0: st.error("⚠️ 請填寫「專案名稱」且金額須大於 0")
                 else:
-                    if f_acc: b_acc = base64.b64encode(f_acc.getvalue()).decode(); acc_name_save = f_acc.name
-                    else: b_acc = "" if del_acc else safe_str(dv["ab64"]); acc_name_save = "" if del_acc else dv["acc_name"]
+                    if f_acc: b_acc = store_uploads([f_acc]); acc_name_save = f_acc.name
+                    else: b_acc = "" if del_acc else attachment_store.store_cell(safe_str(dv["ab64"])); acc_name_save = "" if del_acc else dv["acc_name"]
 
-                    retained_ims = [img for i, img in enumerate(existing_ims) if i not in del_ims]
+                    retained_ims = [attachment_store.store_cell(img) for i, img in enumerate(existing_ims) if i not in del_ims]
                     safe_existing_names = dv["ims_names"] + [f"舊版憑證 {i+1}" for i in range(len(existing_ims) - len(dv["ims_names"]))]
                     retained_names = [name for i, name in enumerate(safe_existing_names[:len(existing_ims)]) if i not in del_ims]
-                    new_ims_b64 = [base64.b64encode(f.getvalue()).decode() for f in f_ims] if f_ims else []
+                    new_ims_b64 = [store_uploads([f]) for f in f_ims] if f_ims else []
                     new_ims_names = [f.name for f in f_ims] if f_ims else []
                     final_ims_list = retained_ims + new_ims_b64
                     final_names_list = retained_names + new_ims_names
                     b_ims = "|".join(final_ims_list)
-                    packed_desc = "[請款單資料]\n" + json.dumps({"net_amt": net_amt, "tax_amt": tax_amt, "fee": fee, "inv_no": inv_no, "desc": desc, "acc_name": acc_name_save, "ims_names": final_names_list}, ensure_ascii=False)
-                    f_db = load_data(); proxy_app = curr_name if (curr_name == "Anita" and app_val != curr_name) else ""
+                    packed_desc = pack_req_json({"net_amt": net_amt, "tax_amt": tax_amt, "fee": fee, "inv_no": inv_no, "desc": desc, "acc_name": acc_name_save, "ims_names": final_names_list})
+                    proxy_app = curr_name if (curr_name == "Anita" and app_val != curr_name) else ""
                     
                     if st.session_state.req_edit_id:
-                        idx = f_db[f_db["單號"]==st.session_state.req_edit_id].index[0]
-                        f_db.loc[idx, ["申請人", "代申請人", "專案名稱", "專案編號", "專案負責人", "總金額", "請款說明", "請款廠商", "匯款帳戶", "付款方式", "影像Base64", "帳戶影像Base64", "幣別", "狀態"]] = [app_val, proxy_app, pn, pi, exe, total_amt, packed_desc, vdr, acc, pay, b_ims, b_acc, curr, "已存檔未提交"]
                         tid = st.session_state.req_edit_id; msg_prefix = "修改完畢並存檔"
+                        save_form_fields(tid, dict(zip(["申請人", "代申請人", "專案名稱", "專案編號", "專案負責人", "總金額", "請款說明", "請款廠商", "匯款帳戶", "付款方式", "影像Base64", "帳戶影像Base64", "幣別", "狀態"], [app_val, proxy_app, pn, pi, exe, total_amt, packed_desc, vdr, acc, pay, b_ims, b_acc, curr, "已存檔未提交"])), st.session_state.get("req_edit_version"))
                     else:
-                        tid = f"{datetime.date.today().strftime('%Y%m%d')}-{len(f_db[f_db['單號'].str.startswith(datetime.date.today().strftime('%Y%m%d'))])+1:02d}"
+                        # ★ 單號由資料庫序號配發，不再掃描整張表計數（同時存檔或刪單後會重複）
+                        tid = form_store.new_form_id(FORMS_DB, datetime.date.today().strftime('%Y%m%d'))
                         nr = {"單號":tid, "日期":str(datetime.date.today()), "類型":"請款單", "申請人":app_val, "代申請人":proxy_app, "專案負責人":exe, "專案名稱":pn, "專案編號":pi, "請款說明":packed_desc, "總金額":total_amt, "幣別":curr, "請款廠商":vdr, "匯款帳戶":acc, "付款方式":pay, "狀態":"已存檔未提交", "影像Base64":b_ims, "帳戶影像Base64":b_acc}
-                        f_db = pd.concat([f_db, pd.DataFrame([nr])], ignore_index=True); msg_prefix = "存檔成功"
-                    
-                    save_data(f_db)
+                        add_form(nr); msg_prefix = "存檔成功"
 
                     st.toast(f"✅ 單據 {tid} 存檔成功！", icon="💾")
 
                     if btn_submit:
-                        f_db = load_data(); idx = f_db[f_db["單號"]==tid].index[0]
-                        f_db.loc[idx, ["狀態", "提交時間"]] = ["待簽核", get_taiwan_time()]; save_data(f_db)
+                        save_form_fields(tid, {"狀態": "待簽核", "提交時間": get_taiwan_time()})
                         sys_name = st.session_state.get('sys_choice', '請款單系統')
-                        send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{tid}\n專案名稱：{pn}\n有一筆新的表單需要執行長 ({exe}) 進行簽核！")
+                        send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{tid}\n專案名稱：{pn}\n有一筆新的表單需要執行長 ({exe}) 進行簽核！", f"執行長 ({exe})", f"{sys_name}｜{tid}｜{pn}")
                         st.session_state.req_edit_id = None; st.session_state.req_last_msg = f"🚀 單據 {tid} 已成功提交簽核！"
                     else:
                         st.session_state.req_edit_id = None  
@@ -1520,6 +1523,8 @@ else:
         if not is_admin: my_db = my_db[my_db["申請人"] == curr_name]
         
         my_db = my_db.sort_values(by="單號", ascending=False).reset_index(drop=True)
+        # ★ 搜尋與分頁：手機卡片與桌機清單共用，只建立目前這一頁的按鈕
+        my_db = list_pager.paginate(my_db, "req_track") if not my_db.empty else my_db
 
         # 直式手機：申請追蹤清單改為可完整操作的單筆卡片；橫式仍使用下方原有欄位清單。
         with st.container(key="req-mobile-tracking-cards"):
@@ -1544,11 +1549,9 @@ else:
                     if st.button("📤 提交", key=f"mobile_submit_{mobile_id}_{mobile_i}", disabled=not mobile_can_edit, use_container_width=True):
                         st.session_state.req_edit_id = None
                         st.session_state.req_uploader_key += 1
-                        fdb = load_data()
-                        fdb.loc[fdb["單號"] == mobile_id, ["狀態", "提交時間"]] = ["待簽核", get_taiwan_time()]
-                        save_data(fdb)
+                        save_form_fields(mobile_id, {"狀態": "待簽核", "提交時間": get_taiwan_time()})
                         sys_name = st.session_state.get('sys_choice', '請款單系統')
-                        send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{mobile_id}\n專案名稱：{mobile_r['專案名稱']}\n有一筆新的表單需要執行長 ({mobile_r['專案負責人']}) 進行簽核！")
+                        send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{mobile_id}\n專案名稱：{mobile_r['專案名稱']}\n有一筆新的表單需要執行長 ({mobile_r['專案負責人']}) 進行簽核！", f"執行長 ({mobile_r['專案負責人']})", f"{sys_name}｜{mobile_id}｜{mobile_r['專案名稱']}")
                         st.toast(f"🚀 單據 {mobile_id} 已成功提交！", icon="✅")
                         st.rerun()
 
@@ -1557,12 +1560,11 @@ else:
                         st.rerun()
 
                     if st.button("🖨️ 列印", key=f"mobile_track_print_{mobile_id}_{mobile_i}", use_container_width=True):
-                        html_str = clean_for_js(render_html_with_attachments(mobile_r))
-                        js_code = f"<script>var w=window.open('');w.document.write('{html_str}');w.document.close();setTimeout(function(){{w.print();w.close();}}, 1000);</script>"
-                        st.components.v1.html(js_code, height=0)
+                        print_forms([mobile_id], f"mobile_track_print_{mobile_id}_{mobile_i}")
 
                     if st.button("✏️ 修改", key=f"mobile_track_edit_{mobile_id}_{mobile_i}", disabled=not mobile_can_edit, use_container_width=True):
                         st.session_state.req_edit_id = mobile_id
+                        st.session_state.req_edit_version = form_version(mobile_id)
                         st.session_state.req_uploader_key += 1
                         st.rerun()
 
@@ -1573,9 +1575,7 @@ else:
                                 if mobile_delete_reason.strip():
                                     st.session_state.req_edit_id = None
                                     st.session_state.req_uploader_key += 1
-                                    fresh_db = load_data()
-                                    fresh_db.loc[fresh_db["單號"] == mobile_id, ["狀態", "刪除人", "刪除時間", "刪除原因"]] = ["已刪除", curr_name, get_taiwan_time(), mobile_delete_reason]
-                                    save_data(fresh_db)
+                                    save_form_fields(mobile_id, {"狀態": "已刪除", "刪除人": curr_name, "刪除時間": get_taiwan_time(), "刪除原因": mobile_delete_reason})
                                     st.toast(f"🗑️ 單據 {mobile_id} 已成功刪除。", icon="✅")
                                     st.rerun()
                                 else:
@@ -1628,10 +1628,10 @@ else:
                     st.session_state.req_edit_id = None
                     st.session_state.req_uploader_key += 1
                     
-                    fdb = load_data(); fdb.loc[fdb["單號"]==r["單號"], ["狀態", "提交時間"]] = ["待簽核", get_taiwan_time()]; save_data(fdb)
+                    save_form_fields(r["單號"], {"狀態": "待簽核", "提交時間": get_taiwan_time()})
                     
                     sys_name = st.session_state.get('sys_choice', '請款單系統')
-                    send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n有一筆新的表單需要執行長 ({r['專案負責人']}) 進行簽核！")
+                    send_line_message(f"🔔【待簽核提醒】\n系統：{sys_name}\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n有一筆新的表單需要執行長 ({r['專案負責人']}) 進行簽核！", f"執行長 ({r['專案負責人']})", f"{sys_name}｜{r['單號']}｜{r['專案名稱']}")
                     
                     st.toast(f"🚀 單據 {r['單號']} 已成功提交！", icon="✅")
                     st.rerun()
@@ -1642,12 +1642,11 @@ else:
                     st.rerun()
                 
                 if b3.button("列印", key=f"p{i}"): 
-                    html_str = clean_for_js(render_html_with_attachments(r))
-                    js_code = f"<script>var w=window.open('');w.document.write('{html_str}');w.document.close();setTimeout(function(){{w.print();w.close();}}, 1000);</script>"
-                    st.components.v1.html(js_code, height=0)
+                    print_forms([r["單號"]], f"p{i}")
                     
                 if b4.button("修改", key=f"e{i}", disabled=not can_edit): 
                     st.session_state.req_edit_id = r["單號"]
+                    st.session_state.req_edit_version = form_version(r["單號"])
                     st.session_state.req_uploader_key += 1
                     st.rerun()
                 if can_edit:
@@ -1658,7 +1657,7 @@ else:
                                 st.session_state.req_edit_id = None
                                 st.session_state.req_uploader_key += 1
                                 
-                                fresh_db = load_data(); fresh_db.loc[fresh_db["單號"]==r["單號"], ["狀態", "刪除人", "刪除時間", "刪除原因"]] = ["已刪除", curr_name, get_taiwan_time(), reason]; save_data(fresh_db); 
+                                save_form_fields(r["單號"], {"狀態": "已刪除", "刪除人": curr_name, "刪除時間": get_taiwan_time(), "刪除原因": reason})
                                 st.toast(f"🗑️ 單據 {r['單號']} 已成功刪除。", icon="✅")
                                 st.rerun()
                             else: st.error("請輸入原因")
@@ -1670,28 +1669,26 @@ else:
 
     elif menu == "2. 專案執行長簽核":
         st.subheader("👨‍💼 專案執行長簽核管理")
-        f_db = load_data(); req_db = f_db[f_db["類型"]=="請款單"]
         t1, t2 = st.tabs(["⏳ 待簽核清單", "📜 歷史紀錄 (已核准/已駁回)"])
         with t1:
-            pending = req_db[req_db["狀態"].isin(["待簽核", "待初審"])]
-            if not is_admin: pending = pending[pending["專案負責人"] == curr_name]
+            # inbox 已依簽核人（專案負責人的第一個字）篩選，與側邊欄的待簽核數量一致
+            pending = load_pending(["待簽核", "待初審"], None if is_admin else curr_name)
             pending = pending.sort_values(by="單號", ascending=False).reset_index(drop=True)
             render_signing_table(pending, "EXE")
         with t2:
-            history_exe = req_db[req_db["狀態"].isin(["已核准", "已駁回", "待複審"])]
+            history_exe = load_list(["已核准", "已駁回", "待複審"])
             if not is_admin: history_exe = history_exe[(history_exe["初審人"] == curr_name) | (history_exe["專案負責人"] == curr_name) | (history_exe["申請人"] == curr_name) | (history_exe["代申請人"] == curr_name)]
             history_exe = history_exe.sort_values(by="單號", ascending=False).reset_index(drop=True)
             render_signing_table(history_exe, "EXE", is_history=True)
 
     elif menu == "3. 財務長簽核":
         st.subheader("💰 財務長簽核管理")
-        f_db = load_data(); req_db = f_db[f_db["類型"]=="請款單"]
         t1, t2 = st.tabs(["⏳ 待簽核清單", "📜 歷史紀錄 (已核准/已駁回)"])
         
         is_cfo_role = (curr_name == CFO_NAME) or is_admin
         
         with t1:
-            pending = req_db[req_db["狀態"] == "待複審"]
+            pending = load_pending(["待複審"])
             if not is_cfo_role:
                 pending = pending[(pending["申請人"] == curr_name) | (pending["代申請人"] == curr_name) | (pending["專案負責人"] == curr_name)]
                 if not pending.empty:
@@ -1706,7 +1703,7 @@ else:
                 else:
                     st.info("目前無待簽核單據")
         with t2:
-            history_cfo = req_db[req_db["狀態"].isin(["已核准", "已駁回"])]
+            history_cfo = load_list(["已核准", "已駁回"])
             if not is_cfo_role: 
                 history_cfo = history_cfo[(history_cfo["申請人"] == curr_name) | (history_cfo["代申請人"] == curr_name) | (history_cfo["專案負責人"] == curr_name) | (history_cfo["初審人"] == curr_name)]
             
@@ -1718,46 +1715,16 @@ else:
 
     elif menu == "4. 表單狀態總覽":
         st.subheader("📊 表單狀態總覽")
-        f_db = load_data(); my_db = f_db[f_db["類型"]=="請款單"]
+        overview_cols = ["單號", "專案名稱", "請款廠商", "總金額", "申請人", "狀態", "付款方式", "匯款狀態", "匯款日期"]
+        my_db = load_list(columns=overview_cols + ["專案負責人"])
         if not is_admin: my_db = my_db[(my_db["申請人"] == curr_name) | (my_db["專案負責人"] == curr_name)]
         my_db = my_db.sort_values(by="單號", ascending=False).reset_index(drop=True)
-        st.dataframe(my_db[["單號", "專案名稱", "請款廠商", "總金額", "申請人", "狀態", "付款方式", "匯款狀態", "匯款日期"]], hide_index=True)
+        st.dataframe(my_db[overview_cols], hide_index=True)
 
     elif menu == "5. 產出本期支出報表":
         st.subheader("📊 產出本期支出報表")
         st.info("💡 勾選清單中您預計於「本期」支付的單據，系統將自動套用您的 Excel 範本。")
         
-        # 定義：防呆寫入 Excel 函數 (極致穿透合併儲存格)
-        def safe_write_and_style(ws_obj, r_idx, c_idx, val=None, border=None, alignment=None):
-            try:
-                cell_obj = ws_obj.cell(row=r_idx, column=c_idx)
-                
-                if type(cell_obj).__name__ == 'MergedCell':
-                    for m_range in ws_obj.merged_cells.ranges:
-                        if cell_obj.coordinate in m_range:
-                            tl_cell = ws_obj.cell(row=m_range.min_row, column=m_range.min_col)
-                            if type(tl_cell).__name__ != 'MergedCell':
-                                cell_obj = tl_cell
-                            break
-                            
-                if type(cell_obj).__name__ == 'MergedCell':
-                    found = False
-                    for sr in range(r_idx, max(0, r_idx - 5), -1):
-                        for sc in range(c_idx, max(0, c_idx - 5), -1):
-                            tc = ws_obj.cell(row=sr, column=sc)
-                            if type(tc).__name__ != 'MergedCell':
-                                cell_obj = tc
-                                found = True
-                                break
-                        if found: break
-
-                if type(cell_obj).__name__ != 'MergedCell':
-                    if val is not None: cell_obj.value = val
-                    if border is not None: cell_obj.border = border
-                    if alignment is not None: cell_obj.alignment = alignment
-            except Exception:
-                pass
-
         f_db = load_data()
         req_db = f_db[f_db["類型"] == "請款單"]
         
@@ -1792,62 +1759,33 @@ else:
                 if selected_rows.empty:
                     st.error("請至少勾選一筆單據！")
                 else:
-                    possible_templates = [f for f in os.listdir(B_DIR) if "支出表" in f and f.endswith(".xlsx")]
+                    # ★ 範本版面（合併儲存格、摘要列位置）依檔案修改時間快取，寫入時直接查表
+                    TEMPLATE_FILE = expense_report.find_template(B_DIR)
                     
-                    if not possible_templates:
+                    if not TEMPLATE_FILE:
                         st.error("找不到範本檔案！請確認您的 GitHub 主目錄中是否有包含「支出表」字眼且副檔名為 `.xlsx` 的檔案。")
                     else:
-                        TEMPLATE_FILE = os.path.join(B_DIR, possible_templates[0])
                         try:
-                            import openpyxl
-                            from openpyxl.styles import Border, Side, Alignment
-                            
-                            wb = openpyxl.load_workbook(TEMPLATE_FILE)
-                            ws = wb.active
-                            
-                            safe_write_and_style(ws, 1, 1, f"時研國際設計股份有限公司\n{report_title}")
-                            safe_write_and_style(ws, 2, 4, pay_date)
-                            safe_write_and_style(ws, 2, 9, form_id)
-                            
-                            summary_start_row = 4
-                            for r in range(4, 200):
-                                try:
-                                    val = str(ws.cell(row=r, column=1).value or "").replace(" ", "")
-                                    if "匯款(含手續費)" in val:
-                                        summary_start_row = r
-                                        break
-                                except:
-                                    pass
-                                    
-                            available_rows = summary_start_row - 4
-                            num_items = len(selected_rows)
-                            
-                            if num_items > available_rows and available_rows > 0:
-                                ws.insert_rows(summary_start_row, amount=(num_items - available_rows))
-                                summary_start_row += (num_items - available_rows)
-                                
-                            current_row = 4
+                            items = []
                             sum_transfer = 0.0
                             sum_cash = 0.0
                             
-                            thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-                            
                             for idx, row_id in enumerate(selected_rows["單號"], 1):
                                 r = req_db[req_db["單號"] == row_id].iloc[0]
                                 date_str = str(r.get("日期", ""))
                                 proj = str(r.get("專案名稱", ""))
                                 vendor = str(r.get("請款廠商", ""))
                                 
-                                desc_raw = str(r.get("請款說明", ""))
-                                jd = parse_req_json(desc_raw)
-                                reason = jd.get("desc", desc_raw).replace("\n", " ")
+                                jd = req_fields(r)
+                                reason = jd["desc"].replace("\n", " ")
                                 
                                 amt = float(clean_amount(r.get("總金額", 0)))
                                 pay_method_raw = str(r.get("付款方式", ""))
                                 
                                 if "匯款" in pay_method_raw:
                                     pay_method = "匯款"
-                                    fee = float(jd.get("fee", 15.0 if "扣" in pay_method_raw else 0.0))
+                                    # 舊格式的請款說明沒有手續費欄位，沿用預設 15 元
+                                    fee = float(jd["fee"]) if form_store.REQUEST_MARK in str(r.get("請款說明", "")) else (15.0 if "扣" in pay_method_raw else 0.0)
                                 elif "現金" in pay_method_raw or "零用金" in pay_method_raw:
                                     pay_method = "現金"
                                     fee = 0.0
@@ -1859,72 +1797,37 @@ else:
                                 if pay_method == "匯款": sum_transfer += total
                                 else: sum_cash += total
                                 
-                                row_data = [idx, date_str, proj, vendor, reason, amt, fee if fee else "", total, pay_method, r["單號"]]
-                                for col_idx, val in enumerate(row_data, 1):
-                                    safe_write_and_style(ws, current_row, col_idx, val, thin_border, Alignment(wrap_text=True, vertical='center'))
-                                
-                                current_row += 1
+                                items.append([idx, date_str, proj, vendor, reason, amt, fee if fee else "", total, pay_method, r["單號"]])
                                 
                             sum_all = sum_transfer + sum_cash
                             balance_after = float(balance_before) - sum_transfer if balance_before else 0.0
+                            totals = {"transfer": sum_transfer, "check": 0.0, "cash": sum_cash, "total": sum_all, "balance_before": float(balance_before), "balance_after": balance_after}
+                            # ★ 報表寫到暫存匯出檔，session 只保留檔案代號，不再存整份位元組
+                            export_store.discard(st.session_state.get('temp_xlsx'))
+                            handle, xlsx_path = export_store.create(f"支出報表_{pay_date}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                            expense_report.render_report(TEMPLATE_FILE, report_title, pay_date, form_id, items, totals, output=xlsx_path)
                             
-                            def get_cell_text(ws_obj, r_idx, c_idx):
-                                try:
-                                    cell_obj = ws_obj.cell(row=r_idx, column=c_idx)
-                                    if type(cell_obj).__name__ == 'MergedCell':
-                                        for m_range in ws_obj.merged_cells.ranges:
-                                            if cell_obj.coordinate in m_range:
-                                                tl_cell = ws_obj.cell(row=m_range.min_row, column=m_range.min_col)
-                                                return str(tl_cell.value or "").replace(" ", "")
-                                    return str(cell_obj.value or "").replace(" ", "")
-                                except: return ""
-
-                            for r in range(summary_start_row, summary_start_row + 30):
-                                row_text = ""
-                                for c in range(1, 8):
-                                    row_text += get_cell_text(ws, r, c)
-                                        
-                                if "匯款(含手續費)" in row_text:
-                                    safe_write_and_style(ws, r, 8, sum_transfer)
-                                elif row_text.startswith("支票") and "小計" in row_text:
-                                    safe_write_and_style(ws, r, 8, 0.0)
-                                elif row_text.startswith("現金") and "小計" in row_text:
-                                    safe_write_and_style(ws, r, 8, sum_cash)
-                                elif "合計(匯款+現金)" in row_text:
-                                    safe_write_and_style(ws, r, 8, sum_all)
-                                elif "扣掉固定費用" in row_text:
-                                    safe_write_and_style(ws, r, 8, float(balance_before))
-                                elif "扣掉此次" in row_text:
-                                    safe_write_and_style(ws, r, 8, balance_after)
-                                    
-                            output = io.BytesIO()
-                            wb.save(output)
-                            xlsx_data = output.getvalue()
-                            
-                            st.session_state.temp_xlsx_data = xlsx_data
-                            st.session_state.temp_xlsx_name = f"支出報表_{pay_date}.xlsx"
+                            st.session_state.temp_xlsx = handle
                             st.session_state.temp_xlsx_selected = selected_rows["單號"].tolist()
                             st.success("🎉 Excel 報表產生成功！請點擊下方按鈕下載或標記為已匯款。")
                             
                         except Exception as e:
                             st.error(f"產生 Excel 發生錯誤：{e}")
             
-            if st.session_state.get('temp_xlsx_data'):
+            xlsx_file = export_store.open_export(st.session_state.get('temp_xlsx'))
+            if xlsx_file:
                 col_dl, col_mark = st.columns(2)
-                col_dl.download_button(
-                    label="📥 下載 Excel 報表", 
-                    data=st.session_state.temp_xlsx_data, 
-                    file_name=st.session_state.temp_xlsx_name, 
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+                with xlsx_file:
+                    col_dl.download_button(
+                        label="📥 下載 Excel 報表", 
+                        data=xlsx_file, 
+                        file_name=st.session_state.temp_xlsx.name, 
+                        mime=st.session_state.temp_xlsx.mime
+                    )
                 if col_mark.button("🚀 將上述單據標記為「已匯款」"):
-                    f_db = load_data()
                     today_str = str(datetime.date.today())
-                    for sel_id in st.session_state.temp_xlsx_selected:
-                        idx = f_db[f_db["單號"]==sel_id].index[0]
-                        f_db.loc[idx, ["匯款狀態", "匯款日期"]] = ["已匯款", today_str]
-                    save_data(f_db)
-                    st.session_state.temp_xlsx_data = None 
+                    save_forms_fields({sel_id: {"匯款狀態": "已匯款", "匯款日期": today_str} for sel_id in st.session_state.temp_xlsx_selected})
+                    export_store.discard(st.session_state.temp_xlsx); st.session_state.temp_xlsx = None
                     st.success("✅ 已成功標記為「已匯款」！")
                     time.sleep(1.5)
                     st.rerun()
@@ -1933,8 +1836,12 @@ else:
         st.subheader("⚙️ 請款狀態 / 系統設定")
         if is_admin:
             with st.expander("🐙 4. GitHub 自動備份同步設定", expanded=True):
-                st.write("設定完成後，每次存檔都會自動覆蓋 GitHub 上的 CSV 檔！(永不遺失)")
+                st.write("設定完成後，每次存檔都會自動在背景備份到 GitHub！(永不遺失)")
                 g_token, g_repo, g_branch, g_source = get_github_config()
+                sync_status = GITHUB_SYNC.status()
+                last_ok = sync_status.last_success.strftime('%Y-%m-%d %H:%M:%S') if sync_status.last_success else "尚未成功"
+                st.info(f"📤 待上傳檔案：{sync_status.pending} 個 ｜ 最後成功備份：{last_ok} ｜ 累計 commit：{sync_status.commits}")
+                if sync_status.last_error: st.warning(f"⚠️ 最近一次備份失敗（將自動重試）：{sync_status.last_error}")
                 st.caption(f"GitHub credential source: {g_source}. Leave the token unchanged if it is already configured.")
                 
                 i_token = st.text_input("GitHub Token（要更換才輸入）", value="", type="password", placeholder="已設定則留白")
@@ -1946,7 +1853,7 @@ else:
                     if not clean_token or not clean_repo: st.error("❌ 請輸入有效的 Token 與倉庫名稱。")
                     else:
                         encoded_token = base64.b64encode(clean_token.encode()).decode()
-                        with open(G_FILE, "w", encoding="utf-8") as f: f.write(f"{encoded_token}\n{clean_repo}\n{g_branch or DEFAULT_GITHUB_BRANCH}")
+                        atomic_io.write_text(G_FILE, f"{encoded_token}\n{clean_repo}\n{g_branch or DEFAULT_GITHUB_BRANCH}")
                         try:
                             url = f"https://api.github.com/repos/{clean_repo}"; headers = {"Authorization": f"token {clean_token}"}
                             res = requests.get(url, headers=headers, timeout=5)
@@ -1957,17 +1864,13 @@ else:
                 st.markdown("---"); st.write("💡 **如果您的舊單據或人員密碼還沒上傳到 GitHub，請點擊下方按鈕強制備份：**")
                 if c_btn2.button("🚀 一鍵強制同步所有資料至 GitHub"):
                     with st.spinner("正在將所有資料（包含舊單據與密碼）傳送至 GitHub，請稍候..."):
-                        if os.path.exists(D_FILE): sync_to_github(D_FILE)
-                        if os.path.exists(S_FILE): sync_to_github(S_FILE)
-                        if os.path.exists(P_FILE): sync_to_github(P_FILE)
-                        if os.path.exists(V_FILE): sync_to_github(V_FILE)
-                        if os.path.exists(L_FILE): sync_to_github(L_FILE) 
-                        if os.path.exists(G_FILE): sync_to_github(G_FILE)
-                        time.sleep(2) 
-                    st.success("✅ 資料庫、人員密碼、專案、廠商與「設定參數」已全部發送至 GitHub 同步！")
+                        sync_to_github(FORMS_DB, S_FILE, P_FILE, V_FILE, *attachment_store.stored_paths())
+                        flushed = GITHUB_SYNC.flush(timeout=120)
+                    if flushed: st.success("✅ 資料庫、人員密碼、專案、廠商與附件已全部同步至 GitHub！")
+                    else: st.warning(f"⏳ 仍有 {GITHUB_SYNC.queue_depth()} 個檔案在背景上傳中，稍後可於上方查看狀態。")
 
             with st.expander("🧰 3. 專案與廠商資料庫 (備份、還原與重建)", expanded=False):
-                st.write("💡 **資料不見了怎麼辦？** 如果雲端重啟導致您之前建檔的廠商與專案消失，只要點擊下方按鈕，系統就會自動去「歷史表單 (database.csv)」裡面，把您曾經打過的專案跟廠商全部抓出來重建！")
+                st.write("💡 **資料不見了怎麼辦？** 如果雲端重啟導致您之前建檔的廠商與專案消失，只要點擊下方按鈕，系統就會自動去「歷史表單資料庫 (forms.db)」裡面，把您曾經打過的專案跟廠商全部抓出來重建！")
                 if st.button("🪄 一鍵從歷史單據找回/重建專案與廠商"):
                     with st.spinner("正在從歷史單據中打撈資料..."):
                         f_db = load_data()
@@ -1986,26 +1889,36 @@ else:
                 col_down, col_up = st.columns(2)
                 with col_down:
                     st.write("⬇️ **步驟一：下載最新表單資料庫**")
-                    if os.path.exists(D_FILE):
-                        with open(D_FILE, "rb") as f: st.download_button("下載表單備份檔", f, file_name=f"時研系統表單備份_{datetime.date.today()}.csv", mime="text/csv")
+                    # ★ 備份為 zip（表單 CSV + 附件檔），逐檔寫到暫存匯出檔，不在記憶體裡組 base64
+                    if st.button("產生表單備份檔"):
+                        handle, zip_path = export_store.create(f"時研系統表單備份_{datetime.date.today()}.zip", "application/zip")
+                        attachment_store.export_forms_zip(FORMS_DB, zip_path)
+                        with export_store.open_export(handle) as f: st.download_button("下載表單備份檔", f, file_name=handle.name, mime=handle.mime)
                 with col_up:
                     st.write("⬆️ **步驟二：還原表單資料庫**")
-                    up_db = st.file_uploader("上傳表單 CSV 檔", type=["csv"], key="up_db", label_visibility="collapsed")
+                    up_db = st.file_uploader("上傳表單備份檔 (zip 或 CSV)", type=["zip", "csv"], key="up_db", label_visibility="collapsed")
                     if up_db and st.button("確認還原表單"):
-                        with open(D_FILE, "wb") as f: f.write(up_db.getbuffer())
-                        st.success("表單資料庫已還原！"); time.sleep(1); st.rerun()
+                        # ★ 無法辨識的金額會記為 0 並列出，不再默默變成 0
+                        amount_issues = []
+                        sync_to_github(FORMS_DB, *attachment_store.restore_forms_backup(FORMS_DB, up_db.name, up_db, issues=amount_issues))
+                        if amount_issues: st.warning(f"⚠️ 表單已還原，但有 {len(amount_issues)} 個金額無法辨識，已記為 0，請手動更正：\n" + "\n".join(f"- {fid}｜{col}：{raw}" for fid, col, raw in amount_issues[:20]))
+                        else: st.success("表單資料庫已還原！"); time.sleep(1); st.rerun()
                     
             with st.expander("👥 2. 人員與大頭貼資料備份與還原"):
                 col_down2, col_up2 = st.columns(2)
                 with col_down2:
                     st.write("⬇️ **步驟一：下載最新人員資料 (含大頭貼與LINE ID)**")
-                    if os.path.exists(S_FILE):
-                        with open(S_FILE, "rb") as f: st.download_button("下載人員備份檔", f, file_name=f"時研系统人員備份_{datetime.date.today()}.csv", mime="text/csv")
+                    # ★ 名單只存大頭貼代號，備份為 zip（名單 CSV + 大頭貼檔），換主機還原後大頭貼才不會遺失
+                    if os.path.exists(S_FILE) and st.button("產生人員備份檔"):
+                        handle, zip_path = export_store.create(f"時研系統人員備份_{datetime.date.today()}.zip", "application/zip")
+                        avatar_store.export_staff_zip(S_FILE, zip_path)
+                        with export_store.open_export(handle) as f: st.download_button("下載人員備份檔", f, file_name=handle.name, mime=handle.mime)
                 with col_up2:
                     st.write("⬆️ **步驟二：還原人員資料**")
-                    uploaded_staff = st.file_uploader("上傳人員 CSV 檔", type=["csv"], key="up_staff", label_visibility="collapsed")
+                    uploaded_staff = st.file_uploader("上傳人員備份檔 (zip 或 CSV)", type=["zip", "csv"], key="up_staff", label_visibility="collapsed")
                     if uploaded_staff and st.button("確認還原人員資料"):
-                        with open(S_FILE, "wb") as f: f.write(uploaded_staff.getbuffer())
+                        # 舊的 CSV 備份若含內嵌 base64 大頭貼，還原後會重新搬到附件儲存區
+                        sync_to_github(S_FILE, *avatar_store.restore_staff_backup(S_FILE, uploaded_staff.name, uploaded_staff.getvalue()))
                         st.session_state.staff_df = load_staff(); st.success("人員資料已還原！"); time.sleep(1); st.rerun()
 
             with st.expander("🔔 3. LINE 官方帳號推播設定 (全域 Token & 行政副本 ID)", expanded=True):
@@ -2014,6 +1927,10 @@ else:
                 nt = st.text_input("Channel Access Token (長字串)", value=ct, type="password")
                 nu = st.text_input("行政專屬 User ID (U開頭，用來接收所有副本)", value=cu)
                 if st.button("💾 儲存 LINE 設定"): save_line_credentials(nt, nu); st.success("LINE 推播設定已成功儲存並啟用！"); time.sleep(1); st.rerun()
+                ls = LINE_NOTIFY.stats()
+                lc1, lc2, lc3 = st.columns(3)
+                lc1.metric("已送出", ls.sent); lc2.metric("等待發送", ls.pending); lc3.metric("發送失敗", ls.failed)
+                if ls.last_error: st.caption(f"最近一次錯誤：{ls.last_error}")
             st.divider()
 
         st.subheader("💰 財務匯款註記")
@@ -2027,8 +1944,8 @@ else:
             if is_admin:
                 ed = st.data_editor(df_pay[["單號", "專案名稱", "請款廠商", "總金額", "匯款狀態", "匯款日期"]], hide_index=True, column_config={"匯款狀態": st.column_config.SelectboxColumn("匯款狀態", options=["尚未匯款", "已匯款"]), "匯款日期": st.column_config.DateColumn("匯款日期", format="YYYY-MM-DD")})
                 if st.button("💾 儲存匯款資訊"):
-                    for _, row in ed.iterrows(): f_db.loc[f_db["單號"]==row["單號"], ["匯款狀態", "匯款日期"]] = [row["匯款狀態"], str(row["匯款日期"]) if pd.notna(row["匯款日期"]) else ""]
-                    save_data(f_db); st.success("已更新"); st.rerun()
+                    save_forms_fields({row["單號"]: {"匯款狀態": row["匯款狀態"], "匯款日期": str(row["匯款日期"]) if pd.notna(row["匯款日期"]) else ""} for _, row in ed.iterrows()})
+                    st.success("已更新"); st.rerun()
             else: st.dataframe(df_pay[["單號", "專案名稱", "請款廠商", "總金額", "匯款狀態", "匯款日期"]], hide_index=True)
 
     elif menu == "7. 專案 / 廠商資料庫":
@@ -2094,8 +2011,7 @@ else:
                     st.warning(f"⚠️ 以下單號因狀態非「已核准」，為保護進行中案件，已自動略過不予刪除：{', '.join(invalid_selected)}")
                 
                 if selected_to_del:
-                    new_db = f_db[~f_db["單號"].isin(selected_to_del)]
-                    save_data(new_db)
+                    form_store.delete_forms(FORMS_DB, selected_to_del); sync_to_github(FORMS_DB)
                     st.success(f"✅ 已成功永久刪除 {len(selected_to_del)} 筆「已核准」單據！資料庫檔案已瘦身並同步。")
                     time.sleep(2)
                     st.rerun()
@@ -2103,11 +2019,5 @@ else:
                     st.error("請先勾選要刪除的單據！")
 
     if st.session_state.get('req_print_id'):
-        r_df = load_data()
-        r_df = r_df[r_df["單號"]==st.session_state.req_print_id]
-        if not r_df.empty:
-            r = r_df.iloc[0]
-            html_str = clean_for_js(render_html_with_attachments(r))
-            js_code = f"<script>var w=window.open('');w.document.write('{html_str}');w.document.close();setTimeout(function(){{w.print();w.close();}}, 1000);</script>"
-            st.components.v1.html(js_code, height=0)
+        print_forms([st.session_state.req_print_id], "req_print")
         st.session_state.req_print_id = None
@@ -1,6 +1,15 @@
 import streamlit as st
 import pandas as pd
 import datetime, os, base64, time, requests, json, io
+import form_store
+import form_conversion
+import excel_preview
+import attachment_store
+import export_store
+import data_cache
+import avatar_store
+import atomic_io
+import presence
 from ai_assistant import render_ai_operations_assistant
 
 # --- 1. 系統鎖定與介面設定 ---
@@ -83,7 +92,10 @@ input, textarea { color: var(--ink) !important; }
 
 # --- 2. 路徑與資料庫定位 ---
 B_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-D_FILE, S_FILE, O_FILE, L_FILE = [os.path.join(B_DIR, f) for f in ["database.csv", "staff_v2.csv", "online.csv", "line_credentials.txt"]]
+D_FILE, S_FILE, O_FILE, L_FILE = [os.path.join(B_DIR, f) for f in ["database.csv", "staff_v2.csv", "online_heartbeat.tsv", "line_credentials.txt"]]
+FORMS_DB = os.path.join(B_DIR, "forms.db")
+form_store.open_store(FORMS_DB, D_FILE)  # 第一次開啟時自動匯入舊的 database.csv
+attachment_store.migrate_forms(FORMS_DB)  # 附件改存 attachments/，舊的 base64 附件搬出表單
 ADMINS, DEFAULT_STAFF = ["Anita"], ["Andy", "Charles", "Eason", "Sunglin", "Anita"]
 
 # --- 3. [資料庫] 報價細項選單 (嚴格依照 Excel 內容) ---
@@ -106,42 +118,48 @@ def clean_amount(val):
     except: return 0
 def clean_name(val): return str(val).strip().split(" ")[0] if pd.notna(val) and str(val).strip() != "" else ""
 
+# ★ 在線名單改由 presence 在記憶體維護、各工作階段共用；心跳檔只偶爾附加一行，不再每次點擊都改寫檔案
+ONLINE = presence.registry(O_FILE)
+SYS_NAME = "報價單系統"
+
 def get_online_users(curr_user):
-    try:
-        now = time.time()
-        df = pd.read_csv(O_FILE) if os.path.exists(O_FILE) else pd.DataFrame(columns=["user", "time"])
-        df = df[df["user"] != curr_user]
-        df = pd.concat([df, pd.DataFrame([{"user": curr_user, "time": now}])], ignore_index=True)
-        df = df[now - pd.to_numeric(df["time"], errors='coerce').fillna(0) <= 300]
-        df.to_csv(O_FILE, index=False); return len(df["user"].unique())
+    try: ONLINE.touch(SYS_NAME, curr_user); return max(ONLINE.count(), 1)
     except: return 1
 
+def system_online_counts():
+    try: return ONLINE.counts()
+    except: return {}
+
 def load_data():
-    if not os.path.exists(D_FILE): return pd.DataFrame()
-    try:
-        df = pd.read_csv(D_FILE, encoding='utf-8-sig', dtype=str).fillna("")
-        for c in ["總金額", "已請款金額", "尚未請款金額"]:
-            if c in df.columns: df[c] = df[c].apply(clean_amount)
-        return df
-    except: return pd.DataFrame()
-
-def save_data(df):
-    try: df.reset_index(drop=True).to_csv(D_FILE, index=False, encoding='utf-8-sig')
-    except: st.error("⚠️ 存檔失敗！請關閉電腦上的 database.csv。"); st.stop()
+    try: return data_cache.load(FORMS_DB, lambda: form_store.load_forms(FORMS_DB), "forms")
+    except: return pd.DataFrame(columns=form_store.FORM_COLUMNS)
+
+def form_version(form_id):
+    r = form_store.get_form(FORMS_DB, form_id)
+    return None if r is None else r[form_store.VERSION_COLUMN]
+
+# ★ expected_version：開啟編輯時的版本，期間若被別人改過就拒絕寫入
+def save_form_fields(form_id, values, expected_version=None):
+    try: form_store.update_form(FORMS_DB, form_id, values, expected_version); data_cache.invalidate(FORMS_DB)
+    except form_store.VersionConflict as e: st.error(f"⚠️ 單據 {e.form_ids[0]} 在您編輯期間已被其他人修改，為避免覆蓋對方的變更，本次未存檔。請取消修改後重新開啟。"); st.stop()
+    except Exception as e: st.error(f"⚠️ 存檔失敗！錯誤：{e}"); st.stop()
+
+def save_forms_fields(updates, new_forms=()):
+    try: form_store.update_forms(FORMS_DB, updates, new_forms); data_cache.invalidate(FORMS_DB)
+    except Exception as e: st.error(f"⚠️ 存檔失敗！錯誤：{e}"); st.stop()
 
 def load_staff():
+    avatar_store.migrate_staff_csv(S_FILE)
     if not os.path.exists(S_FILE): return pd.DataFrame({"name": DEFAULT_STAFF, "password": ["0000"]*5})
-    return pd.read_csv(S_FILE, encoding='utf-8-sig', dtype=str).fillna("")
+    return data_cache.read_csv(S_FILE)
 
-def parse_quote_json(desc_raw):
-    try:
-        if "[報價單資料]" in desc_raw: return json.loads(desc_raw.split("[報價單資料]")[1].strip())
-    except: pass
-    return {"c_name": "", "address": "", "is_inv": False, "inv_no": "", "tax": 0, "items": []}
+# ★ 客戶、發票與報價細項在存檔時已由 form_store 展開成欄位與 quote_items 表，不再解析請款說明裡的 JSON
+def quote_fields(row):
+    return {"c_name": str(row.get("客戶名稱", "")), "address": str(row.get("施工地址", "")), "is_inv": bool(clean_amount(row.get("開立發票", 0))), "inv_no": str(row.get("發票號碼", "")), "tax": clean_amount(row.get("稅額", 0)), "items": form_store.load_quote_items(FORMS_DB, row["單號"])}
 
 # --- 5. HTML 專業報價單渲染 ---
 def render_html(row):
-    data = parse_quote_json(row.get("請款說明", ""))
+    data = quote_fields(row)
     total_net = clean_amount(row['總金額']) - data.get("tax", 0)
     h = f'<div style="padding:20px;border:2px solid #000;background:#fff;color:#000;font-family:sans-serif;">'
     h += f'<div style="text-align:center;"><h2>時研國際設計 - 工程報價單</h2></div>'
@@ -171,14 +189,17 @@ curr_name, is_active, is_admin = st.session_state.user_id, (st.session_state.use
 # --- 7. 左側側邊欄 (嚴格對齊) ---
 st.sidebar.markdown(f"**📌 目前系統：** `報價單系統`")
 st.sidebar.divider()
-avatar_b64 = ""
-try: avatar_b64 = st.session_state.staff_df[st.session_state.staff_df["name"] == curr_name].iloc[0].get("avatar", "")
+# ★ 只在側邊欄顯示時讀取目前使用者的大頭貼縮圖
+avatar_src = ""
+try: avatar_src = avatar_store.avatar_url(st.session_state.staff_df[st.session_state.staff_df["name"] == curr_name].iloc[0].get("avatar", ""))
 except: pass
 
-if avatar_b64: st.sidebar.markdown(f'<div style="display:flex;align-items:center;gap:12px;margin-bottom:15px;"><img src="data:image/jpeg;base64,{avatar_b64}" style="width:60px;height:60px;border-radius:50%;object-fit:cover;border:3px solid #eee;"><span style="font-size:22px;font-weight:bold;color:#333;">{curr_name}</span></div>', unsafe_allow_html=True)
+if avatar_src: st.sidebar.markdown(f'<div style="display:flex;align-items:center;gap:12px;margin-bottom:15px;"><img src="{avatar_src}" style="width:60px;height:60px;border-radius:50%;object-fit:cover;border:3px solid #eee;"><span style="font-size:22px;font-weight:bold;color:#333;">{curr_name}</span></div>', unsafe_allow_html=True)
 else: st.sidebar.markdown(f"### 👤 {curr_name}")
 
-st.sidebar.info(f"🟢 在線人數：**{get_online_users(curr_name)}** 人")
+online_count = get_online_users(curr_name)
+online_by_system = "｜".join(f"{k} {v} 人" for k, v in system_online_counts().items())
+st.sidebar.info(f"🟢 在線人數：**{online_count}** 人" + (f"\n\n{online_by_system}" if online_by_system else ""))
 with st.sidebar.expander("🔐 修改密碼/大頭貼"):
     new_pw = st.text_input("新密碼", type="password")
     if st.button("更新密碼") and len(new_pw) >= 4:
@@ -189,7 +210,9 @@ if is_admin:
     st.sidebar.success("管理員模式")
     with st.sidebar.expander("⚙️ 系統資料管理"):
         if st.button("下載資料庫備份"):
-            with open(D_FILE, "rb") as f: st.download_button("點此下載", f, file_name="database.csv")
+            handle, zip_path = export_store.create("database.zip", "application/zip")
+            attachment_store.export_forms_zip(FORMS_DB, zip_path)
+            with export_store.open_export(handle) as f: st.download_button("點此下載", f, file_name=handle.name, mime=handle.mime)
 
 if st.sidebar.button("登出系統"): st.session_state.user_id = None; st.switch_page("app.py")
 
@@ -206,7 +229,7 @@ if menu == "1. 填寫申請單":
     dv = {"app": curr_name, "pn": "", "pi": "", "exe": staffs[0], "c_name": "", "address": "", "ib64": "", "is_inv": False, "inv_no": ""}
     if st.session_state.edit_id:
         r = db[db["單號"]==st.session_state.edit_id].iloc[0]
-        jd = parse_quote_json(r["請款說明"])
+        jd = quote_fields(r)
         dv.update({"app": r["申請人"], "pn": r["專案名稱"], "pi": r["專案編號"], "exe": r["專案負責人"], "c_name": jd.get("c_name"), "address": jd.get("address"), "ib64": r["影像Base64"], "is_inv": jd.get("is_inv"), "inv_no": jd.get("inv_no")})
         if not st.session_state.quote_items: st.session_state.quote_items = jd.get("items", [])
 
@@ -251,18 +274,18 @@ if menu == "1. 填寫申請單":
 
     if st.button("💾 儲存報價單", type="primary"):
         if pn and c_name and st.session_state.quote_items:
-            packed = "[報價單資料]\n" + json.dumps({"c_name": c_name, "address": address, "is_inv": is_inv, "inv_no": inv_no, "tax": tax, "items": st.session_state.quote_items}, ensure_ascii=False)
-            b_ims = "|".join([base64.b64encode(f.getvalue()).decode() for f in f_ims]) if f_ims else dv["ib64"]
-            fresh_db = load_data()
+            packed = form_store.QUOTE_MARK + "\n" + json.dumps({"c_name": c_name, "address": address, "is_inv": is_inv, "inv_no": inv_no, "tax": tax, "items": st.session_state.quote_items}, ensure_ascii=False)
+            b_ims = attachment_store.store_files([f.getvalue() for f in f_ims]) if f_ims else dv["ib64"]
+            for ref in attachment_store.split_cell(b_ims) if f_ims else []: excel_preview.warm(ref)
             if st.session_state.edit_id:
-                idx = fresh_db[fresh_db["單號"]==st.session_state.edit_id].index[0]
-                fresh_db.loc[idx, ["申請人", "專案名稱", "專案編號", "專案負責人", "請款說明", "總金額", "影像Base64", "尚未請款金額"]] = [app_val, pn, pi, exe, packed, total, b_ims, total]
+                save_form_fields(st.session_state.edit_id, {"申請人": app_val, "專案名稱": pn, "專案編號": pi, "專案負責人": exe, "請款說明": packed, "總金額": total, "影像Base64": b_ims, "尚未請款金額": total}, st.session_state.get("edit_version"))
                 st.session_state.edit_id = None
             else:
-                tid = f"Q{datetime.date.today().strftime('%Y%m%d')}-{len(fresh_db[fresh_db['單號'].str.startswith('Q')])+1:02d}"
+                # ★ 單號由資料庫序號配發（每天重新編號），不再計算所有 Q 開頭的單據
+                tid = form_store.new_form_id(FORMS_DB, f"Q{datetime.date.today().strftime('%Y%m%d')}")
                 nr = {"單號":tid, "日期":str(datetime.date.today()), "類型":"報價單", "申請人":app_val, "專案負責人":exe, "專案名稱":pn, "專案編號":pi, "請款說明":packed, "總金額":total, "狀態":"已核准", "影像Base64":b_ims, "尚未請款金額":total, "已請款金額":0}
-                fresh_db = pd.concat([fresh_db, pd.DataFrame([nr])], ignore_index=True)
-            save_data(fresh_db); st.success("報價單已成功存檔！"); st.session_state.quote_items = []; time.sleep(1); st.rerun()
+                save_forms_fields({}, [nr])
+            st.success("報價單已成功存檔！"); st.session_state.quote_items = []; time.sleep(1); st.rerun()
 
     st.divider(); st.subheader("📋 報價追蹤清單")
     my_db = load_data(); my_db = my_db[my_db["類型"] == "報價單"]
@@ -276,9 +299,9 @@ if menu == "1. 填寫申請單":
             b1, b2, b3, b4 = st.columns(4)
             if b1.button("預覽", key=f"v_{i}"): st.session_state.view_id = r["單號"]; st.rerun()
             if b2.button("列印", key=f"p_{i}"): st.components.v1.html(f"<script>var w=window.open();w.document.write('{clean_for_js(render_html(r))}');w.print();w.close();</script>", height=0)
-            if b3.button("修改", key=f"e_{i}"): st.session_state.edit_id = r["單號"]; st.rerun()
+            if b3.button("修改", key=f"e_{i}"): st.session_state.edit_id = r["單號"]; st.session_state.edit_version = form_version(r["單號"]); st.rerun()
             if b4.button("刪除", key=f"d_{i}"):
-                fdb = load_data(); fdb.at[fdb[fdb["單號"]==r["單號"]].index[0], "狀態"] = "已刪除"; save_data(fdb); st.rerun()
+                save_form_fields(r["單號"], {"狀態": "已刪除"}); st.rerun()
 
 # ================= 頁面 2 & 3: 簽核 (保留畫面) =================
 elif menu in ["2. 專案執行長簽核", "3. 財務長簽核"]:
@@ -292,36 +315,43 @@ elif menu == "4. 表單狀態總覽及轉採購單":
         df = sys_db.copy(); df.insert(0, "轉成採購單", False); df.insert(1, "本次轉入金額", 0)
         ed = st.data_editor(df, disabled=["單號","專案名稱","總金額","狀態","已請款金額","尚未請款金額"], hide_index=True)
         if st.button("🚀 執行轉換 (生成採購單草稿)"):
-            fdb = load_data(); count = 0
-            for _, row in ed.iterrows():
-                if row["轉成採購單"] and row["本次轉入金額"] > 0:
-                    idx = fdb[fdb["單號"]==row["單號"]].index[0]
-                    if row["本次轉入金額"] > clean_amount(fdb.at[idx, "尚未請款金額"]): st.error(f"{row['單號']} 超額"); continue
-                    fdb.at[idx, "已請款金額"] += row["本次轉入金額"]; fdb.at[idx, "尚未請款金額"] -= row["本次轉入金額"]
-                    nr = {"單號":f"PO-F-{row['單號']}-{int(time.time())%100}", "日期":str(datetime.date.today()), "類型":"採購單", "申請人":curr_name, "專案名稱":row["專案名稱"], "總金額":row["本次轉入金額"], "狀態":"已儲存", "請款說明":f"從報價單 {row['單號']} 轉入"}
-                    fdb = pd.concat([fdb, pd.DataFrame([nr])], ignore_index=True); count += 1
-            if count > 0: save_data(fdb); st.success(f"成功轉換 {count} 筆！"); st.rerun()
+            # ★ 與採購單轉請款單共用 form_conversion：整批比對尚未請款金額、同一個交易寫入
+            rule = form_conversion.ConversionRule(available=form_conversion.balance_from_unbilled, id_prefix=lambda q: f"PO-F-{q['單號']}",
+                build=lambda q, amount, new_id: {"單號":new_id, "日期":str(datetime.date.today()), "類型":"採購單", "申請人":curr_name, "專案名稱":q["專案名稱"], "總金額":amount, "狀態":"已儲存", "請款說明":f"從報價單 {q['單號']} 轉入"})
+            picked = ed[ed["轉成採購單"].astype(bool)]
+            try: report = form_conversion.convert_forms(FORMS_DB, zip(picked["單號"], picked["本次轉入金額"]), rule)
+            except Exception as e: st.error(f"⚠️ 存檔失敗！錯誤：{e}"); st.stop()
+            data_cache.invalidate(FORMS_DB)
+            for r in report:
+                if r.result == "over_balance": st.error(f"{r.source_id} 超額（尚未請款金額 {r.available:,}）")
+                elif r.result == "missing": st.error(f"{r.source_id} 已不存在")
+                elif r.result == "conflict": st.error(f"{r.source_id} 已被其他人修改，請重新整理後再試")
+            count = sum(r.result == "ok" for r in report)
+            if count > 0: st.success(f"成功轉換 {count} 筆！"); st.rerun()
 
 # ================= 頁面 5: 系統設定 (同步對齊) =================
 elif menu == "5. 請款狀態/系統設定":
     st.title("⚙️ 請款狀態 / 系統設定")
     with st.expander("💾 資料庫備份與還原", expanded=True):
-        if os.path.exists(D_FILE):
-            with open(D_FILE, "rb") as f: st.download_button("⬇️ 下載最新備份", f, file_name="database.csv")
-        up = st.file_uploader("⬆️ 上傳 CSV 還原備份", type=["csv"])
+        if os.path.exists(FORMS_DB) and st.button("產生最新備份"):
+            handle, zip_path = export_store.create("database.zip", "application/zip")
+            attachment_store.export_forms_zip(FORMS_DB, zip_path)
+            with export_store.open_export(handle) as f: st.download_button("⬇️ 下載最新備份", f, file_name=handle.name, mime=handle.mime)
+        up = st.file_uploader("⬆️ 上傳備份檔還原 (zip 或 CSV)", type=["zip", "csv"])
         if up and st.button("確認還原"):
-            with open(D_FILE, "wb") as f: f.write(up.getbuffer())
-            st.success("還原成功！"); st.rerun()
+            amount_issues = []
+            attachment_store.restore_forms_backup(FORMS_DB, up.name, up, issues=amount_issues)
+            if amount_issues: st.warning(f"⚠️ 表單已還原，但有 {len(amount_issues)} 個金額無法辨識，已記為 0，請手動更正：\n" + "\n".join(f"- {fid}｜{col}：{raw}" for fid, col, raw in amount_issues[:20]))
+            else: st.success("還原成功！"); st.rerun()
 
 # ================= 全域預覽 =================
 if st.session_state.view_id:
-    st.divider(); r = load_data(); r = r[r["單號"]==st.session_state.view_id].iloc[0]
+    st.divider(); r = pd.Series(form_store.get_form(FORMS_DB, st.session_state.view_id))
     if st.button("❌ 關閉預覽"): st.session_state.view_id = None; st.rerun()
     st.markdown(render_html(r), unsafe_allow_html=True)
     if r.get("影像Base64"):
-        for f_b64 in r["影像Base64"].split('|'):
+        for raw in attachment_store.load_cell(r["影像Base64"]):
             try:
-                raw = base64.b64decode(f_b64)
-                if raw.startswith(b'PK\x03\x04'): st.write("📊 Excel 內容："); st.dataframe(pd.read_excel(io.BytesIO(raw)))
+                if excel_preview.is_excel(raw): st.write("📊 Excel 內容："); st.dataframe(excel_preview.snapshot(raw).frame)
                 else: st.image(raw)
             except: st.error("附件解析失敗")
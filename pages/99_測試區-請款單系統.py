@@ -8,6 +8,13 @@ import requests
 import json
 import io
 import threading
+import form_store
+import excel_preview
+import data_cache
+import avatar_store
+import export_store
+import atomic_io
+import presence
 from ai_assistant import render_ai_operations_assistant
 from mobile_camera import mobile_camera_input
 
@@ -302,15 +309,19 @@ st.sidebar.markdown("<h2 class='时研logo'>時研國際設計股份有限公司
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 B_DIR = os.path.dirname(CURRENT_DIR) 
 D_FILE = os.path.join(B_DIR, "demo_database.csv")
+FORMS_DB = os.path.join(B_DIR, "demo_forms.db")
 S_FILE = os.path.join(B_DIR, "demo_staff.csv")
 PROD_S_FILE = os.path.join(B_DIR, "staff_v2.csv")
-O_FILE = os.path.join(B_DIR, "demo_online.csv")
+O_FILE = os.path.join(B_DIR, "demo_online_heartbeat.tsv")
 L_FILE = os.path.join(B_DIR, "demo_line_credentials.txt") 
 G_FILE = os.path.join(B_DIR, "demo_github_credentials.txt") 
 
 P_FILE = os.path.join(B_DIR, "demo_projects.csv")
 V_FILE = os.path.join(B_DIR, "demo_vendors.csv")
 
+# 測試區表單同樣存於 SQLite；第一次開啟時自動匯入 demo_database.csv
+form_store.open_store(FORMS_DB, D_FILE)
+
 # =========================================================================
 # ★ 測試區專屬預設參數 (寫死在這裡，確保雲端重啟後絕對不會遺失！) ★
 # =========================================================================
@@ -393,16 +404,18 @@ def get_fallback_date(r):
         return f"{d[:4]}-{d[4:6]}-{d[6:]}"
     return "2026-03-18"
 
+# ★ 在線名單改由 presence 在記憶體維護、各工作階段共用；心跳檔只偶爾附加一行，不再每次點擊都改寫檔案
+ONLINE = presence.registry(O_FILE)
+SYS_NAME = "測試區"
+
 def get_online_users(curr_user):
-    try:
-        now = time.time()
-        df = pd.read_csv(O_FILE) if os.path.exists(O_FILE) else pd.DataFrame(columns=["user", "time"])
-        df = df[df["user"] != curr_user]
-        df = pd.concat([df, pd.DataFrame([{"user": curr_user, "time": now}])], ignore_index=True)
-        df = df[now - pd.to_numeric(df["time"], errors='coerce').fillna(0) <= 300]
-        df.to_csv(O_FILE, index=False); return len(df["user"].unique())
+    try: ONLINE.touch(SYS_NAME, curr_user); return max(ONLINE.count(), 1)
     except: return 1
 
+def system_online_counts():
+    try: return ONLINE.counts()
+    except: return {}
+
 def get_line_credentials():
     if os.path.exists(L_FILE):
         try:
@@ -424,7 +437,7 @@ def save_line_credentials(token, user_id):
     try:
         enc_t = base64.b64encode(token.strip().encode()).decode() if token.strip() else ""
         enc_u = base64.b64encode(user_id.strip().encode()).decode() if user_id.strip() else ""
-        with open(L_FILE, "w", encoding="utf-8") as f: f.write(f"b64:{enc_t}\nb64:{enc_u}")
+        atomic_io.write_text(L_FILE, f"b64:{enc_t}\nb64:{enc_u}")
         sync_to_github(L_FILE)
     except: pass
 
@@ -436,39 +449,53 @@ def send_line_message(msg):
             requests.post("https://api.line.me/v2/bot/message/broadcast", headers={"Content-Type": "application/json", "Authorization": f"Bearer {token}"}, json={"messages": [{"type": "text", "text": msg}]}, timeout=5)
         except: pass
 
+# ★ 編碼只偵測一次、單次解析（與正式區共用 data_cache 的讀取器）
 def read_csv_robust(filepath):
-    if not os.path.exists(filepath): return None
-    for enc in ['utf-8-sig', 'utf-8', 'cp950', 'big5']:
-        try: return pd.read_csv(filepath, encoding=enc, dtype=str).fillna("")
-        except: continue
-    return pd.DataFrame()
+    return data_cache.read_csv_file(filepath)
 
 def load_data():
-    cols = ["單號", "日期", "類型", "申請人", "代申請人", "專案負責人", "專案名稱", "專案編號", "請款說明", "總金額", "幣別", "付款方式", "請款廠商", "匯款帳戶", "帳戶影像Base64", "狀態", "影像Base64", "提交時間", "申請人信箱", "初審人", "初審時間", "複審人", "複審時間", "刪除人", "刪除時間", "刪除原因", "駁回原因", "匯款狀態", "匯款日期", "支付條件", "支付期數", "請款狀態", "已請款金額", "尚未請款金額", "最後採購金額"]
-    df = read_csv_robust(D_FILE)
-    if df is None or df.empty: return pd.DataFrame(columns=cols)
-    try:
-        df.columns = [c.strip() for c in df.columns]
-        if "專案執行人" in df.columns: df = df.rename(columns={"專案執行人": "專案負責人"})
-        for c in cols:
-            if c not in df.columns: df[c] = ""
-        for c in ["總金額", "已請款金額", "尚未請款金額"]:
-            df[c] = df[c].apply(clean_amount)
-            
-        # 廣泛性修復：若不小心將 LINE 通知文字貼到狀態欄
-        if "狀態" in df.columns:
-            df.loc[df["狀態"].astype(str).str.contains("需要財務長", na=False), "狀態"] = "待複審"
-            df.loc[df["狀態"].astype(str).str.contains("需要執行長", na=False), "狀態"] = "待簽核"
-
-        return df[cols]
-    except:
-        return pd.DataFrame(columns=cols)
+    try: df = form_store.load_forms(FORMS_DB)
+    except: return pd.DataFrame(columns=form_store.FORM_COLUMNS)
+    # 廣泛性修復：若不小心將 LINE 通知文字貼到狀態欄
+    df.loc[df["狀態"].str.contains("需要財務長", na=False), "狀態"] = "待複審"
+    df.loc[df["狀態"].str.contains("需要執行長", na=False), "狀態"] = "待簽核"
+    return df
 
 def save_data(df):
     try: 
-        df.reset_index(drop=True).to_csv(D_FILE, index=False, encoding='utf-8-sig')
-        sync_to_github(D_FILE) 
-    except: st.error("⚠️ 檔案鎖定中！請關閉測試區的 demo_database.csv。"); st.stop()
+        form_store.save_frame(FORMS_DB, df)
+        sync_to_github(FORMS_DB) 
+    except Exception as e: st.error(f"⚠️ 測試區資料庫寫入失敗！錯誤：{e}"); st.stop()
+
+# ★ 簽核關卡：待簽核／待初審 →（執行長初審）→ 待複審 →（財務長複審）→ 已核准
+SIGN_STEPS = {"EXE": (("待簽核", "待初審"), "待複審", "初審"), "CFO": (("待複審",), "已核准", "複審")}
+
+def can_sign_form(row, actor):
+    if not is_active or actor == "Anita": return False
+    return clean_name(row["專案負責人"]) == actor if row["狀態"] in SIGN_STEPS["EXE"][0] else actor == CFO_NAME
+
+# ★ 批次／單筆簽核與駁回共用：一次交易內檢查狀態與權限並更新，回傳 {單號: 結果}
+def bulk_transition(ids, from_states, to_state, actor, fields):
+    try:
+        results = form_store.transition_forms(FORMS_DB, ids, from_states, to_state, fields, allowed=lambda row: can_sign_form(row, actor))
+    except Exception as e: st.error(f"⚠️ 測試區資料庫寫入失敗！錯誤：{e}"); st.stop()
+    done = [i for i, res in results.items() if res == "ok"]
+    if done: sync_to_github(FORMS_DB)
+    if done and to_state == "待複審":
+        sys_name = st.session_state.get('sys_choice', '請款單系統')
+        for _, r in form_store.load_forms(FORMS_DB, columns=["單號", "專案名稱"], where={"單號": done}).iterrows():
+            send_line_message(f"🔔【[測試區]待簽核提醒】\n系統：{sys_name}\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n執行長已核准，有一筆表單需要財務長 ({CFO_NAME}) 進行簽核！")
+    return results
+
+def sign_forms(ids, sign_type, approve, reason=""):
+    from_states, next_state, field_prefix = SIGN_STEPS[sign_type]
+    fields = {f"{field_prefix}人": curr_name, f"{field_prefix}時間": get_taiwan_time()}
+    if not approve: next_state = "已駁回"; fields["駁回原因"] = reason
+    results = bulk_transition(ids, list(from_states), next_state, curr_name, fields)
+    skipped = {"missing": "找不到單號", "wrong_state": "狀態已變更", "denied": "無簽核權限"}
+    for fid, res in results.items():
+        if res != "ok": st.warning(f"⚠️ {fid} 未處理：{skipped.get(res, res)}")
+    return sum(res == "ok" for res in results.values())
 
 def load_staff():
     # 測試區首次使用時，以正式人員資料（含目前真實密碼）作為唯讀初始基準。
@@ -488,7 +515,7 @@ def load_staff():
             updated_passwords = df["name"].map(password_map).fillna(df["password"])
             if not updated_passwords.equals(df["password"]):
                 df["password"] = updated_passwords
-                df.to_csv(S_FILE, index=False, encoding="utf-8-sig")
+                atomic_io.write_csv(df, S_FILE)
     default_roles = {"Andy": "執行長", "Charles": "執行長&財務長", "Eason": "執行長", "Sunglin": "執行長", "Anita": "管理員"}
     
     if df is None or df.empty: 
@@ -509,39 +536,40 @@ def load_staff():
     return df
 
 def save_staff(df): 
-    df.reset_index(drop=True).to_csv(S_FILE, index=False, encoding='utf-8-sig')
+    atomic_io.write_csv(df.reset_index(drop=True), S_FILE)
     sync_to_github(S_FILE) 
 
 def load_projects():
     if not os.path.exists(P_FILE):
-        pd.DataFrame(columns=["負責執行長", "專案名稱", "專案編號"]).to_csv(P_FILE, index=False, encoding='utf-8-sig')
+        atomic_io.write_csv(pd.DataFrame(columns=["負責執行長", "專案名稱", "專案編號"]), P_FILE)
     return read_csv_robust(P_FILE)
 
 def save_projects(df):
-    df.to_csv(P_FILE, index=False, encoding='utf-8-sig')
+    atomic_io.write_csv(df, P_FILE)
     sync_to_github(P_FILE) 
 
 def load_vendors():
     if not os.path.exists(V_FILE):
-        pd.DataFrame(columns=["請款廠商", "匯款帳戶"]).to_csv(V_FILE, index=False, encoding='utf-8-sig')
+        atomic_io.write_csv(pd.DataFrame(columns=["請款廠商", "匯款帳戶"]), V_FILE)
     return read_csv_robust(V_FILE)
 
 def save_vendors(df):
-    df.to_csv(V_FILE, index=False, encoding='utf-8-sig')
+    atomic_io.write_csv(df, V_FILE)
     sync_to_github(V_FILE) 
 
-# --- 4. 請款單資料打包解析器 ---
-def parse_req_json(desc_raw):
-    try:
-        if "[請款單資料]" in desc_raw:
-            return json.loads(desc_raw.split("[請款單資料]")[1].strip())
-    except: pass
-    return {"desc": desc_raw, "net_amt": 0, "tax_amt": 0, "fee": 0, "inv_no": "", "acc_name": "", "ims_names": []}
+# --- 4. 請款單資料 ---
+# ★ 金額、發票與附件名稱在存檔時已由 form_store 從打包的請款說明展開成欄位，這裡直接讀欄位，不再解析 JSON
+def req_fields(row):
+    names = safe_str(row.get("憑證附件名稱"))
+    return {"desc": safe_str(row.get("說明內容")), "net_amt": clean_amount(row.get("未稅金額")), "tax_amt": clean_amount(row.get("稅額")), "fee": clean_amount(row.get("手續費")), "inv_no": safe_str(row.get("發票號碼")), "acc_name": safe_str(row.get("帳戶附件名稱")), "ims_names": names.split(form_store.NAME_SEPARATOR) if names else []}
+
+def pack_req_json(fields):
+    return form_store.REQUEST_MARK + "\n" + json.dumps(fields, ensure_ascii=False)
 
 # --- 5. HTML 渲染 ---
 def render_html(row):
     amt = clean_amount(row['總金額'])
-    data = parse_req_json(row.get("請款說明", ""))
+    data = req_fields(row)
     
     app_name = safe_str(row.get('申請人'))
     proxy_name = safe_str(row.get('代申請人'))
@@ -609,6 +637,20 @@ def render_html(row):
     h += f'<p style="font-size:15px;margin-top:20px;line-height:1.6;">提交: {s_submit} | 初審: {s_first} | 複審: {s_second}</p></div>'
     return h
 
+# ★ Excel 附件依內容雜湊快取前 1000 列與列印用 HTML，大檔分頁顯示，不再每次重新解析整本活頁簿
+def set_excel_page(key, page): st.session_state[key] = page
+
+def render_excel_preview(raw, key):
+    page = st.session_state.get(key, 0)
+    try: pv = excel_preview.preview(raw, page)
+    except Exception: st.error("⚠️ 無法預覽此 Excel。請確保 requirements.txt 包含 openpyxl。"); return
+    st.dataframe(pv.frame, use_container_width=True)
+    if page or pv.has_more:
+        c_prev, c_info, c_next = st.columns([1, 2, 1])
+        c_prev.button("⬅️ 上一頁", key=f"{key}_prev", disabled=page == 0, on_click=set_excel_page, args=(key, page - 1))
+        c_info.caption(f"第 {pv.start + 1:,}–{pv.start + len(pv.frame):,} 列")
+        c_next.button("下一頁 ➡️", key=f"{key}_next", disabled=not pv.has_more, on_click=set_excel_page, args=(key, page + 1))
+
 def render_inline_preview(r, prefix_key):
     with st.container():
         st.markdown(f"#### 🔍 單號 {r['單號']} 預覽 (測試區)")
@@ -630,11 +672,7 @@ def render_inline_preview(r, prefix_key):
                 try:
                     pad = f_b64 + "=" * ((4 - len(f_b64) % 4) % 4)
                     raw = base64.b64decode(pad)
-                    if raw.startswith(b'PK\x03\x04') or raw.startswith(b'\xd0\xcf\x11\xe0'):
-                        try:
-                            st.dataframe(pd.read_excel(io.BytesIO(raw)), use_container_width=True)
-                        except:
-                            st.error("⚠️ 無法預覽此 Excel。請確保 requirements.txt 包含 openpyxl。")
+                    if excel_preview.is_excel(raw): render_excel_preview(raw, f"xls_{prefix_key}_{idx}")
                     else: st.image(raw, use_container_width=True)
                 except Exception: pass 
         
@@ -664,11 +702,7 @@ def render_html_with_attachments(row):
                 raw = base64.b64decode(pad)
                 if raw.startswith(b'PK\x03\x04') or raw.startswith(b'\xd0\xcf\x11\xe0'):
                     try:
-                        df_ex = pd.read_excel(io.BytesIO(raw))
-                        html_table = df_ex.to_html(index=False).replace('\n', '')
-                        css_rules = "<style>.xls-tbl { width: 100%; border-collapse: collapse; font-size: 11px; table-layout: fixed; } .xls-tbl th, .xls-tbl td { border: 1px solid #000; padding: 4px; word-wrap: break-word; overflow-wrap: break-word; white-space: normal; word-break: break-all; } .xls-tbl th { background-color: #f0f0f0; } .xls-tbl tr { page-break-inside: avoid !important; }</style>"
-                        html_table = html_table.replace('<table', f'{css_rules}<table class="xls-tbl"')
-                        h += f"{html_table}<br><br>"
+                        h += f"{excel_preview.print_html(raw)}<br><br>"
                     except Exception as e:
                         h += f"<div style='color:red;'>⚠️ Excel轉換列印失敗。請確保您的 GitHub `requirements.txt` 中已加入 `openpyxl` 套件。</div><br>"
                 else:
@@ -693,7 +727,7 @@ def render_upload_popover(container, r, prefix):
             cam_acc = mobile_camera_input("拍攝存摺／帳戶", key=f"{prefix}_cam_a_{st.session_state[cam_reset_key]}")
             if cam_acc and st.button("🔄 重新拍攝存摺／帳戶", key=f"{prefix}_cam_a_retake"):
                 st.session_state[cam_reset_key] += 1; st.rerun()
-            cam_ims = mobile_camera_input("拍攝憑證", key=f"{prefix}_cam_i_{st.session_state[cam_reset_key]}")
+            cam_ims = mobile_camera_input("拍攝憑證", key=f"{prefix}_cam_i_{st.session_state[cam_reset_key]}", allow_grayscale=True)
             if cam_ims and st.button("🔄 重新拍攝憑證", key=f"{prefix}_cam_i_retake"):
                 st.session_state[cam_reset_key] += 1; st.rerun()
         nf_acc = cam_acc or nf_acc
@@ -701,7 +735,7 @@ def render_upload_popover(container, r, prefix):
         if cam_ims: nf_ims.append(cam_ims)
         if st.button("💾 儲存附件", key=f"{prefix}_b"):
             fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-            jd = parse_req_json(fresh_db.at[idx, "請款說明"])
+            jd = req_fields(fresh_db.loc[idx])
             
             if nf_acc: 
                 fresh_db.at[idx, "帳戶影像Base64"] = base64.b64encode(nf_acc.getvalue()).decode()
@@ -711,7 +745,7 @@ def render_upload_popover(container, r, prefix):
                 jd["ims_names"] = [f.name for f in nf_ims]
             
             if nf_acc or nf_ims:
-                packed_desc = "[請款單資料]\n" + json.dumps(jd, ensure_ascii=False)
+                packed_desc = pack_req_json(jd)
                 fresh_db.at[idx, "請款說明"] = packed_desc
                 save_data(fresh_db); st.rerun()
 
@@ -760,20 +794,23 @@ role_map_display = {
 display_title = role_map_display.get(curr_name, curr_role)
 display_name_text = f"{curr_name} - {display_title}"
 
-avatar_b64 = ""
-try: avatar_b64 = st.session_state.staff_df[st.session_state.staff_df["name"] == curr_name].iloc[0].get("avatar", "")
+# ★ 只在側邊欄顯示時讀取目前使用者的大頭貼縮圖
+avatar_src = ""
+try: avatar_src = avatar_store.avatar_url(st.session_state.staff_df[st.session_state.staff_df["name"] == curr_name].iloc[0].get("avatar", ""))
 except: pass
 
-if avatar_b64: st.sidebar.markdown(f'<div style="display:flex;align-items:center;gap:12px;margin-bottom:15px;"><img src="data:image/jpeg;base64,{avatar_b64}" style="width:60px;height:60px;border-radius:50%;object-fit:cover;border:3px solid #eee;"><span style="font-size:20px;font-weight:bold;color:white;">{display_name_text}</span></div>', unsafe_allow_html=True)
+if avatar_src: st.sidebar.markdown(f'<div style="display:flex;align-items:center;gap:12px;margin-bottom:15px;"><img src="{avatar_src}" style="width:60px;height:60px;border-radius:50%;object-fit:cover;border:3px solid #eee;"><span style="font-size:20px;font-weight:bold;color:white;">{display_name_text}</span></div>', unsafe_allow_html=True)
 else: st.sidebar.markdown(f"### 👤 <span style='color:white;'>{display_name_text}</span>", unsafe_allow_html=True)
 
-st.sidebar.info(f"🟢 目前在線人數：**{get_online_users(curr_name)}** 人")
+online_count = get_online_users(curr_name)
+online_by_system = "｜".join(f"{k} {v} 人" for k, v in system_online_counts().items())
+st.sidebar.info(f"🟢 目前在線人數：**{online_count}** 人" + (f"\n\n{online_by_system}" if online_by_system else ""))
 
 with st.sidebar.expander("📸 修改大頭貼"):
     new_avatar = st.file_uploader("上傳圖片", type=["jpg", "png"], key="req_side_avatar")
     if st.button("更新大頭貼", key="req_update_avatar") and new_avatar:
         s_df = load_staff(); idx = s_df[s_df["name"] == curr_name].index[0]
-        s_df.at[idx, "avatar"] = base64.b64encode(new_avatar.getvalue()).decode()
+        s_df.at[idx, "avatar"] = avatar_store.store_avatar(new_avatar.getvalue())
         save_staff(s_df); st.session_state.staff_df = s_df; st.rerun()
 
 with st.sidebar.expander("🔐 修改我的密碼"):
@@ -944,26 +981,18 @@ if st.session_state.get('req_review_id'):
         
         if c_btn2.button("✅ 確認核准", disabled=not can_sign):
             st.session_state.req_edit_id = None 
-            fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-            if sign_type == "EXE":
-                fresh_db.loc[idx, ["狀態", "初審人", "初審時間"]] = ["待複審", curr_name, get_taiwan_time()]
-                sys_name = st.session_state.get('sys_choice', '請款單系統')
-                send_line_message(f"🔔【[測試區]待簽核提醒】\n系統：{sys_name}\n單號：{r['單號']}\n專案名稱：{r['專案名稱']}\n執行長已核准，有一筆表單需要財務長 ({CFO_NAME}) 進行簽核！")
-            else:
-                fresh_db.loc[idx, ["狀態", "複審人", "複審時間"]] = ["已核准", curr_name, get_taiwan_time()]
-            save_data(fresh_db); st.success("已核准！"); time.sleep(0.5)
-            st.session_state.req_review_id = None; st.rerun()
+            if sign_forms([r["單號"]], sign_type, approve=True):
+                st.success("已核准！"); time.sleep(0.5)
+                st.session_state.req_review_id = None; st.rerun()
             
         if can_sign:
             with c_btn3.popover("❌ 駁回單據"):
                 reason = st.text_input("請輸入駁回原因")
                 if st.button("確認駁回", key="btn_rej_conf"):
                     st.session_state.req_edit_id = None 
-                    fresh_db = load_data(); idx = fresh_db[fresh_db["單號"]==r["單號"]].index[0]
-                    field_prefix = "初審" if sign_type == "EXE" else "複審"
-                    fresh_db.loc[idx, ["狀態", "駁回原因", f"{field_prefix}人", f"{field_prefix}時間"]] = ["已駁回", reason, curr_name, get_taiwan_time()]
-                    save_data(fresh_db); st.success("已駁回！"); time.sleep(0.5)
-                    st.session_state.req_review_id = None; st.rerun()
+                    if sign_forms([r["單號"]], sign_type, approve=False, reason=reason):
+                        st.success("已駁回！"); time.sleep(0.5)
+                        st.session_state.req_review_id = None; st.rerun()
         else:
             c_btn3.button("❌ 駁回單據", disabled=True)
 
@@ -981,15 +1010,11 @@ if st.session_state.get('req_review_id'):
                 if c.startswith('data:'): c = c.split('base64,')[-1]
                 if c: all_files.append(c)
         if all_files:
-            for f_b64 in all_files:
+            for idx, f_b64 in enumerate(all_files):
                 try:
                     pad = f_b64 + "=" * ((4 - len(f_b64) % 4) % 4)
                     raw = base64.b64decode(pad)
-                    if raw.startswith(b'PK\x03\x04') or raw.startswith(b'\xd0\xcf\x11\xe0'):
-                        try:
-                            st.dataframe(pd.read_excel(io.BytesIO(raw)), use_container_width=True)
-                        except:
-                            st.error("⚠️ 無法預覽此 Excel。請確保 requirements.txt 包含 openpyxl。")
+                    if excel_preview.is_excel(raw): render_excel_preview(raw, f"xls_review_{r['單號']}_{idx}")
                     else: st.image(raw, use_container_width=True)
                 except Exception: pass 
 
@@ -1029,21 +1054,8 @@ else:
             
             if batch_c1.button(f"✅ 確認核准 (已選 {len(selected_ids)} 筆)", disabled=is_btn_disabled, key=f"bat_ok_{sign_type}"):
                 st.session_state.req_edit_id = None 
-                fresh_db = load_data()
-                success_count = 0
-                for sel_id in selected_ids:
-                    r_match = df_list[df_list["單號"] == sel_id].iloc[0]
-                    if (r_match["專案負責人"] == curr_name if sign_type == "EXE" else curr_name == CFO_NAME) and is_active and curr_name != "Anita":
-                        idx = fresh_db[fresh_db["單號"]==sel_id].index[0]
-                        if sign_type == "EXE":
-                            fresh_db.loc[idx, ["狀態", "初審人", "初審時間"]] = ["待複審", curr_name, get_taiwan_time()]
-                            sys_name = st.session_state.get('sys_choice', '請款單系統')
-                            send_line_message(f"🔔【[測試區]待簽核提醒】\n系統：{sys_name}\n單號：{sel_id}\n專案名稱：{r_match['專案名稱']}\n執行長已核准，有一筆表單需要財務長 ({CFO_NAME}) 進行簽核！")
-                        else:
-                            fresh_db.loc[idx, ["狀態", "複審人", "複審時間"]] = ["已核准", curr_name, get_taiwan_time()]
-                        success_count += 1
-                if success_count > 0:
-                    save_data(fresh_db); st.success(f"成功核准 {success_count} 筆單據！"); time.sleep(1); st.rerun()
+                n_done = sign_forms(selected_ids, sign_type, approve=True)
+                if n_done: st.success(f"成功核准 {n_done} 筆單據！"); time.sleep(1); st.rerun()
 
             if is_btn_disabled:
                 batch_c2.button(f"❌ 駁回單據 (已選 {len(selected_ids)} 筆)", disabled=True, key=f"fake_rej_{sign_type}")
@@ -1052,17 +1064,8 @@ else:
                     reason = st.text_input("請統一輸入駁回原因", key=f"rej_batch_{sign_type}")
                     if st.button("確認批次駁回"):
                         st.session_state.req_edit_id = None 
-                        fresh_db = load_data()
-                        success_count = 0
-                        for sel_id in selected_ids:
-                            r_match = df_list[df_list["單號"] == sel_id].iloc[0]
-                            if (r_match["專案負責人"] == curr_name if sign_type == "EXE" else curr_name == CFO_NAME) and is_active and curr_name != "Anita":
-                                idx = fresh_db[fresh_db["單號"]==sel_id].index[0]
-                                field_prefix = "初審" if sign_type == "EXE" else "複審"
-                                fresh_db.loc[idx, ["狀態", "駁回原因", f"{field_prefix}人", f"{field_prefix}時間"]] = ["已駁回", reason, curr_name, get_taiwan_time()]
-                                success_count += 1
-                        if success_count > 0:
-                            save_data(fresh_db); st.success(f"成功駁回 {success_count} 筆單據！"); time.sleep(1); st.rerun()
+                        n_done = sign_forms(selected_ids, sign_type, approve=False, reason=reason)
+                        if n_done: st.success(f"成功駁回 {n_done} 筆單據！"); time.sleep(1); st.rerun()
                         
             st.write("👉 **或選擇單號進入專屬簽核視窗：**")
             col_sel, col_btn_v, _ = st.columns([2.5, 2.5, 5])
@@ -1154,7 +1157,7 @@ else:
         if st.session_state.req_edit_id:
             match_r = db[db["單號"]==st.session_state.req_edit_id]
             if not match_r.empty:
-                r = match_r.iloc[0]; jd = parse_req_json(r["請款說明"])
+                r = match_r.iloc[0]; jd = req_fields(r)
                 legacy_net = clean_amount(r["總金額"]) if jd.get("net_amt", 0) == 0 and jd.get("tax_amt", 0) == 0 else jd.get("net_amt", 0)
                 dv.update({"app": r["申請人"], "pn": r["專案名稱"], "pi": r["專案編號"], "exe": r["專案負責人"], "net_amt": legacy_net, "tax_amt": jd.get("tax_amt", 0), "desc": jd.get("desc", ""), "ib64": r["影像Base64"], "cur": r.get("幣別","TWD"), "ab64": r["帳戶影像Base64"], "vdr": r.get("請款廠商",""), "acc": r.get("匯款帳戶",""), "pay": r.get("付款方式","匯款(扣30手續費)"), "inv_no": jd.get("inv_no", ""), "acc_name": jd.get("acc_name", ""), "ims_names": jd.get("ims_names", [])})
 
@@ -1221,7 +1224,7 @@ else:
                 cam_acc = mobile_camera_input("拍攝存摺／帳戶", key=f"req_cam_acc_{up_key}_{st.session_state[cam_reset_key]}")
                 if cam_acc and st.button("🔄 重新拍攝存摺／帳戶", key=f"req_cam_acc_retake_{up_key}"):
                     st.session_state[cam_reset_key] += 1; st.rerun()
-                cam_ims = mobile_camera_input("拍攝憑證", key=f"req_cam_ims_{up_key}_{st.session_state[cam_reset_key]}")
+                cam_ims = mobile_camera_input("拍攝憑證", key=f"req_cam_ims_{up_key}_{st.session_state[cam_reset_key]}", allow_grayscale=True)
                 if cam_ims and st.button("🔄 重新拍攝憑證", key=f"req_cam_ims_retake_{up_key}"):
                     st.session_state[cam_reset_key] += 1; st.rerun()
             f_acc = cam_acc or f_acc
@@ -1290,7 +1293,7 @@ else:
                     final_ims_list = retained_ims + new_ims_b64
                     final_names_list = retained_names + new_ims_names
                     b_ims = "|".join(final_ims_list)
-                    packed_desc = "[請款單資料]\n" + json.dumps({"net_amt": net_amt, "tax_amt": tax_amt, "fee": fee, "inv_no": inv_no, "desc": desc, "acc_name": acc_name_save, "ims_names": final_names_list}, ensure_ascii=False)
+                    packed_desc = pack_req_json({"net_amt": net_amt, "tax_amt": tax_amt, "fee": fee, "inv_no": inv_no, "desc": desc, "acc_name": acc_name_save, "ims_names": final_names_list})
                     f_db = load_data(); proxy_app = curr_name if (curr_name == "Anita" and app_val != curr_name) else ""
                     
                     if st.session_state.req_edit_id:
@@ -1298,7 +1301,7 @@ else:
                         f_db.loc[idx, ["申請人", "代申請人", "專案名稱", "專案編號", "專案負責人", "總金額", "請款說明", "請款廠商", "匯款帳戶", "付款方式", "影像Base64", "帳戶影像Base64", "幣別", "狀態"]] = [app_val, proxy_app, pn, pi, exe, total_amt, packed_desc, vdr, acc, pay, b_ims, b_acc, curr, "已存檔未提交"]
                         tid = st.session_state.req_edit_id; msg_prefix = "修改完畢並存檔"
                     else:
-                        tid = f"{datetime.date.today().strftime('%Y%m%d')}-{len(f_db[f_db['單號'].str.startswith(datetime.date.today().strftime('%Y%m%d'))])+1:02d}"
+                        tid = form_store.new_form_id(FORMS_DB, datetime.date.today().strftime('%Y%m%d'))
                         nr = {"單號":tid, "日期":str(datetime.date.today()), "類型":"請款單", "申請人":app_val, "代申請人":proxy_app, "專案負責人":exe, "專案名稱":pn, "專案編號":pi, "請款說明":packed_desc, "總金額":total_amt, "幣別":curr, "請款廠商":vdr, "匯款帳戶":acc, "付款方式":pay, "狀態":"已存檔未提交", "影像Base64":b_ims, "帳戶影像Base64":b_acc}
                         f_db = pd.concat([f_db, pd.DataFrame([nr])], ignore_index=True); msg_prefix = "存檔成功"
                     
@@ -1546,13 +1549,13 @@ else:
 
                             for idx, row_id in enumerate(selected_rows["單號"], 1):
                                 row = req_db[req_db["單號"] == row_id].iloc[0]
-                                jd = parse_req_json(str(row.get("請款說明", "")))
-                                reason = jd.get("desc", str(row.get("請款說明", ""))).replace("\n", " ")
+                                jd = req_fields(row)
+                                reason = jd["desc"].replace("\n", " ")
                                 amt = float(clean_amount(row.get("總金額", 0)))
                                 pay_method_raw = str(row.get("付款方式", ""))
                                 if "匯款" in pay_method_raw:
                                     pay_method = "匯款"
-                                    fee = float(jd.get("fee", 15.0 if "扣" in pay_method_raw else 0.0))
+                                    fee = float(jd["fee"]) if form_store.REQUEST_MARK in str(row.get("請款說明", "")) else (15.0 if "扣" in pay_method_raw else 0.0)
                                 elif "現金" in pay_method_raw or "零用金" in pay_method_raw:
                                     pay_method = "現金"
                                     fee = 0.0
@@ -1647,7 +1650,7 @@ else:
                     if not clean_token or not clean_repo: st.error("❌ 請輸入有效的 Token 與倉庫名稱。")
                     else:
                         encoded_token = base64.b64encode(clean_token.encode()).decode()
-                        with open(G_FILE, "w", encoding="utf-8") as f: f.write(f"{encoded_token}\n{clean_repo}")
+                        atomic_io.write_text(G_FILE, f"{encoded_token}\n{clean_repo}")
                         try:
                             url = f"https://api.github.com/repos/{clean_repo}"; headers = {"Authorization": f"token {clean_token}"}
                             res = requests.get(url, headers=headers, timeout=5)
@@ -1658,7 +1661,7 @@ else:
                 st.markdown("---"); st.write("💡 **如果您的舊單據或人員密碼還沒上傳到 GitHub，請點擊下方按鈕強制備份：**")
                 if c_btn2.button("🚀 一鍵強制同步所有資料至 GitHub"):
                     with st.spinner("正在將所有資料（包含舊單據與密碼）傳送至 GitHub，請稍候..."):
-                        if os.path.exists(D_FILE): sync_to_github(D_FILE)
+                        if os.path.exists(FORMS_DB): sync_to_github(FORMS_DB)
                         if os.path.exists(S_FILE): sync_to_github(S_FILE)
                         if os.path.exists(P_FILE): sync_to_github(P_FILE)
                         if os.path.exists(V_FILE): sync_to_github(V_FILE)
@@ -1687,15 +1690,12 @@ else:
                 col_down, col_up = st.columns(2)
                 with col_down:
                     st.write("⬇️ **步驟一：下載最新表單資料庫**")
-                    if os.path.exists(D_FILE):
-                        with open(D_FILE, "rb") as f: st.download_button("下載表單備份檔", f, file_name=f"時研系統表單備份(測試區)_{datetime.date.today()}.csv", mime="text/csv")
-                    else:
-                        st.download_button("下載表單備份檔", data=load_data().to_csv(index=False, encoding='utf-8-sig'), file_name=f"時研系統表單備份(測試區)_{datetime.date.today()}.csv", mime="text/csv")
+                    st.download_button("下載表單備份檔", data=form_store.export_csv(FORMS_DB), file_name=f"時研系統表單備份(測試區)_{datetime.date.today()}.csv", mime="text/csv")
                 with col_up:
                     st.write("⬆️ **步驟二：還原表單資料庫**")
                     up_db = st.file_uploader("上傳表單 CSV 檔", type=["csv"], key="up_db", label_visibility="collapsed")
                     if up_db and st.button("確認還原表單"):
-                        with open(D_FILE, "wb") as f: f.write(up_db.getbuffer())
+                        form_store.import_csv(FORMS_DB, up_db.getvalue(), replace=True); sync_to_github(FORMS_DB)
                         st.success("表單資料庫已還原！"); time.sleep(1); st.rerun()
                     
             with st.expander("👥 2. 人員與大頭貼資料備份與還原"):
@@ -1703,14 +1703,18 @@ else:
                 with col_down2:
                     st.write("⬇️ **步驟一：下載最新人員資料 (含大頭貼與LINE ID)**")
                     if os.path.exists(S_FILE):
-                        with open(S_FILE, "rb") as f: st.download_button("下載人員備份檔", f, file_name=f"時研系统人員備份(測試區)_{datetime.date.today()}.csv", mime="text/csv")
+                        # ★ 名單只存大頭貼代號，備份為 zip（名單 CSV + 大頭貼檔）
+                        if st.button("產生人員備份檔"):
+                            handle, zip_path = export_store.create(f"時研系統人員備份(測試區)_{datetime.date.today()}.zip", "application/zip")
+                            avatar_store.export_staff_zip(S_FILE, zip_path)
+                            with export_store.open_export(handle) as f: st.download_button("下載人員備份檔", f, file_name=handle.name, mime=handle.mime)
                     else:
                         st.download_button("下載人員備份檔", data=load_staff().to_csv(index=False, encoding='utf-8-sig'), file_name=f"時研系统人員備份(測試區)_{datetime.date.today()}.csv", mime="text/csv")
                 with col_up2:
                     st.write("⬆️ **步驟二：還原人員資料**")
-                    uploaded_staff = st.file_uploader("上傳人員 CSV 檔", type=["csv"], key="up_staff", label_visibility="collapsed")
+                    uploaded_staff = st.file_uploader("上傳人員備份檔 (zip 或 CSV)", type=["zip", "csv"], key="up_staff", label_visibility="collapsed")
                     if uploaded_staff and st.button("確認還原人員資料"):
-                        with open(S_FILE, "wb") as f: f.write(uploaded_staff.getbuffer())
+                        avatar_store.restore_staff_backup(S_FILE, uploaded_staff.name, uploaded_staff.getvalue())
                         st.session_state.staff_df = load_staff(); st.success("人員資料已還原！"); time.sleep(1); st.rerun()
 
             with st.expander("🔔 3. LINE 官方帳號推播設定 (全域 Token & 行政副本 ID)", expanded=True):
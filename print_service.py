@@ -0,0 +1,197 @@
+"""表單列印文件。
+
+列印原本在瀏覽器端把 `render_html_with_attachments` 的結果（每張照片都是 base64
+data URI）跳脫成一整段 JavaScript 字串，再 `window.open('').document.write(...)`，
+每按一次就要在瀏覽器重新組一次文件。這裡改在伺服器端產生 PDF：
+
+- 文件依表單內容（單號、版本與整列資料的雜湊）快取在 .print_cache/，內容沒變就不重產；
+  整批還原後版本歸零或重新編號也不會拿到舊文件。檔名是加上本機密鑰的雜湊
+- 照片依內容存一份在 .print_cache/assets/，文件裡只引用檔名，由 WeasyPrint（見
+  requirements.txt）從這個目錄讀取。照片（含存摺影像）不放在 Streamlit 的靜態目錄，
+  不會有不需登入就能讀取的網址
+- 多張表單可合併成一份，每張表單自成一頁
+- 頁面以下載按鈕提供快取的檔案（`PrintDocument.download`）。伺服器缺少 WeasyPrint
+  需要的系統函式庫（Pango）時改提供內嵌照片的 HTML，由瀏覽器開啟後列印；這份 HTML
+  同樣只在產生文件時組一次並快取
+- 文件、PDF 與照片都在 `PRINT_TTL` 後清除；照片每次被文件引用時會更新時間，
+  不會比引用它的文件先被清掉
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import html
+import json
+import os
+import pathlib
+import re
+import secrets
+import shutil
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, Mapping
+
+import atomic_io
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(ROOT_DIR, ".print_cache")
+ASSET_DIRNAME = "assets"
+ASSET_DIR = os.path.join(CACHE_DIR, ASSET_DIRNAME)
+# 舊版把照片與 PDF 發佈在靜態目錄（任何人都能讀取），清理時整個移除
+LEGACY_PRINT_DIR = os.path.join(ROOT_DIR, "static", "print")
+SECRET_PATH = os.path.join(ROOT_DIR, ".print_secret")
+PRINT_TTL = 7 * 24 * 3600  # 舊版本的列印文件保留一週
+_EXTENSIONS = {b"\x89PNG": "png", b"GIF8": "gif", b"%PDF": "pdf"}
+_MIME = {"png": "image/png", "gif": "image/gif", "jpg": "image/jpeg", "pdf": "application/pdf", "html": "text/html"}
+_ASSET_REF = re.compile(r'src="assets/([0-9a-f]{64}\.[a-z]+)"')
+
+_PAGE_TEMPLATE = """<!doctype html>
+<html lang="zh-Hant"><head><meta charset="utf-8"><title>{title}</title>
+<style>
+  body {{ margin: 0; background: #fff; }}
+  .print-page {{ page-break-after: always; }}
+  .print-page:last-child {{ page-break-after: auto; }}
+  @page {{ size: A4; margin: 10mm; }}
+</style></head>
+<body>
+{pages}
+</body></html>
+"""
+
+
+@dataclass
+class PrintDocument:
+    path: str
+    pdf_path: str = ""
+    standalone_path: str = ""
+
+    def html(self) -> str:
+        with open(self.path, encoding="utf-8") as f:
+            return f.read()
+
+    def download(self) -> tuple[bytes, str, str]:
+        """Return (data, file extension, mime) of the cached file to hand to the user."""
+        path, ext = (self.pdf_path, "pdf") if self.pdf_path else (self.standalone_path, "html")
+        with open(path, "rb") as f:
+            return f.read(), ext, _MIME[ext]
+
+
+def _secret() -> str:
+    try:
+        with open(SECRET_PATH, encoding="utf-8") as f:
+            value = f.read().strip()
+        if value:
+            return value
+    except OSError:
+        pass
+    value = secrets.token_hex(32)
+    with atomic_io.file_lock(SECRET_PATH):
+        if not os.path.exists(SECRET_PATH):
+            atomic_io.write_text(SECRET_PATH, value)
+        with open(SECRET_PATH, encoding="utf-8") as f:
+            return f.read().strip()
+
+
+def _document_name(key: str) -> str:
+    return hashlib.sha256(f"{_secret()}:{key}".encode("utf-8")).hexdigest()[:40]
+
+
+def _row_digest(row: Mapping[str, object]) -> str:
+    # 版本在整批還原時會重新編號，另外以整列內容區分，避免拿到還原前的舊文件
+    payload = json.dumps({str(k): str(v) for k, v in row.items()}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _purge_stale(now: float) -> None:
+    shutil.rmtree(LEGACY_PRINT_DIR, ignore_errors=True)
+    entries = []
+    for folder in (CACHE_DIR, ASSET_DIR):
+        try:
+            entries.extend(os.scandir(folder))
+        except OSError:
+            pass
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < now - PRINT_TTL:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def image_html(raw: bytes) -> str:
+    """Store an attachment image privately and return an ``<img>`` tag that references it."""
+    ext = next((e for magic, e in _EXTENSIONS.items() if raw.startswith(magic)), "jpg")
+    name = f"{hashlib.sha256(raw).hexdigest()}.{ext}"
+    path = os.path.join(ASSET_DIR, name)
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # 新文件引用時延長保留時間
+        except OSError:
+            pass
+    else:
+        os.makedirs(ASSET_DIR, exist_ok=True)
+        atomic_io.write_bytes(path, raw, lock=False)  # 內容定址，不需要鎖
+    return f'<img src="{ASSET_DIRNAME}/{name}" style="max-width:100%; margin-bottom:20px; border:none;">'
+
+
+def _embed_assets(text: str) -> str:
+    def embed(match: re.Match) -> str:
+        name = match.group(1)
+        try:
+            with open(os.path.join(ASSET_DIR, name), "rb") as f:
+                data = base64.b64encode(f.read()).decode("ascii")
+        except OSError:
+            return match.group(0)
+        return f'src="data:{_MIME.get(name.rsplit(".", 1)[-1], "image/jpeg")};base64,{data}"'
+
+    return _ASSET_REF.sub(embed, text)
+
+
+def _pdf_engine():
+    try:
+        from weasyprint import HTML
+    except (ImportError, OSError):  # 未安裝，或缺少 Pango 等系統函式庫
+        return None
+    return HTML
+
+
+def _publish(key: str, title: str, bodies: Callable[[], Iterable[str]]) -> PrintDocument:
+    name = _document_name(key)
+    path = os.path.join(CACHE_DIR, name + ".html")
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        _purge_stale(time.time())
+        pages = "\n".join(f'<div class="print-page">{body}</div>' for body in bodies())
+        # 同一個鍵的內容相同，不需要鎖
+        atomic_io.write_bytes(path, _PAGE_TEMPLATE.format(title=html.escape(title), pages=pages).encode("utf-8"), lock=False)
+    doc = PrintDocument(path=path)
+    pdf_path = os.path.join(CACHE_DIR, name + ".pdf")
+    engine = _pdf_engine() if not os.path.exists(pdf_path) else None
+    if engine is not None:
+        try:
+            pdf = engine(string=doc.html(), base_url=pathlib.Path(CACHE_DIR).as_uri() + "/").write_pdf()
+            atomic_io.write_bytes(pdf_path, pdf, lock=False)
+        except Exception:
+            pass  # PDF 失敗時改提供可由瀏覽器列印的 HTML
+    if os.path.exists(pdf_path):
+        doc.pdf_path = pdf_path
+        return doc
+    standalone = os.path.join(CACHE_DIR, name + ".standalone.html")
+    if not os.path.exists(standalone):
+        atomic_io.write_bytes(standalone, _embed_assets(doc.html()).encode("utf-8"), lock=False)
+    doc.standalone_path = standalone
+    return doc
+
+
+def form_document(form_id: str, row: Mapping[str, object], render: Callable[[], str]) -> PrintDocument:
+    """Return the print document of one form *row*, calling *render* only when this content is not cached."""
+    return _publish(f"form:{form_id}:{_row_digest(row)}", f"請款單 {form_id}", lambda: [render()])
+
+
+def batch_document(forms: Iterable[tuple[str, Mapping[str, object]]], render: Callable[[str], str]) -> PrintDocument:
+    """Return one document holding every (form id, row) in *forms*, one form per page."""
+    forms = list(forms)
+    key = "batch:" + "|".join(f"{form_id}:{_row_digest(row)}" for form_id, row in forms)
+    title = f"請款單 {forms[0][0]} 等 {len(forms)} 筆" if forms else "請款單"
+    return _publish(key, title, lambda: [render(form_id) for form_id, _ in forms])